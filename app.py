@@ -1,72 +1,89 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import psycopg2
+import logging
 import os
-import openai
-import time
 import traceback
 
 from ajuda_drexus import ajuda
+from src import db
+from src.armazenamento import obter_armazenamento
+from src import resumo as resumo_ia
+from src import conhecimento
+from src import metricas
+from src.perguntas import nomes_longos
+from src.sensibilidade import cenario, pontos_alavanca, rotulos_perguntas, simular_cenarios
+from src.calculos import (
+    ZONA_MINIMA, ZONA_NAO_CALCULADA, ZONAS, calcular_dimensoes, calcular_medias, calcular_rexp, interpretar_rexp,
+    matrizes_respostas
+)
 
 st.set_page_config(page_title="Diagnóstico ICE³-R + DREXUS", layout="wide")
 
-def conectar_banco():
-    try:
-        conn = psycopg2.connect(os.getenv("DATABASE_URL"))
-        return conn
-    except Exception as e:
-        st.error(f"Erro ao conectar ao banco de dados: {e}")
-        st.stop()
+# Questionário: "formularios" (um formulário por variável, só o bloco aberto é montado) ou
+# "sliders" (as 70 perguntas em abas, com um rerun a cada slider movido)
+QUESTIONARIO_MODO = os.getenv("QUESTIONARIO_MODO", "formularios")
+
+# Tempos do rerun anterior (mostrados na barra lateral) e início da medição deste rerun
+tempos_anteriores = st.session_state.get("tempos_execucao")
+st.session_state["tempos_execucao"] = metricas.iniciar_execucao()
+metricas.iniciar_servidor()
+
+# Backend de armazenamento (PostgreSQL ou arquivo SQLite, conforme DATABASE_URL)
+armazenamento = obter_armazenamento()
 
 # --- BOTÃO PARA RESETAR BANCO DE DADOS ---
 
 def reset_database():
-    conn = conectar_banco()
-    cur = conn.cursor()
     try:
-        cur.execute("DROP TABLE IF EXISTS respostas_diagnostico CASCADE;")
-        cur.execute("DROP TABLE IF EXISTS organizacoes CASCADE;")
-        cur.execute("""
-        CREATE TABLE organizacoes (
-            id SERIAL PRIMARY KEY,
-            nome TEXT NOT NULL,
-            responsavel TEXT NOT NULL,
-            matricula TEXT NOT NULL,
-            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE TABLE respostas_diagnostico (
-            id SERIAL PRIMARY KEY,
-            organizacao_id INTEGER REFERENCES organizacoes(id) ON DELETE CASCADE,
-            variavel VARCHAR(10) NOT NULL,
-            pergunta_numero INTEGER NOT NULL,
-            nota INTEGER CHECK (nota >= 0 AND nota <= 5),
-            peso NUMERIC(4,2),
-            respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        CREATE INDEX idx_org_nome_resp_matricula ON organizacoes (nome, responsavel, matricula);
-        CREATE INDEX idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
-        """)
-        conn.commit()
+        armazenamento.resetar()
+        st.session_state.pop("cache_ultimo_diagnostico", None)
         st.success("Banco de dados resetado e recriado com sucesso!")
     except Exception as e:
         st.error(f"Erro ao resetar banco de dados: {e}")
-    finally:
-        cur.close()
-        conn.close()
 
 st.sidebar.markdown("**Projeto DREXUS ICE³-R + DRE**")
 if st.sidebar.button("Resetar Banco de Dados"):
     reset_database()
 
+# Uso do pool de conexões compartilhado (tempo de espera por conexão livre)
+stats_pool = db.estatisticas_pool()
+if stats_pool:
+    with st.sidebar.expander("Pool de conexões"):
+        st.caption(
+            f"Em uso: {stats_pool['em_uso']}/{stats_pool['maximo']} · "
+            f"Ociosas: {stats_pool['ociosas']} · Descartadas: {stats_pool['descartadas']}"
+        )
+        st.caption(
+            f"Espera média: {stats_pool['espera_media_ms']} ms · "
+            f"Máx.: {stats_pool['espera_max_ms']} ms · "
+            f"Última: {stats_pool['espera_ultima_ms']} ms"
+        )
+
+# Decomposição de tempo do rerun anterior, por trecho medido
+if tempos_anteriores is not None and tempos_anteriores.trechos:
+    with st.sidebar.expander("Tempos da última execução"):
+        st.caption(f"Total medido: {tempos_anteriores.total() * 1000:.0f} ms")
+        st.text("\n".join(
+            f"{'  ' * profundidade}{operacao}: {duracao * 1000:.1f} ms{' (erro)' if erro else ''}"
+            for operacao, profundidade, _, duracao, erro in sorted(tempos_anteriores.trechos, key=lambda t: t[2])
+        ))
+
 # Botão para diagnóstico agregado da empresa
 if st.sidebar.button("Diagnóstico da Empresa"):
     st.session_state["modo_diagnostico_empresa"] = True
+    st.session_state["modo_painel_empresas"] = False
     for key in st.session_state.keys():
         if key.startswith("media_"):
             del st.session_state[key]
     st.rerun()
 
+# Botão para o painel comparativo de todas as empresas
+if st.sidebar.button("Painel de Empresas"):
+    st.session_state["modo_painel_empresas"] = True
+    st.session_state["modo_diagnostico_empresa"] = False
+    st.rerun()
+
 from dotenv import load_dotenv
 
 # Inicialização das variáveis de estado
@@ -83,61 +100,39 @@ if "responsavel_input" not in st.session_state:
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Índice da base de conhecimento DREXUS: construído uma única vez por processo
+try:
+    conhecimento.obter_indice()
+except Exception as e:
+    logger.warning("Erro ao indexar conhecimento DREXUS: %s", e)
+
 # ---------- FUNÇÕES AUXILIARES ----------
 
-def carregar_conhecimento_drexus():
+def carregar_conhecimento_drexus(medias, respostas=None):
+    # Apenas os trechos da base de conhecimento relevantes para as variáveis mais fracas
+    # (índice BM25 construído uma vez por processo em src/conhecimento.py)
     try:
-        with open("dossie_drexus_ice3r_dre.md", encoding="utf-8") as f:
-            return f.read()
+        return conhecimento.contexto_relevante(medias, respostas)
     except Exception as e:
         st.error(f"Erro ao carregar conhecimento DREXUS: {e}")
         return "Erro ao carregar conhecimento DREXUS."
 
-def gerar_resumo_openai(empresa, responsavel, matricula, respostas, medias, rexp, zona, conhecimento_drexus):
-    try:
-        # Log detalhado para depuração
-        print(f"Iniciando geração de resumo para empresa: {empresa}")
-        print(f"REXP: {rexp}, Zona: {zona}")
-        
-        from openai import OpenAI
-        client = OpenAI()
-        
-        # Verifica a configuração da API Key
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            print("ERRO: Chave da API OpenAI não configurada!")
-            return "Erro: Chave da API OpenAI não está configurada. Configure a variável OPENAI_API_KEY."
-            
-        prompt = f"""
-        Empresa: {empresa}
-        Responsável: {responsavel}
-        Matrícula: {matricula}
-        Respostas brutas: {respostas}
-        Médias das variáveis: {medias}
-        Rexp: {rexp}
-        Zona de maturidade: {zona}
-        Contexto do DREXUS: {conhecimento_drexus[:5000]}... (truncado para não exceder limites)
-
-        Faça um resumo detalhado da situação da empresa, identifique vulnerabilidades e sugira as 5 principais ações prioritárias e objetivas para evolução imediata. Seja claro e prático.
-        """
-        
-        print("Enviando solicitação para API OpenAI...")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Você é um consultor especialista em organizações regenerativas e maturidade organizacional."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=800,
-            temperature=0.7
+def gerar_resumo_openai(empresa, responsavel, matricula, respostas, medias, rexp, zona, conhecimento_drexus, usar_cache=True, stream=False):
+    # Com stream=True retorna um gerador de trechos (para st.write_stream); senão, o texto completo.
+    # Falhas (inclusive no meio do stream) são levantadas: quem chama mostra o erro e não guarda
+    # o texto parcial como resumo
+    
+    def montar_mensagens():
+        # Dados compactos e limitados ao orçamento de tokens (PROMPT_MAX_TOKENS)
+        return resumo_ia.montar_mensagens(
+            empresa, responsavel, matricula, respostas, medias, rexp, zona, conhecimento_drexus
         )
-        
-        print("Resposta da OpenAI recebida com sucesso")
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"ERRO na chamada OpenAI: {type(e).__name__} - {str(e)}")
-        print(traceback.format_exc())
-        return f"Não foi possível gerar o resumo devido a um erro: {str(e)}"
+    
+    if stream:
+        return resumo_ia.gerar_resumo_stream(montar_mensagens(), empresa=empresa, usar_cache=usar_cache)
+    return resumo_ia.gerar_resumo(montar_mensagens(), empresa=empresa, usar_cache=usar_cache)
 
 def autenticar():
     app_password = os.getenv("APP_PASSWORD")
@@ -148,137 +143,195 @@ def autenticar():
             st.stop()
 
 def criar_tabelas():
-    # Executa o schema.sql se desejar garantir a estrutura
-    schema = """
-    CREATE TABLE IF NOT EXISTS organizacoes (
-        id SERIAL PRIMARY KEY,
-        nome TEXT NOT NULL,
-        responsavel TEXT NOT NULL,
-        matricula TEXT NOT NULL,
-        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS respostas_diagnostico (
-        id SERIAL PRIMARY KEY,
-        organizacao_id INTEGER REFERENCES organizacoes(id) ON DELETE CASCADE,
-        variavel VARCHAR(10) NOT NULL,
-        pergunta_numero INTEGER NOT NULL,
-        nota INTEGER CHECK (nota >= 0 AND nota <= 5),
-        peso NUMERIC(4,2),
-        respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE INDEX IF NOT EXISTS idx_org_nome_resp_matricula ON organizacoes (nome, responsavel, matricula);
-    CREATE INDEX IF NOT EXISTS idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
-    """
+    # Aplica as migrações pendentes (src/migracoes.py) apenas na primeira execução do processo;
+    # nos reruns seguintes não há DDL nem acesso ao banco
     try:
-        conn = conectar_banco()
-        cur = conn.cursor()
-        cur.execute(schema)
-        conn.commit()
-        cur.close()
-        conn.close()
+        armazenamento.garantir_esquema()
     except Exception as e:
         st.error(f"Erro ao criar tabelas: {e}")
 
+# Último diagnóstico e pontuação por (empresa, responsável, matrícula), guardados na sessão:
+# o script roda de novo a cada slider movido, e o resultado só muda quando a sessão salva
+def cache_ultimo_diagnostico():
+    return st.session_state.setdefault("cache_ultimo_diagnostico", {})
+
+def invalidar_ultimo_diagnostico(empresa, responsavel, matricula):
+    cache = cache_ultimo_diagnostico()
+    cache.pop(("respostas", empresa, responsavel, matricula), None)
+    cache.pop(("pontuacao", empresa, responsavel, matricula), None)
+
 def salvar_diagnostico(empresa, responsavel, matricula, respostas):
     try:
-        conn = conectar_banco()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO organizacoes (nome, responsavel, matricula) VALUES (%s, %s, %s) RETURNING id",
-            (empresa, responsavel, matricula)
-        )
-        org_id = cur.fetchone()[0]
-        for var, valores in respostas.items():
-            for idx, (nota, peso) in enumerate(valores, 1):
-                cur.execute("""
-                    INSERT INTO respostas_diagnostico (organizacao_id, variavel, pergunta_numero, nota, peso)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (org_id, var, idx, nota, peso))
-        conn.commit()
-        cur.close()
-        conn.close()
-        st.success("Respostas salvas com sucesso!")
+        if armazenamento.salvar_diagnostico(empresa, responsavel, respostas, matricula=matricula):
+            invalidar_ultimo_diagnostico(empresa, responsavel, matricula)
+            st.success("Diagnóstico salvo com sucesso!")
+        else:
+            st.info("Este diagnóstico já havia sido gravado hoje com as mesmas respostas; "
+                    "o envio duplicado foi ignorado.")
     except Exception as e:
         st.error(f"Erro ao salvar no banco: {e}")
 
 def buscar_ultimo_diagnostico(empresa, responsavel, matricula):
+    chave = ("respostas", empresa, responsavel, matricula)
+    cache = cache_ultimo_diagnostico()
+    if chave in cache:
+        return cache[chave]
     try:
-        conn = conectar_banco()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT o.id FROM organizacoes o
-            WHERE o.nome = %s AND o.responsavel = %s AND o.matricula = %s
-            ORDER BY o.criado_em DESC LIMIT 1
-        """, (empresa, responsavel, matricula))
-        org = cur.fetchone()
-        if not org:
-            return None
-        org_id = org[0]
-        cur.execute("""
-            SELECT variavel, pergunta_numero, nota, peso FROM respostas_diagnostico
-            WHERE organizacao_id = %s
-            ORDER BY variavel, pergunta_numero
-        """, (org_id,))
-        dados = cur.fetchall()
-        cur.close()
-        conn.close()
-        respostas = {}
-        for var, qnum, nota, peso in dados:
-            if var not in respostas:
-                respostas[var] = []
-            respostas[var].append((nota, peso))
-        return respostas
+        cache[chave] = armazenamento.buscar_ultimo_diagnostico(empresa, responsavel, matricula)
+        return cache[chave]
     except Exception as e:
         st.error(f"Erro ao buscar diagnóstico anterior: {e}")
         return None
 
+def buscar_ultima_pontuacao(empresa, responsavel, matricula):
+    chave = ("pontuacao", empresa, responsavel, matricula)
+    cache = cache_ultimo_diagnostico()
+    if chave in cache:
+        return cache[chave]
+    try:
+        cache[chave] = armazenamento.buscar_ultima_pontuacao(empresa, responsavel, matricula)
+        return cache[chave]
+    except Exception as e:
+        logger.warning("Erro ao buscar pontuação do diagnóstico anterior: %s", e)
+        return None
+
+def buscar_tendencia(empresa, responsavel=None, matricula=None, periodo="trimestre"):
+    try:
+        return armazenamento.buscar_tendencia(empresa, responsavel, matricula, periodo)
+    except Exception as e:
+        st.error(f"Erro ao buscar a evolução dos diagnósticos: {e}")
+        return []
+
+def buscar_ranking_empresas(**filtros):
+    try:
+        return armazenamento.buscar_ranking_empresas(**filtros)
+    except Exception as e:
+        st.error(f"Erro ao buscar o ranking das empresas: {e}")
+        return [], 0
+
+def mostrar_tendencia(empresa, responsavel=None, matricula=None, chave="tendencia"):
+    """
+    Gráfico de linhas do Rexp e das dimensões por período.
+    """
+    nomes_periodos = {"Mês": "mes", "Trimestre": "trimestre", "Ano": "ano"}
+    periodo = st.radio("Agrupar por", list(nomes_periodos), index=1, horizontal=True, key=chave)
+    serie = buscar_tendencia(empresa, responsavel, matricula, nomes_periodos[periodo])
+    if not serie:
+        st.info("Ainda não há diagnósticos pontuados para mostrar a evolução.")
+        return
+    with metricas.trecho("grafico.tendencia"):
+        periodos = [ponto["periodo"] for ponto in serie]
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=periodos, y=[ponto["rexp"] for ponto in serie], mode="lines+markers", name="Rexp",
+            customdata=[ponto["num_diagnosticos"] for ponto in serie],
+            hovertemplate="%{x}: %{y} (%{customdata} diagnósticos)"
+        ))
+        for dimensao in serie[0]["dimensoes"]:
+            fig.add_trace(go.Scatter(
+                x=periodos, y=[ponto["dimensoes"][dimensao] for ponto in serie],
+                mode="lines+markers", name=dimensao, line=dict(dash="dot")
+            ))
+        fig.update_layout(yaxis=dict(rangemode="tozero"), hovermode="x unified")
+        st.plotly_chart(fig, use_container_width=True)
+
+def buscar_distribuicao_empresa(nome_empresa):
+    try:
+        distribuicao, _ = armazenamento.buscar_distribuicao_empresa(nome_empresa)
+        return distribuicao
+    except Exception as e:
+        st.error(f"Erro ao buscar a distribuição das respostas: {e}")
+        return None
+
+def mostrar_distribuicao(distribuicao):
+    """
+    Mapa de calor das 70 perguntas × notas 0-5 (percentual de respostas), com desvio
+    padrão e quartis no hover e as perguntas de maior divergência em destaque.
+    """
+    with metricas.trecho("grafico.distribuicao"):
+        rotulos, percentuais, detalhes = [], [], []
+        for var, itens in distribuicao.items():
+            for i, item in enumerate(itens, 1):
+                rotulos.append(f"{var}{i}")
+                n = item["respondentes"]
+                percentuais.append([100 * contagem / n if n else 0.0 for contagem in item["histograma"]])
+                detalhes.append([
+                    [contagem, item["desvio"], *item["quartis"]] for contagem in item["histograma"]
+                ])
+        # Notas nas linhas e perguntas nas colunas: um gráfico baixo para as 70 perguntas
+        fig = go.Figure(go.Heatmap(
+            z=[list(linha) for linha in zip(*percentuais)],
+            x=rotulos,
+            y=[str(nota) for nota in range(len(percentuais[0]))],
+            customdata=[list(linha) for linha in zip(*detalhes)],
+            colorscale="Blues",
+            colorbar=dict(title="%"),
+            hovertemplate=(
+                "%{x} · nota %{y}: %{z:.0f}% (%{customdata[0]} respostas)<br>"
+                "desvio %{customdata[1]} · Q1 %{customdata[2]} · mediana %{customdata[3]} · "
+                "Q3 %{customdata[4]}<extra></extra>"
+            ),
+        ))
+        fig.update_layout(
+            height=280, margin=dict(l=10, r=10, t=10, b=10),
+            xaxis=dict(tickangle=-90, tickfont=dict(size=9)), yaxis=dict(title="Nota")
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    itens = [
+        (f"{var}{i}", item) for var, lista in distribuicao.items()
+        for i, item in enumerate(lista, 1) if item["desvio"] is not None
+    ]
+    divergentes = sorted(itens, key=lambda par: par[1]["desvio"], reverse=True)[:5]
+    if divergentes:
+        st.caption("Maior divergência entre os respondentes (desvio padrão): " + ", ".join(
+            f"{rotulo} ({item['desvio']:.2f})" for rotulo, item in divergentes
+        ))
+    with st.expander("Estatísticas por pergunta"):
+        st.dataframe(pd.DataFrame([
+            {
+                "Pergunta": rotulo, "Respostas": item["respondentes"], "Média (0-5)": item["media"],
+                "Desvio padrão": item["desvio"], "Q1": item["quartis"][0], "Mediana": item["quartis"][1],
+                "Q3": item["quartis"][2],
+            }
+            for rotulo, item in itens
+        ]), use_container_width=True, hide_index=True)
+
+def mostrar_alavancas(respostas, chave=None):
+    """
+    Perguntas em que +1 ponto mais aumenta o Rexp (efeito exato, src/sensibilidade.py) e,
+    com `chave`, a simulação do Rexp ao subir as perguntas escolhidas.
+    """
+    alavancas = pontos_alavanca(respostas)
+    if alavancas:
+        st.caption("Aumento do Rexp ao subir 1 ponto em cada pergunta, considerando o peso da pergunta.")
+        st.dataframe(pd.DataFrame([
+            {"Pergunta": a["pergunta"], "Texto": a["texto"], "Nota atual": round(a["nota"], 2),
+             "Peso": a["peso"], "Aumento do Rexp": round(a["ganho"], 3)}
+            for a in alavancas
+        ]), use_container_width=True, hide_index=True)
+    if chave is None:
+        return
+    escolhidas = st.multiselect(
+        "E se estas perguntas subirem 1 ponto?", rotulos_perguntas(),
+        default=[a["pergunta"] for a in alavancas[:3]], key=chave
+    )
+    if escolhidas:
+        notas, pesos = matrizes_respostas([respostas])
+        atual, simulado = simular_cenarios(notas, [cenario([]), cenario(escolhidas)], pesos)[:, 0]
+        st.metric("Rexp simulado", f"{simulado:.3f}", delta=f"{simulado - atual:+.3f}")
+
 def buscar_media_empresa(nome_empresa):
     try:
-        conn = conectar_banco()
-        cur = conn.cursor()
-        
-        # Primeiro, busca todos os IDs da organização com este nome
-        cur.execute("""
-            SELECT id FROM organizacoes
-            WHERE LOWER(nome) = LOWER(%s)
-        """, (nome_empresa.lower(),))
+        # Lê os agregados mantidos a cada gravação (70 linhas, independente do nº de respondentes)
+        medias_perguntas, num_registros = armazenamento.buscar_media_empresa(nome_empresa)
         
-        org_ids = [row[0] for row in cur.fetchall()]
-        
-        if not org_ids:
+        if not num_registros:
             st.error(f"Nenhum registro encontrado para a empresa '{nome_empresa}'")
             return None, 0
-            
-        # Para cada variável e número de pergunta, calcula a média das notas
-        medias_perguntas = {}
         
-        for var in perguntas.keys():
-            medias_perguntas[var] = []
-            
-            for i in range(1, len(perguntas[var]) + 1):
-                cur.execute("""
-                    SELECT AVG(nota) as media_nota, AVG(peso) as media_peso
-                    FROM respostas_diagnostico
-                    WHERE organizacao_id = ANY(%s)
-                    AND variavel = %s
-                    AND pergunta_numero = %s
-                """, (org_ids, var, i))
-                
-                resultado = cur.fetchone()
-                if resultado and resultado[0]:
-                    media_nota = float(resultado[0])
-                    media_peso = float(resultado[1])
-                    medias_perguntas[var].append((media_nota, media_peso))
-                else:
-                    # Se não houver dados, usa o peso padrão e nota zero
-                    peso_padrao = perguntas[var][i-1][1]
-                    medias_perguntas[var].append((0.0, peso_padrao))
-        
-        cur.close()
-        conn.close()
-        
-        st.success(f"Dados agregados de {len(org_ids)} diagnósticos da empresa '{nome_empresa}'")
-        return medias_perguntas, len(org_ids)  # Retorna também o número de registros encontrados
+        st.success(f"Dados agregados de {num_registros} diagnósticos da empresa '{nome_empresa}'")
+        return medias_perguntas, num_registros  # Retorna também o número de registros encontrados
         
     except Exception as e:
         st.error(f"Erro ao buscar dados da empresa: {e}")
@@ -374,69 +427,78 @@ perguntas = {
     ],
 }
 
-nomes_longos = {
-    "If": "Integridade Funcional",
-    "Cm": "Capacidade de Modularidade",
-    "Et": "Evolução sob Estresse",
-    "DREq": "Densidade de DREs",
-    "Lc": "Lógica Contextual",
-    "Im": "Impacto Sistêmico das DREs",
-    "Pv": "Propósito Vivo",
-}
-
 # ---------- LÓGICA DE CÁLCULO ----------
+# calcular_medias, calcular_rexp, calcular_dimensoes e interpretar_rexp vêm de src/calculos.py
+# (motor vetorizado compartilhado com as rotinas em lote).
 
-def calcular_medias(respostas):
-    medias = dict()
-    for var, vals in respostas.items():
-        notas = [nota for nota, peso in vals]
-        pesos = [peso for nota, peso in vals]
-        if sum(pesos) > 0:
-            media = sum(n * p for n, p in zip(notas, pesos)) / sum(pesos)
-        else:
-            media = 0
-        medias[var] = round(media / 5, 3)  # var é só a sigla
-    return medias
+# ---------- INTERFACE PRINCIPAL ----------
 
-def calcular_rexp(medias):
-    try:
-        rexpb = medias["If"] * medias["Cm"] * medias["Et"]
-        rexpa = 1 + medias["DREq"] * (1 + medias["Lc"] * medias["Im"] * medias["Pv"])
-        rexp = round(rexpb * rexpa, 3)
-        return rexp
-    except KeyError:
-        return None
+autenticar()
 
-def calcular_dimensoes(medias):
-    # Retorna dicionário para radar
-    return {
-        "Cognitiva": round(
-            medias.get("Lc", 0) * 0.5 + medias.get("Et", 0) * 0.3 + medias.get("DREq", 0) * 0.2, 3),
-        "Estratégica": round(
-            medias.get("Pv", 0) * 0.4 + medias.get("Im", 0) * 0.3 + medias.get("DREq", 0) * 0.3, 3),
-        "Operacional": round(
-            medias.get("If", 0) * 0.4 + medias.get("Cm", 0) * 0.3 + medias.get("Et", 0) * 0.3, 3),
-        "Cultural": round(
-            medias.get("Et", 0) * 0.4 + medias.get("DREq", 0) * 0.3 + medias.get("Pv", 0) * 0.3, 3),
-    }
+# Esquema do banco: migrações aplicadas uma única vez por processo
+criar_tabelas()
 
-def interpretar_rexp(rexp):
-    if rexp is None:
-        return "Não calculado"
-    elif rexp >= 0.80:
-        return "Antifragilidade Regenerativa"
-    elif rexp >= 0.60:
-        return "Resiliência Estratégica"
-    elif rexp >= 0.40:
-        return "Maturidade Tática"
-    elif rexp >= 0.20:
-        return "Resiliência Reativa"
-    else:
-        return "Fragilidade Total"
+# Painel de Empresas: ranking lido de pontuacoes_empresa (uma consulta por página)
+if st.session_state.get("modo_painel_empresas", False):
+    st.title("Painel de Empresas")
+    st.markdown("Ranking das empresas pela pontuação calculada sobre as médias de todos os seus diagnósticos.")
 
-# ---------- INTERFACE PRINCIPAL ----------
+    ordenacoes = {
+        "Rexp": "rexp", "Cognitiva": "cognitiva", "Estratégica": "estrategica", "Operacional": "operacional",
+        "Cultural": "cultural", "Nº de diagnósticos": "num_diagnosticos", "Empresa": "empresa",
+    }
+    col_busca, col_zona, col_minimo = st.columns(3)
+    busca = col_busca.text_input("Buscar empresa", key="painel_busca")
+    zona_filtro = col_zona.selectbox(
+        "Zona de maturidade", ["Todas"] + [nome for _, nome in ZONAS] + [ZONA_MINIMA, ZONA_NAO_CALCULADA],
+        key="painel_zona"
+    )
+    min_diagnosticos = col_minimo.number_input("Mínimo de diagnósticos", min_value=1, value=1, key="painel_minimo")
+    col_ordem, col_direcao, col_por_pagina = st.columns(3)
+    ordenar_por = col_ordem.selectbox("Ordenar por", list(ordenacoes), key="painel_ordem")
+    decrescente = col_direcao.radio("Ordem", ["Decrescente", "Crescente"], horizontal=True,
+                                    key="painel_direcao") == "Decrescente"
+    por_pagina = col_por_pagina.selectbox("Empresas por página", [10, 20, 50, 100], index=1, key="painel_por_pagina")
+
+    filtros = dict(
+        ordenar_por=ordenacoes[ordenar_por], decrescente=decrescente, busca=busca or None,
+        zona=None if zona_filtro == "Todas" else zona_filtro, min_diagnosticos=int(min_diagnosticos),
+        por_pagina=por_pagina
+    )
+    # Filtros ou ordenação alterados: volta para a primeira página
+    if st.session_state.get("painel_filtros") != filtros:
+        st.session_state["painel_filtros"] = filtros
+        st.session_state["painel_pagina"] = 1
+    pagina = st.session_state["painel_pagina"]
+    empresas_pagina, total_empresas = buscar_ranking_empresas(pagina=pagina, **filtros)
+    num_paginas = max(1, -(-total_empresas // por_pagina))
+
+    if not empresas_pagina:
+        st.info("Nenhuma empresa encontrada. Empresas com diagnósticos anteriores ao painel aparecem "
+                "após `python -m src.db reconstruir-agregados`.")
+    else:
+        st.dataframe(pd.DataFrame([
+            {
+                "Posição": empresa["posicao"], "Empresa": empresa["empresa"],
+                "Diagnósticos": empresa["num_diagnosticos"], "Rexp": empresa["rexp"], "Zona": empresa["zona"],
+                **empresa["dimensoes"],
+            }
+            for empresa in empresas_pagina
+        ]), use_container_width=True, hide_index=True)
+        col_anterior, col_pagina, col_proxima = st.columns([1, 2, 1])
+        if col_anterior.button("Anterior", disabled=pagina <= 1):
+            st.session_state["painel_pagina"] = pagina - 1
+            st.rerun()
+        col_pagina.caption(f"Página {pagina} de {num_paginas} · {total_empresas} empresa(s)")
+        if col_proxima.button("Próxima", disabled=pagina >= num_paginas):
+            st.session_state["painel_pagina"] = pagina + 1
+            st.rerun()
+
+    if st.button("Voltar ao Diagnóstico Normal", key="painel_voltar"):
+        st.session_state["modo_painel_empresas"] = False
+        st.rerun()
 
-autenticar()
+    st.stop()
 
 # Modo Diagnóstico da Empresa
 if "modo_diagnostico_empresa" not in st.session_state:
@@ -477,6 +539,7 @@ if st.session_state.get("modo_diagnostico_empresa", False):
                     st.session_state["empresa_rexp"] = rexp
                     st.session_state["empresa_zona"] = zona
                     st.session_state["num_registros"] = num_registros
+                    st.session_state["empresa_distribuicao"] = buscar_distribuicao_empresa(empresa_nome)
                     
                     # Marcar que a busca foi realizada com sucesso
                     busca_realizada = True
@@ -499,16 +562,17 @@ if st.session_state.get("modo_diagnostico_empresa", False):
             st.info(f"Dados agregados de {num_registros} diagnósticos da empresa '{empresa_nome}'")
             
             # Gráfico radar
-            dimensoes = calcular_dimensoes(medias)
-            fig = go.Figure()
-            fig.add_trace(go.Scatterpolar(
-                r=list(dimensoes.values()),
-                theta=list(dimensoes.keys()),
-                fill='toself',
-                name='Maturidade'
-            ))
-            fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
+            with metricas.trecho("grafico.radar"):
+                dimensoes = calcular_dimensoes(medias)
+                fig = go.Figure()
+                fig.add_trace(go.Scatterpolar(
+                    r=list(dimensoes.values()),
+                    theta=list(dimensoes.keys()),
+                    fill='toself',
+                    name='Maturidade'
+                ))
+                fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
+                st.plotly_chart(fig, use_container_width=True)
             
             # Tabela de médias por variável
             st.subheader("Médias por Dimensão")
@@ -518,6 +582,17 @@ if st.session_state.get("modo_diagnostico_empresa", False):
             ])
             st.dataframe(df, use_container_width=True)
             
+            st.subheader("Onde Melhorar Primeiro")
+            mostrar_alavancas(respostas_medias, chave="simulacao_empresa")
+
+            distribuicao = st.session_state.get("empresa_distribuicao")
+            if distribuicao:
+                st.subheader("Distribuição das Respostas por Pergunta")
+                mostrar_distribuicao(distribuicao)
+
+            st.subheader("Evolução ao Longo do Tempo")
+            mostrar_tendencia(empresa_nome, chave="tendencia_empresa")
+            
             # Mostrar todos os sliders com as médias calculadas
             st.subheader("Detalhamento por Pergunta (Valores Médios)")
             
@@ -561,10 +636,11 @@ if st.session_state.get("modo_diagnostico_empresa", False):
                         st.error("Dados incompletos para gerar análise.")
                     else:
                         with st.spinner("Gerando análise completa..."):
+                            rascunho = None
                             try:
                                 # Carregar conhecimento e gerar resumo
-                                conhecimento_drexus = carregar_conhecimento_drexus()
-                                resumo = gerar_resumo_openai(
+                                conhecimento_drexus = carregar_conhecimento_drexus(medias, respostas_medias)
+                                trechos = gerar_resumo_openai(
                                     empresa_nome, 
                                     "Diagnóstico Agregado",
                                     "N/A", 
@@ -572,17 +648,23 @@ if st.session_state.get("modo_diagnostico_empresa", False):
                                     medias, 
                                     rexp,
                                     zona,
-                                    conhecimento_drexus
+                                    conhecimento_drexus,
+                                    stream=True
                                 )
                                 
-                                # Salvar o resumo no estado da sessão
-                                st.session_state["resumo_empresa"] = resumo
-                                
-                                # Exibir o resumo imediatamente
+                                # Exibir o resumo à medida que é gerado; se o stream falhar,
+                                # o texto parcial é removido e nada é guardado
                                 with resumo_container:
-                                    st.subheader("Análise Agregada da Empresa:")
-                                    st.markdown(resumo)
+                                    rascunho = st.empty()
+                                    with rascunho.container():
+                                        st.subheader("Análise Agregada da Empresa:")
+                                        resumo = st.write_stream(trechos)
+                                
+                                # Salvar o resumo completo no estado da sessão
+                                st.session_state["resumo_empresa"] = resumo
                             except Exception as e:
+                                if rascunho is not None:
+                                    rascunho.empty()
                                 st.error(f"Erro ao gerar análise: {str(e)}")
                                 st.code(traceback.format_exc())
     
@@ -593,7 +675,8 @@ if st.session_state.get("modo_diagnostico_empresa", False):
         for key in list(st.session_state.keys()):
             if key.startswith("media_") or key in ["empresa_atual", "respostas_medias", 
                                                   "empresa_medias", "empresa_rexp", 
-                                                  "empresa_zona", "resumo_empresa"]:
+                                                  "empresa_zona", "empresa_distribuicao",
+                                                  "resumo_empresa"]:
                 del st.session_state[key]
         st.rerun()
     
@@ -622,55 +705,108 @@ if not st.session_state["iniciar_questionario"]:
     else:
         st.stop()
 
-criar_tabelas()
-
 # Verifica se já existe diagnóstico:
 ultimo = buscar_ultimo_diagnostico(empresa, responsavel, matricula)
 
 if ultimo:
     st.info(f"Diagnóstico anterior encontrado para esta empresa/responsável/matrícula ({matricula}).")
     if st.checkbox("Deseja visualizar o diagnóstico anterior?"):
-        medias_last = calcular_medias(ultimo)
-        rexp_last = calcular_rexp(medias_last)
+        # Pontuação gravada ao salvar; diagnósticos sem ela são recalculados a partir das respostas
+        pontuacao_last = buscar_ultima_pontuacao(empresa, responsavel, matricula)
+        if pontuacao_last:
+            medias_last = pontuacao_last["medias"]
+            rexp_last = pontuacao_last["rexp"]
+            dim_last = pontuacao_last["dimensoes"]
+        else:
+            medias_last = calcular_medias(ultimo)
+            rexp_last = calcular_rexp(medias_last)
+            dim_last = calcular_dimensoes(medias_last)
         st.success(f"Rexp anterior: **{rexp_last}**")
         st.metric("Zona de Maturidade", interpretar_rexp(rexp_last))
         st.write("Média das variáveis:", medias_last)
-        dim_last = calcular_dimensoes(medias_last)
-        fig_last = go.Figure()
-        fig_last.add_trace(go.Scatterpolar(
-            r=list(dim_last.values()),
-            theta=list(dim_last.keys()),
-            fill='toself',
-            name='Maturidade'
-        ))
-        fig_last.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
-        st.plotly_chart(fig_last, use_container_width=True)
+        with metricas.trecho("grafico.radar"):
+            fig_last = go.Figure()
+            fig_last.add_trace(go.Scatterpolar(
+                r=list(dim_last.values()),
+                theta=list(dim_last.keys()),
+                fill='toself',
+                name='Maturidade'
+            ))
+            fig_last.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
+            st.plotly_chart(fig_last, use_container_width=True)
+    if st.checkbox("Deseja ver a evolução dos seus diagnósticos?"):
+        mostrar_tendencia(empresa, responsavel, matricula, chave="tendencia_respondente")
 
 st.header("Novo Diagnóstico")
 
-# Preencher o dicionário respostas com os sliders
-tab_names = list(perguntas.keys())
-tabs = st.tabs(tab_names)
+def valor_inicial(var, i):
+    if ultimo and var in ultimo and len(ultimo[var]) > i:
+        return ultimo[var][i][0]
+    return 0
+
+def guardar_bloco(var):
+    # Callback do formulário: copia as notas do bloco enviado e abre o próximo bloco
+    st.session_state["notas_questionario"][var] = [
+        st.session_state[f"{var}_{i}"] for i in range(len(perguntas[var]))
+    ]
+    st.session_state["blocos_enviados"].add(var)
+    pendentes = [v for v in perguntas if v not in st.session_state["blocos_enviados"]]
+    if pendentes:
+        st.session_state["bloco_questionario"] = pendentes[0]
 
 respostas = {}
 
-for idx, var in enumerate(tab_names):
-    with tabs[idx]:
+if QUESTIONARIO_MODO == "sliders":
+    # Preencher o dicionário respostas com os sliders
+    tab_names = list(perguntas.keys())
+    tabs = st.tabs(tab_names)
+
+    for idx, var in enumerate(tab_names):
+        with tabs[idx]:
+            st.subheader(nomes_longos[var])
+            st.info(ajuda[var])
+            respostas[var] = []
+            for i, (pergunta, peso) in enumerate(perguntas[var]):
+                slider_key = f"{var}_{i}"
+                nota = st.slider(
+                    f"{i+1}. {pergunta}",
+                    0, 5,
+                    value=valor_inicial(var, i),
+                    key=slider_key
+                )
+                respostas[var].append((nota, peso))
+else:
+    # As notas ficam em notas_questionario (os sliders de blocos fechados não existem no rerun);
+    # começam pelo último diagnóstico do respondente
+    respondente = (empresa, responsavel, matricula)
+    if st.session_state.get("notas_respondente") != respondente:
+        st.session_state["notas_respondente"] = respondente
+        st.session_state["notas_questionario"] = {
+            var: [valor_inicial(var, i) for i in range(len(lista))] for var, lista in perguntas.items()
+        }
+        st.session_state["blocos_enviados"] = set()
+    notas_questionario = st.session_state["notas_questionario"]
+    enviados = st.session_state["blocos_enviados"]
+
+    st.caption(f"Blocos respondidos: {len(enviados)} de {len(perguntas)}. "
+               "As notas de cada bloco são registradas ao clicar em \"Salvar bloco\".")
+    var = st.radio(
+        "Bloco do questionário",
+        list(perguntas.keys()),
+        format_func=lambda v: f"✓ {v}" if v in enviados else v,
+        horizontal=True,
+        key="bloco_questionario"
+    )
+    # Só o bloco aberto é montado
+    with st.form(f"form_{var}"):
         st.subheader(nomes_longos[var])
         st.info(ajuda[var])
-        respostas[var] = []
-        for i, (pergunta, peso) in enumerate(perguntas[var]):
-            slider_key = f"{var}_{i}"
-            valor_inicial = 0
-            if ultimo and var in ultimo and len(ultimo[var]) > i:
-                valor_inicial = ultimo[var][i][0]
-            nota = st.slider(
-                f"{i+1}. {pergunta}",
-                0, 5,
-                value=valor_inicial,
-                key=slider_key
-            )
-            respostas[var].append((nota, peso))
+        for i, (pergunta, _) in enumerate(perguntas[var]):
+            st.slider(f"{i+1}. {pergunta}", 0, 5, value=notas_questionario[var][i], key=f"{var}_{i}")
+        st.form_submit_button("Salvar bloco", on_click=guardar_bloco, args=(var,))
+
+    for var, lista in perguntas.items():
+        respostas[var] = [(nota, peso) for nota, (_, peso) in zip(notas_questionario[var], lista)]
 
 # --- TRECHO QUE CONTROLA O BOTÃO ---
 
@@ -680,6 +816,9 @@ resumo_individual_container = st.container()
 
 # Botão para calcular Rexp
 if st.button("Calcular Rexp", key="calcular_rexp_btn"):
+    pendentes = [v for v in perguntas if v not in st.session_state.get("blocos_enviados", perguntas)]
+    if QUESTIONARIO_MODO != "sliders" and pendentes:
+        st.warning(f"Blocos ainda não salvos (entram com as notas iniciais): {', '.join(pendentes)}")
     medias = calcular_medias(respostas)
     rexp = calcular_rexp(medias)
     zona = interpretar_rexp(rexp)
@@ -703,17 +842,18 @@ if st.button("Calcular Rexp", key="calcular_rexp_btn"):
         for k, v in medias.items():
             st.write(f"{nomes_longos[k]}: {v}")
 
-        dimensoes = calcular_dimensoes(medias)
-        fig = go.Figure()
-        fig.add_trace(go.Scatterpolar(
-            r=list(dimensoes.values()),
-            theta=list(dimensoes.keys()),
-            fill='toself',
-            name='Maturidade'
-        ))
+        with metricas.trecho("grafico.radar"):
+            dimensoes = calcular_dimensoes(medias)
+            fig = go.Figure()
+            fig.add_trace(go.Scatterpolar(
+                r=list(dimensoes.values()),
+                theta=list(dimensoes.keys()),
+                fill='toself',
+                name='Maturidade'
+            ))
         
-        fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
-        st.plotly_chart(fig, use_container_width=True)
+            fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=False)
+            st.plotly_chart(fig, use_container_width=True)
 
         st.subheader("Tabela de Variáveis e Pesos")
 
@@ -722,6 +862,9 @@ if st.button("Calcular Rexp", key="calcular_rexp_btn"):
         for k, v in medias.items()
         ])
         st.dataframe(df, use_container_width=True)
+
+        st.subheader("Onde Melhorar Primeiro")
+        mostrar_alavancas(respostas)
         
         st.session_state["resumo_gerado"] = False
 
@@ -731,10 +874,13 @@ if dados_resultado and not st.session_state.get("resumo_gerado", False):
     # Mostrar o botão de resumo individual
     if st.button("Gerar Resumo e Recomendações Personalizadas", key="btn_resumo_individual"):
         with st.spinner("Gerando análise e recomendações..."):
+            rascunho = None
             try:
                 # Carregar conhecimento e gerar resumo
-                conhecimento_drexus = carregar_conhecimento_drexus()
-                resumo = gerar_resumo_openai(
+                conhecimento_drexus = carregar_conhecimento_drexus(
+                    dados_resultado["medias"], dados_resultado["respostas"]
+                )
+                trechos = gerar_resumo_openai(
                     dados_resultado["empresa"],
                     dados_resultado["responsavel"],
                     dados_resultado["matricula"],
@@ -742,18 +888,26 @@ if dados_resultado and not st.session_state.get("resumo_gerado", False):
                     dados_resultado["medias"],
                     dados_resultado["rexp"],
                     dados_resultado["zona"],
-                    conhecimento_drexus
+                    conhecimento_drexus,
+                    stream=True
                 )
                 
-                # Salvar o resumo no estado da sessão
+                # Exibir o resumo à medida que é gerado; o bloco abaixo o exibe
+                # novamente (com o botão de gravação), então o rascunho é removido ao final
+                # (e também se o stream falhar, sem guardar o texto parcial)
+                with resumo_individual_container:
+                    rascunho = st.empty()
+                    with rascunho.container():
+                        st.subheader("Resumo personalizado da situação da empresa:")
+                        resumo = st.write_stream(trechos)
+                    rascunho.empty()
+                
+                # Salvar o resumo completo no estado da sessão
                 st.session_state["resumo"] = resumo
                 st.session_state["resumo_gerado"] = True
-                
-                # Exibir o resumo imediatamente
-                with resumo_individual_container:
-                    st.subheader("Resumo personalizado da situação da empresa:")
-                    st.markdown(resumo)
             except Exception as e:
+                if rascunho is not None:
+                    rascunho.empty()
                 st.error(f"Erro ao gerar resumo: {str(e)}")
                 st.code(traceback.format_exc())
 
@@ -766,7 +920,6 @@ if st.session_state.get("resumo_gerado", False) and "resumo" in st.session_state
         if st.button("Gravar diagnóstico no banco de dados"):
             dados = st.session_state["dados_resultado"]
             salvar_diagnostico(dados["empresa"], dados["responsavel"], dados["matricula"], dados["respostas"])
-            st.success("Diagnóstico salvo com sucesso!")
 
 # Botão para resetar tudo e voltar ao início
 if st.button("Novo Diagnóstico"):
@@ -777,7 +930,10 @@ if st.button("Novo Diagnóstico"):
             if slider_key in st.session_state:
                 del st.session_state[slider_key]
     
-    keys_to_clear = ["iniciar_questionario", "resumo_gerado", "dados_resultado", "resumo"]
+    keys_to_clear = [
+        "iniciar_questionario", "resumo_gerado", "dados_resultado", "resumo",
+        "notas_respondente", "notas_questionario", "blocos_enviados", "bloco_questionario",
+    ]
     for key in keys_to_clear:
         if key in st.session_state:
             del st.session_state[key]
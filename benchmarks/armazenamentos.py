@@ -0,0 +1,110 @@
+"""
+Comparação dos backends de armazenamento (src/armazenamento.py): PostgreSQL e arquivo SQLite.
+
+Os dois recebem os mesmos diagnósticos sintéticos e as mesmas consultas, nos caminhos do
+app: salvar_diagnostico, buscar_ultimo_diagnostico e buscar_media_empresa. Os dois bancos
+são apagados e recriados no início. O PostgreSQL é opcional (--database-url ou
+BENCH_DATABASE_URL; DATABASE_URL nunca é usada); o SQLite usa --sqlite ou um arquivo temporário.
+
+    python -m benchmarks.armazenamentos --database-url postgresql://localhost/drexus_bench
+    python -m benchmarks.armazenamentos --sqlite /tmp/drexus_bench.db --empresas 5 --respondentes 200
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from src.armazenamento import ArmazenamentoPostgres, ArmazenamentoSQLite
+
+from .dados import gerar_diagnosticos
+from .executar import LINHAS_MEDIA_EMPRESA, NUM_PERGUNTAS, medir, resumir
+
+CAMINHOS = ("salvar_diagnostico", "buscar_ultimo_diagnostico", "buscar_media_empresa")
+
+
+def comparar_backends(backends, num_empresas, respondentes_por_empresa, amostra, semente=42):
+    """
+    Grava os diagnósticos em cada backend e mede cada caminho.
+    :param backends: Dicionário {nome: Armazenamento}
+    :return: Dicionário {"parametros": ..., "resultados": {backend: {caminho: métricas}}}
+    """
+    diagnosticos = gerar_diagnosticos(num_empresas, respondentes_por_empresa, semente)
+    empresas = sorted({empresa for empresa, _, _, _ in diagnosticos})
+    rng = random.Random(semente)
+    buscas = [
+        (empresa, responsavel, matricula)
+        for empresa, responsavel, _, matricula in rng.choices(diagnosticos, k=amostra)
+    ]
+    empresas_sorteadas = [(empresa,) for empresa in rng.choices(empresas, k=amostra)]
+    resultados = {}
+    for nome, backend in backends.items():
+        # O PostgreSQL lê os agregados da empresa; o SQLite agrega as respostas de todos os respondentes
+        linhas_media = (
+            LINHAS_MEDIA_EMPRESA if backend.nome == "postgres" else 1 + NUM_PERGUNTAS * respondentes_por_empresa
+        )
+        print(f"{nome}: recriando o esquema e gravando {len(diagnosticos)} diagnósticos...")
+        backend.resetar()
+        resultados[nome] = {
+            "salvar_diagnostico": resumir(medir(backend.salvar_diagnostico, diagnosticos)),
+            "buscar_ultimo_diagnostico": resumir(medir(backend.buscar_ultimo_diagnostico, buscas)),
+            "buscar_media_empresa": resumir(
+                medir(backend.buscar_media_empresa, empresas_sorteadas),
+                linhas_por_operacao=linhas_media
+            ),
+        }
+    return {
+        "parametros": {"empresas": num_empresas, "respondentes": respondentes_por_empresa, "amostra": amostra},
+        "resultados": resultados,
+    }
+
+
+def imprimir(resultado):
+    nomes = list(resultado["resultados"])
+    print(f"\n{'Caminho':<30}{'backend':<12}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>11}")
+    for caminho in CAMINHOS:
+        for nome in nomes:
+            m = resultado["resultados"][nome][caminho]
+            print(f"{caminho:<30}{nome:<12}{m['n']:>7}{m['p50_ms']:>10.3f}{m['p95_ms']:>10.3f}"
+                  f"{m['p99_ms']:>10.3f}{m['ops_s']:>11.1f}")
+    if len(nomes) == 2:
+        base, outro = nomes
+        print(f"\nRazão de p50 ({outro} / {base}):")
+        for caminho in CAMINHOS:
+            p50_base = resultado["resultados"][base][caminho]["p50_ms"]
+            p50_outro = resultado["resultados"][outro][caminho]["p50_ms"]
+            print(f"  {caminho:<28}{p50_outro / p50_base if p50_base else 0.0:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparação dos backends de armazenamento do DREXUS ICE³-R.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="PostgreSQL descartável (padrão: BENCH_DATABASE_URL). Sem ele, mede só o SQLite.")
+    parser.add_argument("--sqlite", type=Path,
+                        help="Arquivo SQLite descartável (padrão: arquivo temporário).")
+    parser.add_argument("--empresas", type=int, default=5, help="Número de empresas (padrão 5).")
+    parser.add_argument("--respondentes", type=int, default=100, help="Respondentes por empresa (padrão 100).")
+    parser.add_argument("--amostra", type=int, default=300,
+                        help="Consultas medidas por caminho de leitura (padrão 300).")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", type=Path, help="Grava os resultados em JSON.")
+    args = parser.parse_args()
+
+    backends = {}
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        backends["postgres"] = ArmazenamentoPostgres()
+    else:
+        print("Sem --database-url/BENCH_DATABASE_URL: medindo apenas o SQLite.")
+    with tempfile.TemporaryDirectory() as diretorio:
+        backends["sqlite"] = ArmazenamentoSQLite(str(args.sqlite or Path(diretorio) / "drexus_bench.db"))
+        resultado = comparar_backends(backends, args.empresas, args.respondentes, args.amostra, args.semente)
+    imprimir(resultado)
+    if args.saida:
+        args.saida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
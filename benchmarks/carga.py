@@ -0,0 +1,246 @@
+"""
+Simulador de carga: muitos respondentes enviando o diagnóstico ao mesmo tempo.
+
+Cada respondente simulado roda, em uma thread, o mesmo caminho do app: busca o último
+diagnóstico, responde (tempo de reflexão opcional), salva e, com alguma probabilidade,
+consulta a média da empresa. As threads compartilham o pool de src/db.py, como as sessões
+do Streamlit em um processo do app; o tamanho do pool segue DB_POOL_MAX.
+
+Durante a execução, uma conexão separada amostra pg_stat_activity e pg_locks. O relatório
+traz vazão, latências (p50/p95/p99/máx) por operação, conexões no servidor, uso e espera
+do pool, esperas por lock e deadlocks.
+
+    export BENCH_DATABASE_URL=postgresql://localhost/drexus_bench
+    DB_POOL_MAX=20 python -m benchmarks.carga --usuarios 200 --empresas 3 --respondentes 400
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+
+from src import db, migracoes
+
+from .dados import gerar_diagnosticos
+
+
+class Metricas:
+    """
+    Latências e erros por operação, registrados pelas threads dos respondentes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duracoes = defaultdict(list)
+        self.erros = defaultdict(int)
+        self.ultimos_erros = []
+
+    def cronometrar(self, operacao, funcao, *args):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args)
+        except Exception as e:
+            with self._lock:
+                self.erros[operacao] += 1
+                if len(self.ultimos_erros) < 5:
+                    self.ultimos_erros.append(f"{operacao}: {e}")
+        finally:
+            duracao = time.perf_counter() - inicio
+            with self._lock:
+                self.duracoes[operacao].append(duracao)
+
+
+class MonitorBanco(threading.Thread):
+    """
+    Amostra periodicamente, por uma conexão própria (fora do pool), as conexões do banco,
+    as que aguardam lock e o uso do pool.
+    """
+
+    def __init__(self, dsn, intervalo=0.1):
+        super().__init__(daemon=True)
+        self.dsn = dsn
+        self.intervalo = intervalo
+        self.amostras = []  # (conexões, ativas, aguardando lock, locks não concedidos, pool em uso)
+        self._parar = threading.Event()
+
+    def run(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            while not self._parar.is_set():
+                cur.execute("""
+                    SELECT count(*),
+                           count(*) FILTER (WHERE state = 'active'),
+                           count(*) FILTER (WHERE wait_event_type = 'Lock'),
+                           (SELECT count(*) FROM pg_locks WHERE NOT granted)
+                    FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                """)
+                estatisticas = db.estatisticas_pool()
+                self.amostras.append(cur.fetchone() + ((estatisticas or {}).get("em_uso", 0),))
+                self._parar.wait(self.intervalo)
+        finally:
+            conn.close()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def _deadlocks(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def respondente(metricas, diagnostico, pausa, prob_media, rng):
+    """
+    Sessão de um respondente: busca o último diagnóstico, responde, salva e,
+    às vezes, consulta a média da empresa.
+    """
+    empresa, responsavel, respostas, matricula = diagnostico
+    metricas.cronometrar("buscar_ultimo_diagnostico", db.buscar_ultimo_diagnostico, empresa, responsavel, matricula)
+    if pausa > 0:
+        time.sleep(rng.uniform(0, 2 * pausa))
+    metricas.cronometrar("salvar_diagnostico", db.salvar_diagnostico, empresa, responsavel, respostas, matricula)
+    if rng.random() < prob_media:
+        metricas.cronometrar("buscar_media_empresa", db.buscar_media_empresa, empresa)
+
+
+def simular(dsn, usuarios, num_empresas, respondentes_por_empresa, pausa=0.0, prob_media=0.3, semente=42,
+            intervalo_monitor=0.1):
+    """
+    Dispara os respondentes com `usuarios` threads simultâneas e coleta as métricas.
+    :return: Dicionário com o relatório da simulação
+    """
+    diagnosticos = gerar_diagnosticos(num_empresas, respondentes_por_empresa, semente)
+    random.Random(semente).shuffle(diagnosticos)
+    metricas = Metricas()
+    monitor = MonitorBanco(dsn, intervalo_monitor)
+    deadlocks_antes = _deadlocks(dsn)
+
+    monitor.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=usuarios) as executor:
+        for i, diagnostico in enumerate(diagnosticos):
+            executor.submit(respondente, metricas, diagnostico, pausa, prob_media, random.Random(semente + i))
+    duracao = time.perf_counter() - inicio
+    monitor.parar()
+
+    amostras = np.array(monitor.amostras or [(0, 0, 0, 0, 0)], dtype=float)
+    operacoes = {}
+    for operacao, duracoes in metricas.duracoes.items():
+        ms = np.array(duracoes) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        operacoes[operacao] = {
+            "n": len(duracoes),
+            "erros": metricas.erros.get(operacao, 0),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(ms.max()), 2),
+        }
+    salvos = len(diagnosticos) - metricas.erros.get("salvar_diagnostico", 0)
+    return {
+        "parametros": {
+            "usuarios": usuarios,
+            "empresas": num_empresas,
+            "respondentes": respondentes_por_empresa,
+            "pausa_s": pausa,
+            "prob_media": prob_media,
+            "armazenamento": db.ARMAZENAMENTO,
+        },
+        "duracao_s": round(duracao, 2),
+        "diagnosticos_salvos": salvos,
+        "diagnosticos_s": round(salvos / duracao, 1) if duracao > 0 else 0.0,
+        "operacoes": operacoes,
+        "conexoes_servidor": {"max": int(amostras[:, 0].max()), "media": round(float(amostras[:, 0].mean()), 1)},
+        "conexoes_ativas": {"max": int(amostras[:, 1].max()), "media": round(float(amostras[:, 1].mean()), 1)},
+        "esperas_lock": {
+            "max_simultaneas": int(amostras[:, 2].max()),
+            "amostras_com_espera": round(float((amostras[:, 2] > 0).mean()), 3),
+            "locks_nao_concedidos_max": int(amostras[:, 3].max()),
+            # Soma de (sessões aguardando lock × intervalo): aproximação do tempo total em espera
+            "tempo_estimado_s": round(float(amostras[:, 2].sum() * intervalo_monitor), 2),
+            "deadlocks": _deadlocks(dsn) - deadlocks_antes,
+        },
+        "pool": db.estatisticas_pool(),
+        "erros": metricas.ultimos_erros,
+    }
+
+
+def imprimir(relatorio):
+    p = relatorio["parametros"]
+    print(f"\n{p['usuarios']} usuários simultâneos, {p['empresas']} empresa(s) × {p['respondentes']} respondentes "
+          f"(armazenamento {p['armazenamento']})")
+    print(f"Duração: {relatorio['duracao_s']}s | Diagnósticos salvos: {relatorio['diagnosticos_salvos']} "
+          f"| Vazão: {relatorio['diagnosticos_s']} diagnósticos/s")
+    print(f"\n{'Operação':<28}{'n':>7}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+    for nome, m in relatorio["operacoes"].items():
+        print(f"{nome:<28}{m['n']:>7}{m['erros']:>7}{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}"
+              f"{m['p99_ms']:>10.2f}{m['max_ms']:>10.2f}")
+    servidor, ativas, locks, pool = (
+        relatorio["conexoes_servidor"], relatorio["conexoes_ativas"], relatorio["esperas_lock"], relatorio["pool"]
+    )
+    print(f"\nConexões no servidor: máx {servidor['max']} (média {servidor['media']}), "
+          f"ativas máx {ativas['max']} (média {ativas['media']})")
+    print(f"Pool: máximo {pool['maximo']}, abertas {pool['abertas']}, espera média {pool['espera_media_ms']} ms, "
+          f"espera máx {pool['espera_max_ms']} ms")
+    print(f"Esperas por lock: até {locks['max_simultaneas']} sessões ao mesmo tempo, em "
+          f"{locks['amostras_com_espera']:.1%} das amostras, ~{locks['tempo_estimado_s']}s no total; "
+          f"deadlocks: {locks['deadlocks']}")
+    for erro in relatorio["erros"]:
+        print(f"Erro: {erro}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de respondentes simultâneos do DREXUS ICE³-R.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="PostgreSQL de teste (padrão: BENCH_DATABASE_URL).")
+    parser.add_argument("--usuarios", type=int, default=50, help="Respondentes simultâneos (padrão 50).")
+    parser.add_argument("--empresas", type=int, default=3, help="Número de empresas (padrão 3).")
+    parser.add_argument("--respondentes", type=int, default=200, help="Respondentes por empresa (padrão 200).")
+    parser.add_argument("--pausa", type=float, default=0.0,
+                        help="Tempo médio de reflexão (s) entre a busca e o envio (padrão 0).")
+    parser.add_argument("--prob-media", type=float, default=0.3,
+                        help="Probabilidade de consultar a média da empresa após salvar (padrão 0.3).")
+    parser.add_argument("--armazenamento", choices=("linhas", "compacto"), default=db.ARMAZENAMENTO,
+                        help="Formato de gravação das respostas (padrão: DB_ARMAZENAMENTO).")
+    parser.add_argument("--resetar", action="store_true", help="Apaga e recria o esquema antes da simulação.")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", type=Path, help="Grava o relatório em JSON.")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("informe o banco de teste com --database-url ou BENCH_DATABASE_URL.")
+    os.environ["DATABASE_URL"] = args.database_url
+    db.ARMAZENAMENTO = args.armazenamento
+    if args.resetar:
+        migracoes.resetar_banco()
+    else:
+        migracoes.garantir_esquema()
+
+    relatorio = simular(
+        args.database_url, args.usuarios, args.empresas, args.respondentes,
+        pausa=args.pausa, prob_media=args.prob_media, semente=args.semente
+    )
+    imprimir(relatorio)
+    if args.saida:
+        args.saida.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Gerador de dados sintéticos para os benchmarks: N empresas × M respondentes.
+
+Cada empresa tem um perfil (nota média por variável) e cada respondente varia em torno
+dele, para que as médias por empresa e as zonas de maturidade tenham alguma dispersão.
+"""
+
+import numpy as np
+
+from src.perguntas import perguntas as perguntas_padrao
+
+
+def gerar_notas(num_empresas, respondentes_por_empresa, semente=42, perguntas=perguntas_padrao):
+    """
+    Matriz de notas (N·M, 70) na ordem do questionário e o índice da empresa de cada linha.
+    """
+    rng = np.random.default_rng(semente)
+    tamanhos = [len(lista) for lista in perguntas.values()]
+    perfis = rng.uniform(1.0, 4.5, size=(num_empresas, len(tamanhos)))
+    empresa_de = np.repeat(np.arange(num_empresas), respondentes_por_empresa)
+    medias = np.repeat(perfis[empresa_de], tamanhos, axis=1)
+    ruido = rng.normal(0.0, 1.0, size=medias.shape)
+    notas = np.clip(np.rint(medias + ruido), 0, 5).astype(int)
+    return notas, empresa_de
+
+
+def gerar_diagnosticos(num_empresas, respondentes_por_empresa, semente=42, perguntas=perguntas_padrao):
+    """
+    Diagnósticos sintéticos no formato de db.salvar_diagnosticos.
+    :return: Lista de (empresa, responsavel, respostas, matricula)
+    """
+    notas, empresa_de = gerar_notas(num_empresas, respondentes_por_empresa, semente, perguntas)
+    faixas = []
+    inicio = 0
+    for var, lista in perguntas.items():
+        faixas.append((var, inicio, [peso for _, peso in lista]))
+        inicio += len(lista)
+    diagnosticos = []
+    for linha, (notas_linha, empresa) in enumerate(zip(notas.tolist(), empresa_de.tolist())):
+        respondente = linha % respondentes_por_empresa
+        respostas = {
+            var: list(zip(notas_linha[inicio:inicio + len(pesos)], pesos)) for var, inicio, pesos in faixas
+        }
+        diagnosticos.append((
+            f"Empresa {empresa:04d}",
+            f"Respondente {respondente:05d}",
+            respostas,
+            f"M{empresa:04d}{respondente:05d}",
+        ))
+    return diagnosticos
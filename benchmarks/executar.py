@@ -0,0 +1,235 @@
+"""
+Benchmarks dos caminhos críticos de cálculo e persistência.
+
+Rodam contra um PostgreSQL descartável: o esquema é recriado do zero no início (todas as
+tabelas do app são apagadas). O banco é informado com --database-url ou BENCH_DATABASE_URL;
+DATABASE_URL nunca é usada, para não apagar dados reais por engano.
+
+    python -m benchmarks.executar --database-url postgresql://localhost/drexus_bench
+    python -m benchmarks.executar --empresas 50 --respondentes 200 --salvar-baseline
+
+Para cada caminho são relatados os percentis de latência (p50/p95/p99), operações/s e linhas
+de resposta/s. Se existir uma baseline salva (benchmarks/baseline.json), os resultados são
+comparados com ela: p50, p95 ou vazão piores que a tolerância contam como regressão e o
+comando termina com código 1.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src import db, migracoes
+from src.calculos import calcular_dimensoes, calcular_medias, calcular_rexp, pontuar_lote
+from src.sensibilidade import ganhos_lote
+
+from .dados import gerar_diagnosticos, gerar_notas
+
+BASELINE_PADRAO = Path(__file__).resolve().parent / "baseline.json"
+TOLERANCIA_PADRAO = 0.20
+TAMANHO_LOTE = 1000
+NUM_PERGUNTAS = 70
+# Linhas lidas pelas consultas da empresa no PostgreSQL, que vêm dos agregados e não dependem
+# do número de respondentes: agregados_empresa_totais + uma linha de agregados_empresa por pergunta
+LINHAS_MEDIA_EMPRESA = 1 + NUM_PERGUNTAS
+LINHAS_DISTRIBUICAO_EMPRESA = NUM_PERGUNTAS
+
+
+def resumir(duracoes, linhas_por_operacao=NUM_PERGUNTAS, operacoes_por_medicao=1):
+    """
+    Percentis de latência (ms) e vazão de uma lista de durações (s).
+    :param linhas_por_operacao: Linhas lidas ou gravadas pelo banco em cada operação
+    :param operacoes_por_medicao: Operações cobertas por cada duração (ex.: tamanho do lote)
+    """
+    duracoes = np.asarray(duracoes, dtype=float)
+    total = float(duracoes.sum())
+    operacoes = len(duracoes) * operacoes_por_medicao
+    ops_s = operacoes / total if total > 0 else 0.0
+    p50, p95, p99 = np.percentile(duracoes * 1000, [50, 95, 99])
+    return {
+        "n": int(len(duracoes)),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "media_ms": round(float(duracoes.mean() * 1000), 3),
+        "ops_s": round(ops_s, 1),
+        "linhas_s": round(ops_s * linhas_por_operacao, 1),
+    }
+
+
+def medir(funcao, argumentos):
+    """
+    Executa funcao(*args) para cada item de `argumentos` e devolve as durações (s).
+    """
+    duracoes = []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        funcao(*args)
+        duracoes.append(time.perf_counter() - inicio)
+    return duracoes
+
+
+def _calcular(respostas):
+    medias = calcular_medias(respostas)
+    calcular_rexp(medias)
+    calcular_dimensoes(medias)
+
+
+def executar(num_empresas, respondentes_por_empresa, amostra, semente=42):
+    """
+    Recria o esquema, gera os dados e mede cada caminho.
+    :return: Dicionário {"parametros": ..., "resultados": {nome: métricas}}
+    """
+    rng = random.Random(semente)
+    diagnosticos = gerar_diagnosticos(num_empresas, respondentes_por_empresa, semente)
+    notas, _ = gerar_notas(num_empresas, respondentes_por_empresa, semente)
+    empresas = sorted({empresa for empresa, _, _, _ in diagnosticos})
+    individuais = diagnosticos[:amostra]
+    em_lote = diagnosticos[amostra:]
+    resultados = {}
+
+    print(f"Recriando o esquema e gerando {len(diagnosticos)} diagnósticos sintéticos...")
+    migracoes.resetar_banco()
+
+    sorteados = rng.sample(diagnosticos, min(amostra, len(diagnosticos)))
+    resultados["calculos (por diagnóstico)"] = resumir(
+        medir(_calcular, [(respostas,) for _, _, respostas, _ in sorteados])
+    )
+    resultados["pontuar_lote"] = resumir(
+        medir(pontuar_lote, [(notas,)] * 5), operacoes_por_medicao=len(notas)
+    )
+    resultados["ganhos_lote (sensibilidade)"] = resumir(
+        medir(ganhos_lote, [(notas,)] * 5), operacoes_por_medicao=len(notas)
+    )
+    resultados["salvar_diagnostico"] = resumir(
+        medir(db.salvar_diagnostico, individuais)
+    )
+    if em_lote:
+        lotes = [(em_lote[i:i + TAMANHO_LOTE],) for i in range(0, len(em_lote), TAMANHO_LOTE)]
+        duracoes = medir(db.salvar_diagnosticos, lotes)
+        metricas = resumir(duracoes)
+        metricas["ops_s"] = round(len(em_lote) / sum(duracoes), 1)
+        metricas["linhas_s"] = round(metricas["ops_s"] * NUM_PERGUNTAS, 1)
+        resultados[f"salvar_diagnosticos (lotes de {TAMANHO_LOTE})"] = metricas
+    resultados["buscar_ultimo_diagnostico"] = resumir(
+        medir(db.buscar_ultimo_diagnostico, [
+            (empresa, responsavel, matricula)
+            for empresa, responsavel, _, matricula in rng.choices(diagnosticos, k=amostra)
+        ])
+    )
+    resultados["buscar_ultima_pontuacao"] = resumir(
+        medir(db.buscar_ultima_pontuacao, [
+            (empresa, responsavel, matricula)
+            for empresa, responsavel, _, matricula in rng.choices(diagnosticos, k=amostra)
+        ]),
+        linhas_por_operacao=1
+    )
+    resultados["buscar_media_empresa"] = resumir(
+        medir(db.buscar_media_empresa, [(empresa,) for empresa in rng.choices(empresas, k=amostra)]),
+        linhas_por_operacao=LINHAS_MEDIA_EMPRESA
+    )
+    resultados["buscar_distribuicao_empresa"] = resumir(
+        medir(db.buscar_distribuicao_empresa, [(empresa,) for empresa in rng.choices(empresas, k=amostra)]),
+        linhas_por_operacao=LINHAS_DISTRIBUICAO_EMPRESA
+    )
+    resultados["buscar_ranking_empresas"] = resumir(
+        medir(db.buscar_ranking_empresas, [
+            (rng.choice(db.ORDENACOES_RANKING), rng.random() < 0.5) for _ in range(amostra)
+        ]),
+        linhas_por_operacao=1
+    )
+    return {
+        "parametros": {
+            "empresas": num_empresas,
+            "respondentes": respondentes_por_empresa,
+            "amostra": amostra,
+            "armazenamento": db.ARMAZENAMENTO,
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar(atual, baseline, tolerancia=TOLERANCIA_PADRAO):
+    """
+    Compara com a baseline: latências (p50, p95) maiores ou vazão menor que a tolerância
+    relativa contam como regressão.
+    :return: Lista de textos descrevendo as regressões
+    """
+    if atual["parametros"] != baseline.get("parametros"):
+        print(f"Atenção: parâmetros diferentes da baseline ({baseline.get('parametros')}); "
+              "a comparação pode não ser significativa.")
+    regressoes = []
+    print(f"\n{'Comparação com a baseline':<44}{'p50':>10}{'p95':>10}{'ops/s':>10}")
+    for nome, metricas in atual["resultados"].items():
+        base = baseline.get("resultados", {}).get(nome)
+        if base is None:
+            print(f"{nome:<44}{'(novo)':>10}")
+            continue
+        variacoes = {
+            chave: (metricas[chave] - base[chave]) / base[chave] if base[chave] else 0.0
+            for chave in ("p50_ms", "p95_ms", "ops_s")
+        }
+        print(f"{nome:<44}" + "".join(f"{variacoes[c]:>+10.1%}" for c in ("p50_ms", "p95_ms", "ops_s")))
+        for chave in ("p50_ms", "p95_ms"):
+            if variacoes[chave] > tolerancia:
+                regressoes.append(f"{nome}: {chave} {base[chave]} -> {metricas[chave]} ({variacoes[chave]:+.1%})")
+        if base["ops_s"] and metricas["ops_s"] < base["ops_s"] / (1 + tolerancia):
+            regressoes.append(f"{nome}: ops_s {base['ops_s']} -> {metricas['ops_s']} ({variacoes['ops_s']:+.1%})")
+    return regressoes
+
+
+def imprimir(resultado):
+    print(f"\n{'Caminho':<44}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>11}{'linhas/s':>13}")
+    for nome, m in resultado["resultados"].items():
+        print(f"{nome:<44}{m['n']:>7}{m['p50_ms']:>10.3f}{m['p95_ms']:>10.3f}{m['p99_ms']:>10.3f}"
+              f"{m['ops_s']:>11.1f}{m['linhas_s']:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de cálculo e persistência do DREXUS ICE³-R.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="PostgreSQL descartável (padrão: BENCH_DATABASE_URL). O esquema é apagado.")
+    parser.add_argument("--empresas", type=int, default=20, help="Número de empresas (padrão 20).")
+    parser.add_argument("--respondentes", type=int, default=100, help="Respondentes por empresa (padrão 100).")
+    parser.add_argument("--amostra", type=int, default=300,
+                        help="Operações medidas individualmente por caminho (padrão 300).")
+    parser.add_argument("--armazenamento", choices=("linhas", "compacto"), default=db.ARMAZENAMENTO,
+                        help="Formato de gravação das respostas (padrão: DB_ARMAZENAMENTO).")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PADRAO, help="Arquivo da baseline.")
+    parser.add_argument("--salvar-baseline", action="store_true", help="Grava os resultados como nova baseline.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PADRAO,
+                        help=f"Piora relativa aceita antes de acusar regressão (padrão {TOLERANCIA_PADRAO}).")
+    parser.add_argument("--saida", type=Path, help="Grava os resultados desta execução em JSON.")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("informe um banco descartável com --database-url ou BENCH_DATABASE_URL.")
+    os.environ["DATABASE_URL"] = args.database_url
+    db.ARMAZENAMENTO = args.armazenamento
+
+    resultado = executar(args.empresas, args.respondentes, args.amostra, args.semente)
+    imprimir(resultado)
+    if args.saida:
+        args.saida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+    if args.salvar_baseline:
+        args.baseline.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nBaseline gravada em {args.baseline}.")
+        return
+    if args.baseline.exists():
+        regressoes = comparar(resultado, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerancia)
+        if regressoes:
+            print("\nRegressões acima da tolerância:")
+            for regressao in regressoes:
+                print(f"  {regressao}")
+            sys.exit(1)
+        print("\nSem regressões acima da tolerância.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+-- Referência do esquema na versão mais recente.
+-- A fonte oficial são as migrações versionadas em src/migracoes.py:
+--     python -m src.migracoes
+
 -- Criação da tabela de organizações/empresas
 CREATE TABLE IF NOT EXISTS organizacoes (
     id SERIAL PRIMARY KEY,
     nome TEXT NOT NULL,
     responsavel TEXT NOT NULL,
-    criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    matricula TEXT NOT NULL DEFAULT '',
+    criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- SHA-256 de respondente + respostas + dia do envio (NULL em diagnósticos importados)
+    impressao CHAR(64)
 );
 
 -- Criação da tabela de respostas dos diagnósticos
@@ -17,6 +24,144 @@ CREATE TABLE IF NOT EXISTS respostas_diagnostico (
     respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Armazenamento compacto (DB_ARMAZENAMENTO=compacto): uma linha por diagnóstico,
+-- com as notas em array e os pesos na versão do questionário
+CREATE TABLE IF NOT EXISTS questionarios (
+    versao SERIAL PRIMARY KEY,
+    variaveis VARCHAR(10)[] NOT NULL,
+    numeros SMALLINT[] NOT NULL,
+    pesos NUMERIC(4,2)[] NOT NULL,
+    criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (variaveis, numeros, pesos)
+);
+CREATE TABLE IF NOT EXISTS diagnosticos_compactos (
+    organizacao_id INTEGER PRIMARY KEY REFERENCES organizacoes(id) ON DELETE CASCADE,
+    questionario_versao INTEGER NOT NULL REFERENCES questionarios(versao),
+    notas SMALLINT[70] NOT NULL CHECK (0 <= ALL(notas) AND 5 >= ALL(notas)),
+    respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT diagnosticos_compactos_num_notas CHECK (array_length(notas, 1) = 70)
+);
+
+-- Respostas nos dois formatos, uma linha por pergunta
+CREATE OR REPLACE VIEW respostas_expandidas AS
+    SELECT organizacao_id, variavel, pergunta_numero, nota, peso
+    FROM respostas_diagnostico
+    UNION ALL
+    SELECT d.organizacao_id, q.variaveis[i], q.numeros[i]::integer, d.notas[i]::integer, q.pesos[i]
+    FROM diagnosticos_compactos d
+    JOIN questionarios q ON q.versao = d.questionario_versao
+    CROSS JOIN LATERAL generate_subscripts(d.notas, 1) AS i;
+
 -- Índices para busca rápida
-CREATE INDEX IF NOT EXISTS idx_org_nome_resp ON organizacoes (nome, responsavel);
-CREATE INDEX IF NOT EXISTS idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_org_respondente_criado
+    ON organizacoes (nome, responsavel, matricula, criado_em DESC) INCLUDE (id);
+CREATE INDEX IF NOT EXISTS idx_org_empresa ON organizacoes (LOWER(TRIM(nome)));
+CREATE UNIQUE INDEX IF NOT EXISTS idx_org_impressao ON organizacoes (impressao);
+CREATE INDEX IF NOT EXISTS idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
+
+-- Agregados por empresa (nome normalizado), atualizados a cada diagnóstico salvo
+CREATE TABLE IF NOT EXISTS agregados_empresa (
+    empresa TEXT NOT NULL,
+    variavel VARCHAR(10) NOT NULL,
+    pergunta_numero INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    soma_notas BIGINT NOT NULL DEFAULT 0,
+    soma_pesos NUMERIC NOT NULL DEFAULT 0,
+    -- Histograma: número de respostas com cada nota
+    qtd_nota_0 INTEGER NOT NULL DEFAULT 0,
+    qtd_nota_1 INTEGER NOT NULL DEFAULT 0,
+    qtd_nota_2 INTEGER NOT NULL DEFAULT 0,
+    qtd_nota_3 INTEGER NOT NULL DEFAULT 0,
+    qtd_nota_4 INTEGER NOT NULL DEFAULT 0,
+    qtd_nota_5 INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (empresa, variavel, pergunta_numero)
+);
+CREATE TABLE IF NOT EXISTS agregados_empresa_totais (
+    empresa TEXT PRIMARY KEY,
+    num_diagnosticos INTEGER NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Cache dos resumos gerados pela IA (chave = hash das mensagens e parâmetros do modelo)
+CREATE TABLE IF NOT EXISTS resumos_cache (
+    chave CHAR(64) PRIMARY KEY,
+    empresa TEXT,
+    modelo TEXT NOT NULL,
+    resumo TEXT NOT NULL,
+    criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expira_em TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_resumos_cache_empresa ON resumos_cache (empresa);
+
+-- Progresso das importações em lote (python -m src.importacao), para retomar após uma falha
+CREATE TABLE IF NOT EXISTS importacoes (
+    chave CHAR(64) PRIMARY KEY,
+    arquivo TEXT NOT NULL,
+    linhas_processadas INTEGER NOT NULL DEFAULT 0,
+    importados INTEGER NOT NULL DEFAULT 0,
+    rejeitados INTEGER NOT NULL DEFAULT 0,
+    concluida BOOLEAN NOT NULL DEFAULT FALSE,
+    iniciada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    atualizada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Pontuações de cada diagnóstico (médias, Rexp, zona e dimensões), calculadas ao salvar
+CREATE TABLE IF NOT EXISTS pontuacoes (
+    organizacao_id INTEGER PRIMARY KEY REFERENCES organizacoes(id) ON DELETE CASCADE,
+    media_if DOUBLE PRECISION NOT NULL,
+    media_cm DOUBLE PRECISION NOT NULL,
+    media_et DOUBLE PRECISION NOT NULL,
+    media_dreq DOUBLE PRECISION NOT NULL,
+    media_lc DOUBLE PRECISION NOT NULL,
+    media_im DOUBLE PRECISION NOT NULL,
+    media_pv DOUBLE PRECISION NOT NULL,
+    rexp DOUBLE PRECISION,
+    zona TEXT NOT NULL,
+    cognitiva DOUBLE PRECISION NOT NULL,
+    estrategica DOUBLE PRECISION NOT NULL,
+    operacional DOUBLE PRECISION NOT NULL,
+    cultural DOUBLE PRECISION NOT NULL,
+    calculado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Soma das pontuações por empresa (nome normalizado) e mês, atualizada a cada diagnóstico salvo
+CREATE TABLE IF NOT EXISTS pontuacoes_periodo (
+    empresa TEXT NOT NULL,
+    periodo DATE NOT NULL,
+    num_diagnosticos INTEGER NOT NULL DEFAULT 0,
+    num_rexp INTEGER NOT NULL DEFAULT 0,
+    soma_rexp DOUBLE PRECISION NOT NULL DEFAULT 0,
+    soma_cognitiva DOUBLE PRECISION NOT NULL DEFAULT 0,
+    soma_estrategica DOUBLE PRECISION NOT NULL DEFAULT 0,
+    soma_operacional DOUBLE PRECISION NOT NULL DEFAULT 0,
+    soma_cultural DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (empresa, periodo)
+);
+
+-- Pontuação de cada empresa calculada sobre as médias por pergunta (painel de empresas)
+CREATE TABLE IF NOT EXISTS pontuacoes_empresa (
+    empresa TEXT PRIMARY KEY,
+    num_diagnosticos INTEGER NOT NULL,
+    media_if DOUBLE PRECISION NOT NULL,
+    media_cm DOUBLE PRECISION NOT NULL,
+    media_et DOUBLE PRECISION NOT NULL,
+    media_dreq DOUBLE PRECISION NOT NULL,
+    media_lc DOUBLE PRECISION NOT NULL,
+    media_im DOUBLE PRECISION NOT NULL,
+    media_pv DOUBLE PRECISION NOT NULL,
+    rexp DOUBLE PRECISION,
+    zona TEXT NOT NULL,
+    cognitiva DOUBLE PRECISION NOT NULL,
+    estrategica DOUBLE PRECISION NOT NULL,
+    operacional DOUBLE PRECISION NOT NULL,
+    cultural DOUBLE PRECISION NOT NULL,
+    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_pontuacoes_empresa_rexp ON pontuacoes_empresa (rexp DESC NULLS LAST);
+
+-- Versões de migração aplicadas
+CREATE TABLE IF NOT EXISTS schema_version (
+    versao INTEGER PRIMARY KEY,
+    descricao TEXT NOT NULL,
+    aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
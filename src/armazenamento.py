@@ -0,0 +1,441 @@
+"""
+Backends de armazenamento dos diagnósticos.
+
+O app usa a interface Armazenamento, e não o banco diretamente. Há duas implementações:
+- ArmazenamentoPostgres: o PostgreSQL de DATABASE_URL, com as migrações, os agregados e o
+  pool de src/db.py (produção);
+- ArmazenamentoSQLite: um arquivo SQLite local, sem serviço externo (demonstrações,
+  oficinas sem conexão, desenvolvimento). As médias e rankings são calculados na leitura,
+  o que basta para os volumes de uma instalação local.
+
+O backend é escolhido pela DATABASE_URL: `sqlite:///caminho/drexus.db` usa o arquivo
+(criado se não existir); qualquer outro valor usa o PostgreSQL.
+
+    DATABASE_URL=sqlite:///drexus.db streamlit run app.py
+"""
+
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from . import db, migracoes
+from .calculos import pontuar_respostas
+from .metricas import medido
+
+PREFIXO_SQLITE = "sqlite:///"
+MEMORIA_SQLITE = ":memory:"
+
+
+class Armazenamento(ABC):
+    """
+    Operações de persistência usadas pelo app. Os formatos de entrada e saída são os
+    das funções de mesmo nome em src/db.py. Um backend que não implemente todas não
+    pode ser instanciado.
+    """
+
+    nome = None
+
+    @abstractmethod
+    def garantir_esquema(self):
+        """
+        Cria ou atualiza o esquema (uma vez por processo).
+        """
+        ...
+
+    @abstractmethod
+    def resetar(self):
+        """
+        Apaga todos os dados e recria o esquema.
+        """
+        ...
+
+    @abstractmethod
+    def salvar_diagnostico(self, empresa, responsavel, respostas, matricula=""):
+        """
+        :return: True se o diagnóstico foi gravado, False se era um envio duplicado
+        """
+        ...
+
+    @abstractmethod
+    def buscar_ultimo_diagnostico(self, empresa, responsavel, matricula=None):
+        ...
+
+    @abstractmethod
+    def buscar_media_empresa(self, nome_empresa):
+        ...
+
+    @abstractmethod
+    def buscar_distribuicao_empresa(self, nome_empresa):
+        ...
+
+    @abstractmethod
+    def buscar_ultima_pontuacao(self, empresa, responsavel, matricula=None):
+        ...
+
+    @abstractmethod
+    def buscar_tendencia(self, empresa, responsavel=None, matricula=None, periodo="trimestre"):
+        ...
+
+    @abstractmethod
+    def buscar_ranking_empresas(self, ordenar_por="rexp", decrescente=True, busca=None, zona=None,
+                                min_diagnosticos=1, pagina=1, por_pagina=20):
+        ...
+
+
+class ArmazenamentoPostgres(Armazenamento):
+    """
+    PostgreSQL (DATABASE_URL): delega para src/db.py e src/migracoes.py.
+    """
+
+    nome = "postgres"
+
+    def garantir_esquema(self):
+        migracoes.garantir_esquema()
+
+    def resetar(self):
+        migracoes.resetar_banco()
+
+    def salvar_diagnostico(self, empresa, responsavel, respostas, matricula=""):
+        return db.salvar_diagnostico(empresa, responsavel, respostas, matricula)
+
+    def buscar_ultimo_diagnostico(self, empresa, responsavel, matricula=None):
+        return db.buscar_ultimo_diagnostico(empresa, responsavel, matricula)
+
+    def buscar_media_empresa(self, nome_empresa):
+        return db.buscar_media_empresa(nome_empresa)
+
+    def buscar_distribuicao_empresa(self, nome_empresa):
+        return db.buscar_distribuicao_empresa(nome_empresa)
+
+    def buscar_ultima_pontuacao(self, empresa, responsavel, matricula=None):
+        return db.buscar_ultima_pontuacao(empresa, responsavel, matricula)
+
+    def buscar_tendencia(self, empresa, responsavel=None, matricula=None, periodo="trimestre"):
+        return db.buscar_tendencia(empresa, responsavel, matricula, periodo)
+
+    def buscar_ranking_empresas(self, ordenar_por="rexp", decrescente=True, busca=None, zona=None,
+                                min_diagnosticos=1, pagina=1, por_pagina=20):
+        return db.buscar_ranking_empresas(ordenar_por, decrescente, busca, zona, min_diagnosticos,
+                                          pagina, por_pagina)
+
+
+_COLUNAS_PONTUACAO = db.COLUNAS_MEDIAS + ["rexp", "zona"] + db.COLUNAS_DIMENSOES
+
+ESQUEMA_SQLITE = f"""
+    CREATE TABLE IF NOT EXISTS organizacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT NOT NULL,
+        responsavel TEXT NOT NULL,
+        matricula TEXT NOT NULL DEFAULT '',
+        empresa TEXT NOT NULL,  -- nome normalizado (db.normalizar_empresa)
+        criado_em TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+        impressao TEXT UNIQUE
+    );
+    CREATE INDEX IF NOT EXISTS idx_org_respondente_criado
+        ON organizacoes (nome, responsavel, matricula, criado_em DESC);
+    CREATE INDEX IF NOT EXISTS idx_org_empresa ON organizacoes (empresa);
+    CREATE TABLE IF NOT EXISTS respostas_diagnostico (
+        organizacao_id INTEGER NOT NULL REFERENCES organizacoes(id) ON DELETE CASCADE,
+        variavel TEXT NOT NULL,
+        pergunta_numero INTEGER NOT NULL,
+        nota INTEGER CHECK (nota >= 0 AND nota <= 5),
+        peso REAL,
+        PRIMARY KEY (organizacao_id, variavel, pergunta_numero)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS pontuacoes (
+        organizacao_id INTEGER PRIMARY KEY REFERENCES organizacoes(id) ON DELETE CASCADE,
+        {", ".join(f"{coluna} {'TEXT NOT NULL' if coluna == 'zona' else 'REAL'}" for coluna in _COLUNAS_PONTUACAO)}
+    );
+"""
+TABELAS_SQLITE = ["pontuacoes", "respostas_diagnostico", "organizacoes"]
+
+
+def _inicio_periodo(momento, periodo):
+    """
+    Primeiro dia do mês, trimestre ou ano de `momento`.
+    """
+    if periodo == "mes":
+        return date(momento.year, momento.month, 1)
+    if periodo == "trimestre":
+        return date(momento.year, 3 * ((momento.month - 1) // 3) + 1, 1)
+    return date(momento.year, 1, 1)
+
+
+def _media(valores):
+    valores = [valor for valor in valores if valor is not None]
+    return round(sum(valores) / len(valores), 3) if valores else None
+
+
+class ArmazenamentoSQLite(Armazenamento):
+    """
+    Arquivo SQLite local. Cada operação abre a própria conexão (as sessões do Streamlit
+    rodam em threads diferentes); o modo WAL permite leituras durante as gravações.
+    Com caminho ":memory:" (testes), o banco vive em uma única conexão compartilhada,
+    usada por uma operação de cada vez.
+    """
+
+    nome = "sqlite"
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._esquema_ok = False
+        self._esquema_lock = threading.Lock()
+        self._memoria = None
+        self._memoria_lock = threading.RLock()
+        if caminho == MEMORIA_SQLITE:
+            self._memoria = self._conectar()
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.caminho, timeout=30, check_same_thread=self.caminho != MEMORIA_SQLITE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @contextmanager
+    def _conexao(self):
+        if self._memoria is not None:
+            with self._memoria_lock, self._memoria:  # commit ao final, rollback em caso de erro
+                yield self._memoria
+            return
+        conn = self._conectar()
+        try:
+            with conn:  # commit ao final, rollback em caso de erro
+                yield conn
+        finally:
+            conn.close()
+
+    def garantir_esquema(self):
+        if self._esquema_ok:
+            return
+        with self._esquema_lock:
+            if not self._esquema_ok:
+                with self._conexao() as conn:
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    conn.executescript(ESQUEMA_SQLITE)
+                self._esquema_ok = True
+
+    def resetar(self):
+        with self._esquema_lock:
+            with self._conexao() as conn:
+                for tabela in TABELAS_SQLITE:
+                    conn.execute(f"DROP TABLE IF EXISTS {tabela}")
+            self._esquema_ok = False
+        self.garantir_esquema()
+
+    @staticmethod
+    def _ultimo(matricula):
+        """
+        Subconsulta do id do último diagnóstico do respondente, e seus parâmetros.
+        """
+        filtro_matricula = "AND matricula = ?" if matricula is not None else ""
+        return f"""
+            SELECT id FROM organizacoes
+            WHERE nome = ? AND responsavel = ? {filtro_matricula}
+            ORDER BY criado_em DESC, id DESC LIMIT 1
+        """
+
+    @medido("sqlite.salvar_diagnostico")
+    def salvar_diagnostico(self, empresa, responsavel, respostas, matricula=""):
+        self.garantir_esquema()
+        impressao = db.impressao_diagnostico(empresa, responsavel, matricula, respostas)
+        with self._conexao() as conn:
+            cur = conn.execute("""
+                INSERT INTO organizacoes (nome, responsavel, matricula, empresa, impressao)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (impressao) DO NOTHING
+            """, (empresa, responsavel, matricula, db.normalizar_empresa(empresa), impressao))
+            if cur.rowcount == 0:
+                return False
+            org_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO respostas_diagnostico VALUES (?, ?, ?, ?, ?)",
+                db._linhas_respostas(org_id, respostas)
+            )
+            linha = db._linhas_pontuacao([org_id], pontuar_respostas([respostas]))[0]
+            conn.execute(
+                f"INSERT INTO pontuacoes (organizacao_id, {', '.join(_COLUNAS_PONTUACAO)}) "
+                f"VALUES ({', '.join('?' * len(linha))})",
+                linha
+            )
+        return True
+
+    @medido("sqlite.buscar_ultimo_diagnostico")
+    def buscar_ultimo_diagnostico(self, empresa, responsavel, matricula=None):
+        self.garantir_esquema()
+        params = (empresa, responsavel) + ((matricula,) if matricula is not None else ())
+        with self._conexao() as conn:
+            linhas = conn.execute(f"""
+                SELECT variavel, nota, peso FROM respostas_diagnostico
+                WHERE organizacao_id = ({self._ultimo(matricula)})
+                ORDER BY variavel, pergunta_numero
+            """, params).fetchall()
+        if not linhas:
+            return None
+        respostas = {}
+        for var, nota, peso in linhas:
+            respostas.setdefault(var, []).append((nota, peso))
+        return respostas
+
+    @medido("sqlite.buscar_media_empresa")
+    def buscar_media_empresa(self, nome_empresa):
+        self.garantir_esquema()
+        chave = db.normalizar_empresa(nome_empresa)
+        with self._conexao() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM organizacoes WHERE empresa = ?", (chave,)).fetchone()[0]
+            if not total:
+                return None, 0
+            linhas = conn.execute("""
+                SELECT r.variavel, r.pergunta_numero, AVG(r.nota), AVG(r.peso)
+                FROM organizacoes o
+                JOIN respostas_diagnostico r ON r.organizacao_id = o.id
+                WHERE o.empresa = ? AND r.nota IS NOT NULL
+                GROUP BY r.variavel, r.pergunta_numero
+            """, (chave,)).fetchall()
+        agregados = {(var, num): (media_nota, media_peso) for var, num, media_nota, media_peso in linhas}
+        return db._medias_perguntas(agregados), total
+
+    @medido("sqlite.buscar_distribuicao_empresa")
+    def buscar_distribuicao_empresa(self, nome_empresa):
+        self.garantir_esquema()
+        chave = db.normalizar_empresa(nome_empresa)
+        with self._conexao() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM organizacoes WHERE empresa = ?", (chave,)).fetchone()[0]
+            if not total:
+                return None, 0
+            # Uma passada agrupada por pergunta e nota
+            linhas = conn.execute("""
+                SELECT r.variavel, r.pergunta_numero, r.nota, COUNT(*)
+                FROM organizacoes o
+                JOIN respostas_diagnostico r ON r.organizacao_id = o.id
+                WHERE o.empresa = ? AND r.nota IS NOT NULL
+                GROUP BY r.variavel, r.pergunta_numero, r.nota
+            """, (chave,)).fetchall()
+        contagens = {}
+        for var, num, nota, quantidade in linhas:
+            contagens.setdefault((var, num), [0] * len(db.COLUNAS_HISTOGRAMA))[nota] = quantidade
+        return db._distribuicao(contagens), total
+
+    @medido("sqlite.buscar_ultima_pontuacao")
+    def buscar_ultima_pontuacao(self, empresa, responsavel, matricula=None):
+        self.garantir_esquema()
+        params = (empresa, responsavel) + ((matricula,) if matricula is not None else ())
+        with self._conexao() as conn:
+            linha = conn.execute(
+                f"SELECT * FROM pontuacoes WHERE organizacao_id = ({self._ultimo(matricula)})", params
+            ).fetchone()
+        return db._pontuacao(linha) if linha else None
+
+    @medido("sqlite.buscar_tendencia")
+    def buscar_tendencia(self, empresa, responsavel=None, matricula=None, periodo="trimestre"):
+        if periodo not in db.PERIODOS:
+            raise Exception(f"Período inválido: {periodo!r} (use {', '.join(db.PERIODOS)}).")
+        self.garantir_esquema()
+        if responsavel is None:
+            filtro, params = "o.empresa = ?", (db.normalizar_empresa(empresa),)
+        else:
+            filtro = "o.nome = ? AND o.responsavel = ?" + (" AND o.matricula = ?" if matricula is not None else "")
+            params = (empresa, responsavel) + ((matricula,) if matricula is not None else ())
+        with self._conexao() as conn:
+            linhas = conn.execute(f"""
+                SELECT o.criado_em, p.rexp, {", ".join(f"p.{coluna}" for coluna in db.COLUNAS_DIMENSOES)}
+                FROM organizacoes o
+                JOIN pontuacoes p ON p.organizacao_id = o.id
+                WHERE {filtro}
+            """, params).fetchall()
+        grupos = {}
+        for criado_em, rexp, *dimensoes in linhas:
+            inicio = _inicio_periodo(datetime.fromisoformat(criado_em), periodo)
+            grupos.setdefault(inicio, []).append((rexp, dimensoes))
+        return [
+            {
+                "periodo": inicio,
+                "num_diagnosticos": len(grupo),
+                "rexp": _media([rexp for rexp, _ in grupo]),
+                "dimensoes": {
+                    dimensao: _media([dimensoes[j] for _, dimensoes in grupo])
+                    for j, dimensao in enumerate(db.DIMENSOES)
+                },
+            }
+            for inicio, grupo in sorted(grupos.items())
+        ]
+
+    @medido("sqlite.buscar_ranking_empresas")
+    def buscar_ranking_empresas(self, ordenar_por="rexp", decrescente=True, busca=None, zona=None,
+                                min_diagnosticos=1, pagina=1, por_pagina=20):
+        if ordenar_por not in db.ORDENACOES_RANKING:
+            raise Exception(f"Ordenação inválida: {ordenar_por!r} (use {', '.join(db.ORDENACOES_RANKING)}).")
+        self.garantir_esquema()
+        with self._conexao() as conn:
+            totais = dict(conn.execute(
+                "SELECT empresa, COUNT(*) FROM organizacoes GROUP BY empresa HAVING COUNT(*) >= ?",
+                (min_diagnosticos,)
+            ).fetchall())
+            agregados = {empresa: {} for empresa in totais}
+            for empresa, var, num, media_nota, media_peso in conn.execute("""
+                SELECT o.empresa, r.variavel, r.pergunta_numero, AVG(r.nota), AVG(r.peso)
+                FROM organizacoes o
+                JOIN respostas_diagnostico r ON r.organizacao_id = o.id
+                WHERE r.nota IS NOT NULL
+                GROUP BY o.empresa, r.variavel, r.pergunta_numero
+            """):
+                if empresa in agregados:
+                    agregados[empresa][(var, num)] = (media_nota, media_peso)
+        if not totais:
+            return [], 0
+        # Mesmo cálculo do diagnóstico da empresa: pontuação sobre as médias por pergunta
+        empresas = sorted(totais)
+        pontuacao = pontuar_respostas([db._medias_perguntas(agregados[empresa]) for empresa in empresas])
+        itens = []
+        for linha in db._linhas_pontuacao(empresas, pontuacao):
+            registro = dict(zip(["empresa"] + _COLUNAS_PONTUACAO, linha), num_diagnosticos=totais[linha[0]])
+            itens.append(registro)
+
+        # Posição como RANK(): empates ficam na mesma posição; valores nulos por último
+        com_valor = sorted((i for i in itens if i[ordenar_por] is not None),
+                           key=lambda i: i[ordenar_por], reverse=decrescente)
+        ordenados = com_valor + [i for i in itens if i[ordenar_por] is None]
+        for n, item in enumerate(ordenados):
+            anterior = ordenados[n - 1] if n else None
+            item["posicao"] = anterior["posicao"] if anterior and anterior[ordenar_por] == item[ordenar_por] else n + 1
+
+        trecho = db.normalizar_empresa(busca) if busca else None
+        filtrados = [
+            item for item in ordenados
+            if (trecho is None or trecho in item["empresa"]) and (not zona or item["zona"] == zona)
+        ]
+        filtrados.sort(key=lambda i: (i["posicao"], i["empresa"]))
+        inicio = (max(pagina, 1) - 1) * por_pagina
+        return [
+            {"posicao": item["posicao"], "empresa": item["empresa"], "num_diagnosticos": item["num_diagnosticos"],
+             **db._pontuacao(item)}
+            for item in filtrados[inicio:inicio + por_pagina]
+        ], len(filtrados)
+
+
+_armazenamento = None
+_armazenamento_lock = threading.Lock()
+
+
+def usa_postgres():
+    """
+    True se DATABASE_URL aponta para o PostgreSQL (e não para um arquivo SQLite).
+    """
+    return not os.getenv("DATABASE_URL", "").startswith(PREFIXO_SQLITE)
+
+
+def obter_armazenamento():
+    """
+    Backend do processo, escolhido pela DATABASE_URL na primeira chamada.
+    """
+    global _armazenamento
+    if _armazenamento is None:
+        with _armazenamento_lock:
+            if _armazenamento is None:
+                if usa_postgres():
+                    _armazenamento = ArmazenamentoPostgres()
+                else:
+                    _armazenamento = ArmazenamentoSQLite(os.environ["DATABASE_URL"][len(PREFIXO_SQLITE):])
+    return _armazenamento
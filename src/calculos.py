@@ -1,25 +1,282 @@
 """
 Funções para cálculo de médias, índice Rexp e dimensões para o diagnóstico ICE³-R + DREXUS.
+
+O motor de cálculo é vetorizado (NumPy) e opera sobre lotes: uma matriz N×70 de notas
+(um diagnóstico por linha) e o vetor de pesos das perguntas. As funções por diagnóstico
+(calcular_medias, calcular_rexp, calcular_dimensoes) são invólucros sobre ele.
 """
 
-def calcular_medias(respostas, variaveis_siglas):
+import numpy as np
+
+from .perguntas import perguntas as perguntas_padrao
+
+# Variáveis usadas na fórmula Rexp = If·Cm·Et·(1 + DREq·(1 + Lc·Im·Pv))
+VARIAVEIS_REXP = ["If", "Cm", "Et", "DREq", "Lc", "Im", "Pv"]
+
+# Pesos de cada variável nas 4 dimensões do radar
+DIMENSOES = {
+    "Cognitiva": {"Lc": 0.5, "Et": 0.3, "DREq": 0.2},
+    "Estratégica": {"Pv": 0.4, "Im": 0.3, "DREq": 0.3},
+    "Operacional": {"If": 0.4, "Cm": 0.3, "Et": 0.3},
+    "Cultural": {"Et": 0.4, "DREq": 0.3, "Pv": 0.3},
+}
+
+# Zonas de maturidade: (limite inferior do Rexp, nome), da maior para a menor
+ZONAS = [
+    (0.80, "Antifragilidade Regenerativa"),
+    (0.60, "Resiliência Estratégica"),
+    (0.40, "Maturidade Tática"),
+    (0.20, "Resiliência Reativa"),
+]
+ZONA_MINIMA = "Fragilidade Total"
+ZONA_NAO_CALCULADA = "Não calculado"
+
+# Notas possíveis de cada pergunta e quantis das distribuições (Q1, mediana, Q3)
+NOTAS_POSSIVEIS = np.arange(6)
+QUARTIS = (0.25, 0.5, 0.75)
+
+
+def _separar(valores):
+    # Divisão de Veltkamp: valores = alto + baixo, cada parte com até 26 bits de mantissa
+    c = 134217729.0 * valores  # 2**27 + 1
+    alto = c - (c - valores)
+    return alto, valores - alto
+
+
+def arredondar_exato(valores, casas=3):
+    """
+    Arredondamento vetorizado com o mesmo resultado do round() do Python: pelo valor exato
+    do float, com empates para o par. np.round arredonda valores·10**casas já arredondado
+    e erra quando esse produto cai exatamente em ,5 sem que o valor exato caia.
+    :param valores: Escalar ou array
+    :return: Array de floats (NaN é preservado)
+    """
+    valores = np.asarray(valores, dtype=float)
+    escala = 10.0 ** casas
+    produto = valores * escala
+    # Erro exato da multiplicação (TwoProduct de Dekker): valores·escala = produto + erro
+    v_alto, v_baixo = _separar(valores)
+    e_alto, e_baixo = _separar(escala)
+    erro = ((v_alto * e_alto - produto) + v_alto * e_baixo + v_baixo * e_alto) + v_baixo * e_baixo
+    inteiros = np.rint(produto)
+    empate = np.abs(produto - np.trunc(produto)) == 0.5
+    inteiros = np.where(empate & (erro > 0), np.ceil(produto), inteiros)
+    inteiros = np.where(empate & (erro < 0), np.floor(produto), inteiros)
+    return inteiros / escala
+
+
+def estrutura_questionario(perguntas=perguntas_padrao):
+    """
+    Descreve o questionário no formato usado pelo motor vetorizado.
+    :param perguntas: Dicionário {variável: [(pergunta, peso), ...]}
+    :return: (variaveis, pesos, grupos) — lista de variáveis na ordem das colunas,
+             vetor de pesos (70,) e índice da variável de cada coluna (70,)
+    """
+    variaveis = list(perguntas.keys())
+    pesos = np.array([peso for var in variaveis for _, peso in perguntas[var]], dtype=float)
+    grupos = np.array([i for i, var in enumerate(variaveis) for _ in perguntas[var]], dtype=np.intp)
+    return variaveis, pesos, grupos
+
+
+def medias_lote(notas, pesos, grupos, num_variaveis, arredondar=True):
+    """
+    Média ponderada de cada variável para N diagnósticos, normalizada para 0-1.
+    :param notas: Matriz (N, K) de notas 0-5
+    :param pesos: Vetor (K,) ou matriz (N, K) de pesos
+    :param grupos: Vetor (K,) com o índice da variável de cada coluna
+    :param num_variaveis: Número de variáveis (V)
+    :param arredondar: Se False, devolve as médias sem arredondar (análise de sensibilidade)
+    :return: Matriz (N, V) de médias arredondadas em 3 casas
+    """
+    notas = np.atleast_2d(np.asarray(notas, dtype=float))
+    pesos = np.broadcast_to(np.asarray(pesos, dtype=float), notas.shape)
+    # Somas acumuladas coluna a coluna, na ordem das perguntas: mesma ordem de soma (e
+    # portanto os mesmos floats) que o cálculo por diagnóstico com sum()
+    soma_pesos = np.zeros((notas.shape[0], num_variaveis))
+    soma_ponderada = np.zeros((notas.shape[0], num_variaveis))
+    for coluna, grupo in enumerate(grupos):
+        soma_pesos[:, grupo] += pesos[:, coluna]
+        soma_ponderada[:, grupo] += notas[:, coluna] * pesos[:, coluna]
+    medias = np.divide(
+        soma_ponderada, soma_pesos,
+        out=np.zeros_like(soma_ponderada), where=soma_pesos > 0
+    )
+    medias = medias / 5  # Normaliza em 0-1
+    return arredondar_exato(medias, 3) if arredondar else medias
+
+
+def colunas_medias(medias, variaveis, nomes, padrao=None):
+    """
+    Extrai as colunas `nomes` de uma matriz de médias; variáveis ausentes viram `padrao`
+    (ou geram KeyError se padrao for None).
+    """
+    posicoes = {var: i for i, var in enumerate(variaveis)}
+    colunas = []
+    for nome in nomes:
+        if nome in posicoes:
+            colunas.append(medias[:, posicoes[nome]])
+        elif padrao is None:
+            raise KeyError(nome)
+        else:
+            colunas.append(np.full(medias.shape[0], padrao, dtype=float))
+    return colunas
+
+
+def rexp_lote(medias, variaveis, arredondar=True):
+    """
+    Índice Rexp para N diagnósticos.
+    :param medias: Matriz (N, V) de médias normalizadas
+    :param variaveis: Nomes das V colunas
+    :param arredondar: Se False, devolve o Rexp sem arredondar
+    :return: Vetor (N,) arredondado em 3 casas (KeyError se faltar variável da fórmula)
+    """
+    medias = np.atleast_2d(np.asarray(medias, dtype=float))
+    if_, cm, et, dreq, lc, im, pv = colunas_medias(medias, variaveis, VARIAVEIS_REXP)
+    rexpb = if_ * cm * et
+    rexpa = 1 + dreq * (1 + lc * im * pv)
+    return arredondar_exato(rexpb * rexpa, 3) if arredondar else rexpb * rexpa
+
+
+def dimensoes_lote(medias, variaveis, arredondar=True):
+    """
+    As 4 dimensões do radar para N diagnósticos (variáveis ausentes contam como 0).
+    :return: Matriz (N, 4) na ordem de DIMENSOES, arredondada em 3 casas (se `arredondar`)
+    """
+    medias = np.atleast_2d(np.asarray(medias, dtype=float))
+    resultado = np.zeros((medias.shape[0], len(DIMENSOES)))
+    for j, composicao in enumerate(DIMENSOES.values()):
+        colunas = colunas_medias(medias, variaveis, composicao, padrao=0.0)
+        for coluna, peso in zip(colunas, composicao.values()):
+            resultado[:, j] += coluna * peso
+    return arredondar_exato(resultado, 3) if arredondar else resultado
+
+
+def zonas_lote(rexp):
+    """
+    Zona de maturidade para um vetor de Rexp (NaN = não calculado).
+    :return: Vetor (N,) de textos
+    """
+    rexp = np.asarray(rexp, dtype=float)
+    zonas = np.full(rexp.shape, ZONA_MINIMA, dtype=object)
+    for limite, nome in reversed(ZONAS):
+        zonas[rexp >= limite] = nome
+    zonas[np.isnan(rexp)] = ZONA_NAO_CALCULADA
+    return zonas
+
+
+def pontuar_lote(notas, pesos=None, perguntas=perguntas_padrao, arredondar=True):
+    """
+    Calcula médias, Rexp, zona e dimensões para N diagnósticos de uma só vez.
+    :param notas: Matriz (N, 70) de notas, colunas na ordem de `perguntas`
+    :param pesos: Vetor (70,) ou matriz (N, 70) de pesos; padrão: pesos de `perguntas`
+    :param perguntas: Dicionário {variável: [(pergunta, peso), ...]}
+    :param arredondar: Se False, nada é arredondado em 3 casas (análise de sensibilidade)
+    :return: Dicionário com "variaveis", "medias" (N, 7), "rexp" (N,), "zonas" (N,),
+             "dimensoes" (nomes) e "valores_dimensoes" (N, 4)
+    """
+    variaveis, pesos_padrao, grupos = estrutura_questionario(perguntas)
+    if pesos is None:
+        pesos = pesos_padrao
+    medias = medias_lote(notas, pesos, grupos, len(variaveis), arredondar)
+    try:
+        rexp = rexp_lote(medias, variaveis, arredondar)
+    except KeyError:
+        rexp = np.full(medias.shape[0], np.nan)
+    return {
+        "variaveis": variaveis,
+        "medias": medias,
+        "rexp": rexp,
+        "zonas": zonas_lote(rexp),
+        "dimensoes": list(DIMENSOES),
+        "valores_dimensoes": dimensoes_lote(medias, variaveis, arredondar),
+    }
+
+
+def matrizes_respostas(lista_respostas, perguntas=perguntas_padrao):
+    """
+    Monta as matrizes de notas e pesos usadas por pontuar_lote a partir de respostas
+    no formato {variável: [(nota, peso), ...]}. Perguntas sem resposta contam como
+    nota 0 com o peso padrão.
+    :param lista_respostas: Lista com as respostas de N diagnósticos
+    :return: (notas, pesos), matrizes (N, 70) na ordem de `perguntas`
+    """
+    _, pesos_padrao, _ = estrutura_questionario(perguntas)
+    posicoes = {}
+    for var, lista in perguntas.items():
+        for i in range(1, len(lista) + 1):
+            posicoes[(var, i)] = len(posicoes)
+    notas = np.zeros((len(lista_respostas), len(pesos_padrao)))
+    pesos = np.tile(pesos_padrao, (len(lista_respostas), 1))
+    for n, respostas in enumerate(lista_respostas):
+        for var, valores in respostas.items():
+            sigla = var.split(" –")[0]
+            for i, (nota, peso) in enumerate(valores, 1):
+                coluna = posicoes.get((sigla, i))
+                if coluna is None:
+                    continue
+                notas[n, coluna] = nota or 0
+                if peso is not None:
+                    pesos[n, coluna] = peso
+    return notas, pesos
+
+
+def pontuar_respostas(lista_respostas, perguntas=perguntas_padrao):
+    """
+    pontuar_lote para N diagnósticos no formato {variável: [(nota, peso), ...]}.
+    """
+    notas, pesos = matrizes_respostas(lista_respostas, perguntas)
+    return pontuar_lote(notas, pesos, perguntas)
+
+
+def estatisticas_histogramas(contagens):
+    """
+    Estatísticas da distribuição das notas de K perguntas a partir dos histogramas, sem
+    expandir as respostas (custo independente do número de respondentes).
+    :param contagens: Matriz (K, 6) com o número de respostas de cada nota (0 a 5)
+    :return: Dicionário com "respondentes" (K,), "media" (K,), "desvio" (K,) (desvio padrão
+             populacional) e "quartis" (K, 3), iguais aos de np.percentile sobre as notas;
+             perguntas sem respostas ficam com NaN
+    """
+    contagens = np.atleast_2d(np.asarray(contagens, dtype=float))
+    total = contagens.sum(axis=1)
+    divisor = np.where(total > 0, total, 1.0)
+    media = contagens @ NOTAS_POSSIVEIS / divisor
+    desvio = np.sqrt(np.clip(contagens @ NOTAS_POSSIVEIS ** 2 / divisor - media ** 2, 0, None))
+
+    # Quantil por interpolação linear entre as posições vizinhas de q·(n-1) nas notas ordenadas;
+    # a nota na posição k é a primeira cuja contagem acumulada passa de k
+    acumulado = contagens.cumsum(axis=1)
+    posicoes = np.outer(np.maximum(total - 1, 0), QUARTIS)
+    inferior, superior = np.floor(posicoes), np.ceil(posicoes)
+    nota_inferior = (acumulado[:, None, :] <= inferior[:, :, None]).sum(axis=2)
+    nota_superior = (acumulado[:, None, :] <= superior[:, :, None]).sum(axis=2)
+    quartis = nota_inferior + (posicoes - inferior) * (nota_superior - nota_inferior)
+
+    sem_respostas = total == 0
+    media[sem_respostas] = np.nan
+    desvio[sem_respostas] = np.nan
+    quartis[sem_respostas] = np.nan
+    return {"respondentes": total.astype(int), "media": media, "desvio": desvio, "quartis": quartis}
+
+
+def calcular_medias(respostas, variaveis_siglas=None):
     """
     Calcula a média ponderada de cada variável, normalizando para 0-1.
     :param respostas: Dicionário {variável: [(nota, peso), ...]}
-    :param variaveis_siglas: Dicionário de nomes para siglas
+    :param variaveis_siglas: Dicionário de nomes para siglas (opcional)
     :return: Dicionário {sigla: média normalizada}
     """
-    medias = {}
-    for var, vals in respostas.items():
-        notas = [nota for nota, peso in vals]
-        pesos = [peso for nota, peso in vals]
-        if sum(pesos) > 0:
-            media = sum(n * p for n, p in zip(notas, pesos)) / sum(pesos)
-        else:
-            media = 0
-        sigla = variaveis_siglas[var] if var in variaveis_siglas else var
-        medias[sigla] = round(media / 5, 3)  # Normaliza em 0-1
-    return medias
+    variaveis_siglas = variaveis_siglas or {}
+    chaves = list(respostas.keys())
+    notas = [float(nota) for var in chaves for nota, _ in respostas[var]]
+    pesos = [float(peso) for var in chaves for _, peso in respostas[var]]
+    grupos = [i for i, var in enumerate(chaves) for _ in respostas[var]]
+    medias = medias_lote([notas], pesos, np.array(grupos, dtype=np.intp), len(chaves))[0]
+    return {
+        variaveis_siglas.get(var, var): float(media)
+        for var, media in zip(chaves, medias)
+    }
+
 
 def calcular_rexp(medias):
     """
@@ -27,44 +284,30 @@ def calcular_rexp(medias):
     :param medias: Dicionário {sigla: média normalizada}
     :return: Valor de Rexp arredondado (float) ou None se incompleto
     """
+    variaveis = list(medias.keys())
     try:
-        rexpb = medias["If"] * medias["Cm"] * medias["Et"]
-        rexpa = 1 + medias["DREq"] * (1 + medias["Lc"] * medias["Im"] * medias["Pv"])
-        rexp = round(rexpb * rexpa, 3)
-        return rexp
+        return float(rexp_lote([list(medias.values())], variaveis)[0])
     except KeyError:
         return None
 
+
 def calcular_dimensoes(medias):
     """
     Calcula as 4 dimensões para o radar.
     :param medias: Dicionário {sigla: média normalizada}
     :return: Dicionário {dimensão: valor}
     """
-    return {
-        "Cognitiva": round(
-            medias.get("Lc", 0) * 0.5 + medias.get("Et", 0) * 0.3 + medias.get("DREq", 0) * 0.2, 3),
-        "Estratégica": round(
-            medias.get("Pv", 0) * 0.4 + medias.get("Im", 0) * 0.3 + medias.get("DREq", 0) * 0.3, 3),
-        "Operacional": round(
-            medias.get("If", 0) * 0.4 + medias.get("Cm", 0) * 0.3 + medias.get("Et", 0) * 0.3, 3),
-        "Cultural": round(
-            medias.get("Et", 0) * 0.4 + medias.get("DREq", 0) * 0.3 + medias.get("Pv", 0) * 0.3, 3),
-    }
+    valores = dimensoes_lote([list(medias.values())], list(medias.keys()))[0]
+    return {dimensao: float(valor) for dimensao, valor in zip(DIMENSOES, valores)}
+
 
 def interpretar_rexp(rexp):
     """
     Retorna o texto da zona de maturidade de acordo com o valor do Rexp.
     """
     if rexp is None:
-        return "Não calculado"
-    elif rexp >= 0.80:
-        return "Antifragilidade Regenerativa"
-    elif rexp >= 0.60:
-        return "Resiliência Estratégica"
-    elif rexp >= 0.40:
-        return "Maturidade Tática"
-    elif rexp >= 0.20:
-        return "Resiliência Reativa"
-    else:
-        return "Fragilidade Total"
\ No newline at end of file
+        return ZONA_NAO_CALCULADA
+    for limite, nome in ZONAS:
+        if rexp >= limite:
+            return nome
+    return ZONA_MINIMA
@@ -0,0 +1,195 @@
+"""
+Índice de busca (BM25) sobre a base de conhecimento DREXUS.
+
+Os arquivos de conhecimento (dossie_drexus_ice3r_dre.md e tudo em conhecimento_Drexus/)
+são divididos em trechos e indexados uma única vez por processo. Para cada resumo,
+apenas os trechos relacionados às variáveis mais fracas do diagnóstico entram no prompt.
+"""
+
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+from .metricas import medido
+from .perguntas import perguntas, nomes_longos
+
+RAIZ = Path(__file__).resolve().parent.parent
+ARQUIVOS_CONHECIMENTO = [RAIZ / "dossie_drexus_ice3r_dre.md"]
+PASTA_CONHECIMENTO = RAIZ / "conhecimento_Drexus"
+
+TAMANHO_TRECHO = 700  # caracteres por trecho
+MAX_CARACTERES_CONTEXTO = int(os.getenv("CONHECIMENTO_MAX_CARACTERES", "2500"))
+NUM_VARIAVEIS_FRACAS = 3
+
+STOPWORDS = set("""
+a ao aos as com como da das de do dos e em entre esta este isso ja mais mas na nas no nos
+o os ou para pela pelas pelo pelos por que se sem ser sob sua suas seu seus um uma umas uns
+ha sao foi tem nao quando cada ate sobre apos
+""".split())
+
+
+def tokenizar(texto):
+    """
+    Minúsculas, sem acentos, sem stopwords.
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", texto) if t not in STOPWORDS and len(t) > 1]
+
+
+def dividir_em_trechos(texto, origem, tamanho=TAMANHO_TRECHO):
+    """
+    Divide o texto em trechos de até `tamanho` caracteres, sem quebrar parágrafos
+    (ou linhas de tabela). Cada trecho leva o título da seção em que começa.
+    """
+    trechos = []
+    titulo = ""
+    atual = []
+
+    def fechar():
+        corpo = "\n".join(atual).strip()
+        if corpo:
+            trechos.append({"origem": origem, "titulo": titulo, "texto": corpo})
+        atual.clear()
+
+    blocos = []
+    for bloco in re.split(r"\n\s*\n", texto):
+        # Tabelas separadas por tabulação: cada linha é um bloco
+        blocos += bloco.split("\n") if "\t" in bloco else [bloco]
+
+    for bloco in blocos:
+        bloco = bloco.strip()
+        if not bloco or set(bloco) <= set("-"):
+            continue
+        if bloco.startswith("#"):
+            fechar()
+            titulo = bloco.lstrip("#").strip()
+            continue
+        if atual and len("\n".join(atual)) + len(bloco) > tamanho:
+            fechar()
+        atual.append(bloco)
+    fechar()
+    return trechos
+
+
+class IndiceConhecimento:
+    """
+    Índice BM25 em memória sobre os trechos da base de conhecimento.
+    """
+
+    def __init__(self, trechos, k1=1.5, b=0.75):
+        self.trechos = trechos
+        self.k1 = k1
+        self.b = b
+        self._frequencias = [Counter(tokenizar(t["titulo"] + " " + t["texto"])) for t in trechos]
+        self._tamanhos = [sum(f.values()) for f in self._frequencias]
+        self._tamanho_medio = sum(self._tamanhos) / len(self._tamanhos) if self._tamanhos else 0
+        documentos = Counter(termo for f in self._frequencias for termo in f)
+        n = len(trechos)
+        self._idf = {
+            termo: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for termo, df in documentos.items()
+        }
+
+    @classmethod
+    @medido("conhecimento.indexar")
+    def dos_arquivos(cls, arquivos=None):
+        """
+        Lê e indexa os arquivos de conhecimento (padrão: dossiê + conhecimento_Drexus/).
+        """
+        if arquivos is None:
+            arquivos = list(ARQUIVOS_CONHECIMENTO)
+            if PASTA_CONHECIMENTO.is_dir():
+                arquivos += sorted(p for p in PASTA_CONHECIMENTO.iterdir() if p.suffix in (".md", ".txt"))
+        trechos = []
+        for caminho in arquivos:
+            with open(caminho, encoding="utf-8") as f:
+                trechos += dividir_em_trechos(f.read(), Path(caminho).name)
+        return cls(trechos)
+
+    def pontuar(self, consulta):
+        """
+        Pontuação BM25 de cada trecho para a consulta.
+        """
+        termos = Counter(tokenizar(consulta))
+        pontuacoes = []
+        for freq, tamanho in zip(self._frequencias, self._tamanhos):
+            total = 0.0
+            for termo, repeticoes in termos.items():
+                tf = freq.get(termo)
+                if not tf:
+                    continue
+                normalizacao = self.k1 * (1 - self.b + self.b * tamanho / self._tamanho_medio)
+                total += repeticoes * self._idf[termo] * tf * (self.k1 + 1) / (tf + normalizacao)
+            pontuacoes.append(total)
+        return pontuacoes
+
+    def buscar(self, consulta, max_caracteres=MAX_CARACTERES_CONTEXTO):
+        """
+        Trechos mais relevantes para a consulta, em ordem de relevância,
+        até somar `max_caracteres`.
+        """
+        pontuacoes = self.pontuar(consulta)
+        ordem = sorted(range(len(self.trechos)), key=lambda i: pontuacoes[i], reverse=True)
+        selecionados = []
+        usados = 0
+        for i in ordem:
+            if pontuacoes[i] <= 0:
+                break
+            trecho = self.trechos[i]
+            if usados + len(trecho["texto"]) > max_caracteres:
+                continue
+            selecionados.append(trecho)
+            usados += len(trecho["texto"])
+        return selecionados
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def obter_indice():
+    """
+    Índice do processo, construído na primeira chamada e reutilizado nos reruns e sessões.
+    """
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceConhecimento.dos_arquivos()
+    return _indice
+
+
+def consulta_variaveis_fracas(medias, respostas=None, num_variaveis=NUM_VARIAVEIS_FRACAS):
+    """
+    Monta a consulta a partir das variáveis com menor média: sigla, nome e o texto
+    das perguntas com as menores notas de cada uma.
+    :param medias: Dicionário {sigla: média normalizada}
+    :param respostas: Dicionário {sigla: [(nota, peso), ...]} (opcional)
+    """
+    fracas = sorted(medias, key=lambda var: medias[var])[:num_variaveis]
+    partes = []
+    for var in fracas:
+        partes += [var, nomes_longos.get(var, "")]
+        if respostas and var in respostas and var in perguntas:
+            notas = [nota for nota, _ in respostas[var]]
+            piores = sorted(range(len(notas)), key=lambda i: notas[i])[:3]
+            partes += [perguntas[var][i][0] for i in piores if i < len(perguntas[var])]
+    return " ".join(partes)
+
+
+@medido("conhecimento.contexto_relevante")
+def contexto_relevante(medias, respostas=None, max_caracteres=MAX_CARACTERES_CONTEXTO):
+    """
+    Texto com os trechos da base de conhecimento mais relevantes para as variáveis
+    mais fracas do diagnóstico.
+    """
+    trechos = obter_indice().buscar(consulta_variaveis_fracas(medias, respostas), max_caracteres)
+    return "\n\n".join(
+        f"[{t['origem']} · {t['titulo']}]\n{t['texto']}" if t["titulo"] else f"[{t['origem']}]\n{t['texto']}"
+        for t in trechos
+    )
@@ -1,110 +1,1228 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
 import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.extensions import STATUS_READY
 from dotenv import load_dotenv
 
+from .calculos import DIMENSOES, NOTAS_POSSIVEIS, estatisticas_histogramas, pontuar_respostas
+from .metricas import medido
+from .perguntas import perguntas
+
 load_dotenv()
 
-def get_connection():
-    """
-    Cria e retorna uma conexão com o banco de dados PostgreSQL usando a variável de ambiente DATABASE_URL.
-    """
+# Progresso dos comandos de manutenção (exibido pelo main; silencioso quando usado pelo app)
+logger = logging.getLogger(__name__)
+
+# Limites do pool (podem ser ajustados por variáveis de ambiente)
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Conexões ociosas há mais tempo que isso são testadas com SELECT 1 antes do uso
+POOL_VERIFICAR_APOS = float(os.getenv("DB_POOL_VERIFICAR_APOS", "30"))
+# Formato de gravação das respostas: "linhas" (uma linha por pergunta em respostas_diagnostico)
+# ou "compacto" (uma linha por diagnóstico em diagnosticos_compactos). A leitura aceita os dois.
+ARMAZENAMENTO = os.getenv("DB_ARMAZENAMENTO", "linhas")
+if ARMAZENAMENTO not in ("linhas", "compacto"):
+    raise Exception(f"DB_ARMAZENAMENTO inválido: {ARMAZENAMENTO!r} (use 'linhas' ou 'compacto').")
+
+# Colunas da tabela pontuacoes, na ordem de perguntas (médias) e de DIMENSOES
+COLUNAS_MEDIAS = [f"media_{var.lower()}" for var in perguntas]
+COLUNAS_DIMENSOES = ["cognitiva", "estrategica", "operacional", "cultural"]
+# Agrupamentos aceitos por buscar_tendencia (nome -> unidade do date_trunc)
+PERIODOS = {"mes": "month", "trimestre": "quarter", "ano": "year"}
+# Colunas pelas quais o ranking de empresas pode ser ordenado
+ORDENACOES_RANKING = ["rexp", "num_diagnosticos", "empresa"] + COLUNAS_DIMENSOES
+# Colunas de agregados_empresa com o número de respostas de cada nota (histograma)
+COLUNAS_HISTOGRAMA = [f"qtd_nota_{nota}" for nota in NOTAS_POSSIVEIS]
+
+
+def _database_url():
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
         raise Exception("A variável de ambiente DATABASE_URL não está definida.")
-    return psycopg2.connect(db_url, cursor_factory=RealDictCursor)
+    return db_url
 
-def criar_tabelas():
+
+class PoolConexoes:
+    """
+    Pool de conexões PostgreSQL compartilhado pelo processo.
+    Limita o número de conexões abertas, mantém as conexões devolvidas abertas
+    para reuso, faz health-check das conexões ociosas e registra o tempo de
+    espera por uma conexão livre.
+    """
+
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._ociosas = []  # pilha de (conexão, instante da devolução)
+        self._em_uso = 0
+        self._emprestimos = 0
+        self._abertas = 0
+        self._descartadas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._espera_ultima = 0.0
+        for _ in range(minconn):
+            self._ociosas.append((self._abrir(), time.monotonic()))
+
+    def _abrir(self):
+        conn = psycopg2.connect(
+            self.dsn,
+            keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+        )
+        with self._lock:
+            self._abertas += 1
+        return conn
+
+    @medido("db.pool_obter")
+    def obter(self):
+        """
+        Empresta uma conexão saudável do pool, aguardando até `timeout` segundos
+        se todas estiverem em uso.
+        """
+        inicio = time.perf_counter()
+        if not self._vagas.acquire(timeout=self.timeout):
+            raise Exception(
+                f"Tempo esgotado ({self.timeout}s) aguardando conexão livre no pool "
+                f"(máximo de {self.maxconn} conexões)."
+            )
+        espera = time.perf_counter() - inicio
+        try:
+            conn = self._proxima_saudavel()
+        except Exception:
+            self._vagas.release()
+            raise
+        with self._lock:
+            self._em_uso += 1
+            self._emprestimos += 1
+            self._espera_total += espera
+            self._espera_ultima = espera
+            self._espera_max = max(self._espera_max, espera)
+        return conn
+
+    def _proxima_saudavel(self):
+        """
+        Reaproveita a conexão ociosa mais recente; as fechadas ou que não respondem
+        a SELECT 1 após um período ocioso são descartadas. Abre uma nova se não houver.
+        """
+        while True:
+            with self._lock:
+                if not self._ociosas:
+                    break
+                conn, devolvida_em = self._ociosas.pop()
+            if conn.closed:
+                self._descartar(conn)
+                continue
+            if time.monotonic() - devolvida_em <= POOL_VERIFICAR_APOS:
+                return conn
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except psycopg2.Error:
+                self._descartar(conn)
+        return self._abrir()
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._descartadas += 1
+
+    def devolver(self, conn, descartar=False):
+        """
+        Devolve a conexão ao pool. Conexões quebradas ou com transação pendente
+        que não pode ser desfeita são fechadas.
+        """
+        try:
+            if conn.closed:
+                descartar = True
+            elif not descartar and conn.status != STATUS_READY:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    descartar = True
+            if descartar:
+                self._descartar(conn)
+            else:
+                with self._lock:
+                    self._ociosas.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self._em_uso -= 1
+            self._vagas.release()
+
+    def estatisticas(self):
+        """
+        Retorna um dicionário com uso do pool e tempos de espera (em milissegundos).
+        """
+        with self._lock:
+            media = self._espera_total / self._emprestimos if self._emprestimos else 0.0
+            return {
+                "maximo": self.maxconn,
+                "em_uso": self._em_uso,
+                "ociosas": len(self._ociosas),
+                "emprestimos": self._emprestimos,
+                "abertas": self._abertas,
+                "descartadas": self._descartadas,
+                "espera_media_ms": round(media * 1000, 2),
+                "espera_max_ms": round(self._espera_max * 1000, 2),
+                "espera_ultima_ms": round(self._espera_ultima * 1000, 2),
+            }
+
+    def fechar(self):
+        """
+        Fecha todas as conexões ociosas.
+        """
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        for conn, _ in ociosas:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def obter_pool():
+    """
+    Retorna o pool do processo, criando-o na primeira chamada.
+    Como o módulo fica em cache no processo, o mesmo pool atende todos os
+    reruns e sessões do Streamlit.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConexoes(_database_url())
+    return _pool
+
+
+def estatisticas_pool():
+    """
+    Estatísticas do pool do processo, ou None se ele ainda não foi criado.
+    """
+    return _pool.estatisticas() if _pool is not None else None
+
+
+@contextmanager
+def conexao():
+    """
+    Empresta uma conexão do pool durante o bloco `with`.
+    Faz commit ao final, rollback em caso de erro e sempre devolve a conexão ao pool.
+    """
+    pool = obter_pool()
+    conn = pool.obter()
+    descartar = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            descartar = True
+        raise
+    finally:
+        pool.devolver(conn, descartar=descartar)
+
+
+class ConexaoEmprestada:
+    """
+    Conexão do pool com o contrato antigo de get_connection(): cursores RealDictCursor por
+    padrão e close() devolvendo a conexão ao pool (a transação pendente é desfeita, como
+    ao fechar uma conexão). Os demais atributos são os da conexão do psycopg2.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._devolvida = False
+
+    def cursor(self, *args, **kwargs):
+        if self._devolvida:
+            raise psycopg2.InterfaceError("connection already closed")
+        if "cursor_factory" not in kwargs and len(args) < 2:
+            kwargs["cursor_factory"] = RealDictCursor
+        return self._conn.cursor(*args, **kwargs)
+
+    def close(self):
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool.devolver(self._conn)
+
+    @property
+    def closed(self):
+        return 1 if self._devolvida else self._conn.closed
+
+    def __getattr__(self, nome):
+        if self._devolvida:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, nome)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *excecao):
+        return self._conn.__exit__(*excecao)
+
+    def __del__(self):
+        # Conexão esquecida sem close(): devolve a vaga do pool, como o coletor fecharia a conexão
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def get_connection():
+    """
+    Empresta uma conexão do pool de conexões PostgreSQL (DATABASE_URL), com cursores
+    RealDictCursor por padrão. conn.close() (ou liberar_connection(conn)) a devolve ao pool.
+    Prefira o gerenciador de contexto conexao().
+    """
+    pool = obter_pool()
+    return ConexaoEmprestada(pool, pool.obter())
+
+
+def liberar_connection(conn):
+    """
+    Devolve ao pool uma conexão obtida com get_connection().
     """
-    Cria as tabelas necessárias no banco de dados se não existirem.
-    """
-    schema = """
-    CREATE TABLE IF NOT EXISTS organizacoes (
-        id SERIAL PRIMARY KEY,
-        nome TEXT NOT NULL,
-        responsavel TEXT NOT NULL,
-        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS respostas_diagnostico (
-        id SERIAL PRIMARY KEY,
-        organizacao_id INTEGER REFERENCES organizacoes(id) ON DELETE CASCADE,
-        variavel VARCHAR(10) NOT NULL,
-        pergunta_numero INTEGER NOT NULL,
-        nota INTEGER CHECK (nota >= 0 AND nota <= 5),
-        peso NUMERIC(4,2),
-        respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE INDEX IF NOT EXISTS idx_org_nome_resp ON organizacoes (nome, responsavel);
-    CREATE INDEX IF NOT EXISTS idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
-    """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(schema)
-    conn.commit()
-    cur.close()
     conn.close()
 
-def salvar_diagnostico(empresa, responsavel, respostas):
+
+def criar_tabelas():
     """
-    Salva as respostas do diagnóstico no banco de dados.
-    :param empresa: Nome da empresa
-    :param responsavel: Nome do responsável
-    :param respostas: Dicionário { variavel: [(nota, peso), ...], ... }
+    Cria ou atualiza as tabelas aplicando as migrações pendentes (src/migracoes.py).
+    """
+    from .migracoes import migrar
+    migrar()
+
+def normalizar_empresa(nome):
+    """
+    Chave usada para agrupar diagnósticos da mesma empresa.
+    """
+    return nome.strip().lower()
+
+def _linhas_respostas(org_id, respostas):
+    """
+    Converte { variavel: [(nota, peso), ...] } nas linhas de respostas_diagnostico.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    # Insere a organização e obtém o id
-    cur.execute(
-        "INSERT INTO organizacoes (nome, responsavel) VALUES (%s, %s) RETURNING id",
-        (empresa, responsavel)
-    )
-    org_id = cur.fetchone()["id"]
-    # Insere todas as respostas
     for var, valores in respostas.items():
         var_sigla = var.split(" –")[0] if " –" in var else var
         for idx, (nota, peso) in enumerate(valores, 1):
-            cur.execute(
-                """
-                INSERT INTO respostas_diagnostico (organizacao_id, variavel, pergunta_numero, nota, peso)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                (org_id, var_sigla, idx, nota, peso)
+            yield (org_id, var_sigla, idx, nota, peso)
+
+def inserir_respostas(cur, org_id, respostas):
+    """
+    Insere todas as respostas de um diagnóstico em um único INSERT multi-linha.
+    Não faz commit: roda na transação do cursor recebido.
+    """
+    linhas = list(_linhas_respostas(org_id, respostas))
+    execute_values(
+        cur,
+        """
+        INSERT INTO respostas_diagnostico (organizacao_id, variavel, pergunta_numero, nota, peso)
+        VALUES %s
+        """,
+        linhas,
+        page_size=max(len(linhas), 1)
+    )
+
+def copiar_respostas(cur, linhas):
+    """
+    Carrega linhas (organizacao_id, variavel, pergunta_numero, nota, peso) com COPY.
+    Não faz commit: roda na transação do cursor recebido.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(linhas)
+    buffer.seek(0)
+    cur.copy_expert(
+        """
+        COPY respostas_diagnostico (organizacao_id, variavel, pergunta_numero, nota, peso)
+        FROM STDIN WITH (FORMAT csv)
+        """,
+        buffer
+    )
+
+def _layout_compacto(respostas):
+    """
+    Separa as respostas em layout do questionário e notas, na ordem (variavel, pergunta_numero).
+    :return: ((variaveis, numeros, pesos), notas)
+    """
+    linhas = sorted(_linhas_respostas(None, respostas), key=lambda linha: (linha[1], linha[2]))
+    layout = (
+        tuple(var for _, var, _, _, _ in linhas),
+        tuple(idx for _, _, idx, _, _ in linhas),
+        tuple(Decimal(str(peso)) if peso is not None else None for _, _, _, _, peso in linhas),
+    )
+    notas = [int(nota) if nota is not None else None for _, _, _, nota, _ in linhas]
+    return layout, notas
+
+_versoes_questionario = {}
+_versoes_lock = threading.Lock()
+
+
+def versao_questionario(cur, layout):
+    """
+    Versão do questionário com o layout (variaveis, numeros, pesos), criada se não existir.
+    As versões já gravadas ficam em cache no processo (um layout nunca muda de versão), então
+    o banco só é consultado na primeira vez de cada layout. Uma versão criada por esta chamada
+    só entra no cache na próxima consulta, depois do commit: se a transação for desfeita, o
+    cache não guarda uma versão que não existe.
+    """
+    with _versoes_lock:
+        versao = _versoes_questionario.get(layout)
+    if versao is not None:
+        return versao
+    variaveis, numeros, pesos = (list(v) for v in layout)
+    # Cursor simples na mesma transação (o recebido pode ser um RealDictCursor)
+    with cur.connection.cursor() as cur_versao:
+        cur_versao.execute("""
+            WITH nova AS (
+                INSERT INTO questionarios (variaveis, numeros, pesos)
+                VALUES (%(variaveis)s::varchar(10)[], %(numeros)s::smallint[], %(pesos)s::numeric(4,2)[])
+                ON CONFLICT DO NOTHING
+                RETURNING versao
             )
-    conn.commit()
-    cur.close()
-    conn.close()
+            SELECT versao, TRUE FROM nova
+            UNION ALL
+            SELECT versao, FALSE FROM questionarios
+            WHERE variaveis = %(variaveis)s::varchar(10)[] AND numeros = %(numeros)s::smallint[]
+              AND pesos = %(pesos)s::numeric(4,2)[]
+            LIMIT 1
+        """, {"variaveis": variaveis, "numeros": numeros, "pesos": pesos})
+        linha = cur_versao.fetchone()
+        if linha is None:
+            # Outra transação inseriu o mesmo layout ao mesmo tempo: o snapshot do comando
+            # acima não a enxerga, mas um novo comando sim
+            cur_versao.execute("""
+                SELECT versao, FALSE FROM questionarios
+                WHERE variaveis = %s::varchar(10)[] AND numeros = %s::smallint[] AND pesos = %s::numeric(4,2)[]
+            """, (variaveis, numeros, pesos))
+            linha = cur_versao.fetchone()
+    versao, criada = linha
+    if not criada:
+        with _versoes_lock:
+            _versoes_questionario[layout] = versao
+    return versao
+
 
-def buscar_ultimo_diagnostico(empresa, responsavel):
+def limpar_cache_versoes():
     """
-    Busca o último diagnóstico salvo para a empresa/responsável.
-    :return: Respostas estruturadas { variavel: [(nota, peso), ...], ... } ou None
+    Esvazia o cache de versões do questionário (ao recriar as tabelas).
+    """
+    with _versoes_lock:
+        _versoes_questionario.clear()
+
+def _array_pg(valores):
+    """
+    Literal de array do PostgreSQL (para COPY).
+    """
+    return "{" + ",".join("NULL" if v is None else str(v) for v in valores) + "}"
+
+def copiar_compactos(cur, diagnosticos):
+    """
+    Grava diagnósticos no formato compacto (uma linha por diagnóstico) com COPY.
+    Não faz commit: roda na transação do cursor recebido.
+    :param diagnosticos: Iterável de (organizacao_id, respostas)
+    """
+    versoes = {}
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for org_id, respostas in diagnosticos:
+        layout, notas = _layout_compacto(respostas)
+        if layout not in versoes:
+            versoes[layout] = versao_questionario(cur, layout)
+        escritor.writerow((org_id, versoes[layout], _array_pg(notas)))
+    buffer.seek(0)
+    cur.copy_expert(
+        """
+        COPY diagnosticos_compactos (organizacao_id, questionario_versao, notas)
+        FROM STDIN WITH (FORMAT csv)
+        """,
+        buffer
+    )
+
+def atualizar_agregados(cur, diagnosticos):
+    """
+    Soma os diagnósticos recebidos aos agregados das empresas (upsert incremental).
+    Não faz commit: deve rodar na mesma transação que grava as respostas.
+    :param diagnosticos: Iterável de (empresa, respostas)
+    """
+    celulas = defaultdict(lambda: [0, 0, Decimal("0")] + [0] * len(COLUNAS_HISTOGRAMA))
+    totais = defaultdict(int)
+    for empresa, respostas in diagnosticos:
+        chave = normalizar_empresa(empresa)
+        totais[chave] += 1
+        for _, var, idx, nota, peso in _linhas_respostas(None, respostas):
+            if nota is None:
+                continue
+            celula = celulas[(chave, var, idx)]
+            celula[0] += 1
+            celula[1] += int(nota)
+            celula[2] += Decimal(str(peso or 0))
+            celula[3 + int(nota)] += 1
+    if not totais:
+        return
+    # Ordem fixa das chaves para que transações concorrentes bloqueiem as linhas na mesma ordem
+    execute_values(
+        cur,
+        f"""
+        INSERT INTO agregados_empresa (
+            empresa, variavel, pergunta_numero, total, soma_notas, soma_pesos, {", ".join(COLUNAS_HISTOGRAMA)}
+        )
+        VALUES %s
+        ON CONFLICT (empresa, variavel, pergunta_numero) DO UPDATE SET
+            total = agregados_empresa.total + EXCLUDED.total,
+            soma_notas = agregados_empresa.soma_notas + EXCLUDED.soma_notas,
+            soma_pesos = agregados_empresa.soma_pesos + EXCLUDED.soma_pesos,
+            {", ".join(f"{coluna} = agregados_empresa.{coluna} + EXCLUDED.{coluna}" for coluna in COLUNAS_HISTOGRAMA)}
+        """,
+        [(*chave, *valores) for chave, valores in sorted(celulas.items())],
+        page_size=max(len(celulas), 1)
+    )
+    execute_values(
+        cur,
+        """
+        INSERT INTO agregados_empresa_totais (empresa, num_diagnosticos)
+        VALUES %s
+        ON CONFLICT (empresa) DO UPDATE SET
+            num_diagnosticos = agregados_empresa_totais.num_diagnosticos + EXCLUDED.num_diagnosticos,
+            atualizado_em = CURRENT_TIMESTAMP
+        """,
+        sorted(totais.items()),
+        page_size=max(len(totais), 1)
+    )
+
+def _linhas_pontuacao(chaves, pontuacao):
+    """
+    Linhas (chave, médias..., rexp, zona, dimensões...) a partir do resultado de pontuar_lote.
+    """
+    return [
+        (chave, *medias, None if rexp != rexp else rexp, zona, *dimensoes)
+        for chave, medias, rexp, zona, dimensoes in zip(
+            chaves, pontuacao["medias"].tolist(), pontuacao["rexp"].tolist(),
+            pontuacao["zonas"].tolist(), pontuacao["valores_dimensoes"].tolist()
+        )
+    ]
+
+def gravar_pontuacoes(cur, org_ids, lista_respostas, pontuacao=None):
+    """
+    Calcula médias, Rexp, zona e dimensões dos diagnósticos e grava em pontuacoes
+    (substituindo as já existentes). Não faz commit: roda na transação do cursor recebido.
+    :param org_ids: Ids das organizações, na ordem de lista_respostas
+    :param lista_respostas: Lista de { variavel: [(nota, peso), ...] }
+    :param pontuacao: Resultado de pontuar_lote já calculado para lista_respostas (evita recalcular)
+    """
+    if not org_ids:
+        return
+    if pontuacao is None:
+        pontuacao = pontuar_respostas(lista_respostas)
+    linhas = _linhas_pontuacao(org_ids, pontuacao)
+    colunas = COLUNAS_MEDIAS + ["rexp", "zona"] + COLUNAS_DIMENSOES
+    execute_values(
+        cur,
+        f"""
+        INSERT INTO pontuacoes (organizacao_id, {", ".join(colunas)})
+        VALUES %s
+        ON CONFLICT (organizacao_id) DO UPDATE SET
+            {", ".join(f"{coluna} = EXCLUDED.{coluna}" for coluna in colunas)},
+            calculado_em = CURRENT_TIMESTAMP
+        """,
+        linhas,
+        page_size=max(len(linhas), 1)
+    )
+
+def _pontuacao(linha):
+    """
+    Converte uma linha de pontuacoes (RealDictCursor) em
+    {"medias": {variavel: valor}, "rexp": ..., "zona": ..., "dimensoes": {dimensao: valor}}.
+    """
+    return {
+        "medias": {var: linha[coluna] for var, coluna in zip(perguntas, COLUNAS_MEDIAS)},
+        "rexp": linha["rexp"],
+        "zona": linha["zona"],
+        "dimensoes": {dimensao: linha[coluna] for dimensao, coluna in zip(DIMENSOES, COLUNAS_DIMENSOES)},
+    }
+
+def _select_periodos(filtro=""):
+    """
+    SELECT das somas de pontuacoes por empresa e mês, nas colunas de pontuacoes_periodo.
+    """
+    somas = ", ".join(f"SUM(p.{coluna})" for coluna in COLUNAS_DIMENSOES)
+    return f"""
+        SELECT LOWER(TRIM(o.nome)), date_trunc('month', o.criado_em)::date,
+               COUNT(*), COUNT(p.rexp), COALESCE(SUM(p.rexp), 0), {somas}
+        FROM organizacoes o
+        JOIN pontuacoes p ON p.organizacao_id = o.id
+        {filtro}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+
+def atualizar_periodos(cur, org_ids):
+    """
+    Soma as pontuações dos diagnósticos recebidos às de sua empresa e mês (upsert incremental).
+    Não faz commit: deve rodar na mesma transação que grava as pontuações.
+    """
+    if not org_ids:
+        return
+    colunas = ["num_diagnosticos", "num_rexp", "soma_rexp"] + [f"soma_{coluna}" for coluna in COLUNAS_DIMENSOES]
+    # ORDER BY do SELECT: transações concorrentes bloqueiam as linhas na mesma ordem
+    cur.execute(f"""
+        INSERT INTO pontuacoes_periodo (empresa, periodo, {", ".join(colunas)})
+        {_select_periodos("WHERE o.id = ANY(%s)")}
+        ON CONFLICT (empresa, periodo) DO UPDATE SET
+            {", ".join(f"{coluna} = pontuacoes_periodo.{coluna} + EXCLUDED.{coluna}" for coluna in colunas)}
+    """, (list(org_ids),))
+
+def reconstruir_periodos(cur, empresa=None):
+    """
+    Recalcula pontuacoes_periodo a partir de pontuacoes, para todas as empresas ou apenas
+    para `empresa`. Não faz commit: roda na transação do cursor recebido.
+    """
+    if empresa is None:
+        cur.execute("TRUNCATE pontuacoes_periodo")
+        cur.execute(f"INSERT INTO pontuacoes_periodo {_select_periodos()}")
+        return
+    chave = normalizar_empresa(empresa)
+    cur.execute("DELETE FROM pontuacoes_periodo WHERE empresa = %s", (chave,))
+    cur.execute(f"INSERT INTO pontuacoes_periodo {_select_periodos('WHERE LOWER(TRIM(o.nome)) = %s')}", (chave,))
+
+def pontuar_diagnosticos(cur, org_ids):
+    """
+    Lê as respostas dos diagnósticos (nos dois formatos) e grava suas pontuações.
+    Não faz commit: roda na transação do cursor recebido.
     """
-    conn = get_connection()
-    cur = conn.cursor()
     cur.execute("""
-        SELECT o.id FROM organizacoes o
-        WHERE o.nome = %s AND o.responsavel = %s
-        ORDER BY o.criado_em DESC LIMIT 1
-    """, (empresa, responsavel))
-    org = cur.fetchone()
-    if not org:
+        SELECT organizacao_id, variavel, nota, peso FROM respostas_expandidas
+        WHERE organizacao_id = ANY(%s)
+        ORDER BY organizacao_id, variavel, pergunta_numero
+    """, (list(org_ids),))
+    respostas = {org_id: {} for org_id in org_ids}
+    for org_id, var, nota, peso in cur.fetchall():
+        respostas[org_id].setdefault(var, []).append((nota, float(peso) if peso is not None else None))
+    gravar_pontuacoes(cur, org_ids, [respostas[org_id] for org_id in org_ids])
+
+@medido("db.preencher_pontuacoes")
+def preencher_pontuacoes(tamanho_lote=1000, recalcular=False):
+    """
+    Calcula as pontuações dos diagnósticos gravados antes da tabela pontuacoes (ou de
+    todos, com recalcular=True), em lotes de `tamanho_lote`, uma transação por lote.
+    :return: Número de diagnósticos pontuados
+    """
+    filtro = "" if recalcular else "AND NOT EXISTS (SELECT 1 FROM pontuacoes p WHERE p.organizacao_id = o.id)"
+    total = 0
+    ultimo_id = 0
+    while True:
+        with conexao() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT o.id FROM organizacoes o
+                WHERE o.id > %s {filtro}
+                ORDER BY o.id LIMIT %s
+            """, (ultimo_id, tamanho_lote))
+            org_ids = [linha[0] for linha in cur.fetchall()]
+            if not org_ids:
+                cur.close()
+                break
+            pontuar_diagnosticos(cur, org_ids)
+            cur.close()
+        total += len(org_ids)
+        ultimo_id = org_ids[-1]
+        logger.info("%d diagnósticos pontuados...", total)
+    if total:
+        # As somas por período não incluíam os diagnósticos sem pontuação
+        with conexao() as conn:
+            cur = conn.cursor()
+            reconstruir_periodos(cur)
+            cur.close()
+    return total
+
+@medido("db.compactar_respostas")
+def compactar_respostas(tamanho_lote=1000):
+    """
+    Converte os diagnósticos gravados em linhas (respostas_diagnostico) para o formato
+    compacto, em lotes de `tamanho_lote`, uma transação por lote. Só entram os diagnósticos
+    com as 70 respostas do questionário; os demais continuam em linhas. Agregados e
+    pontuações não mudam: as respostas são as mesmas.
+    :return: Número de diagnósticos convertidos
+    """
+    total = 0
+    ultimo_id = 0
+    while True:
+        with conexao() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT organizacao_id FROM respostas_diagnostico
+                WHERE organizacao_id > %s
+                GROUP BY organizacao_id
+                HAVING COUNT(*) = 70
+                ORDER BY organizacao_id LIMIT %s
+            """, (ultimo_id, tamanho_lote))
+            org_ids = [linha[0] for linha in cur.fetchall()]
+            if not org_ids:
+                cur.close()
+                break
+            # Uma versão de questionário por layout distinto, como em copiar_compactos
+            cur.execute("""
+                CREATE TEMP TABLE _compactar ON COMMIT DROP AS
+                    SELECT organizacao_id,
+                           array_agg(variavel ORDER BY variavel, pergunta_numero)::VARCHAR(10)[] AS variaveis,
+                           array_agg(pergunta_numero ORDER BY variavel, pergunta_numero)::SMALLINT[] AS numeros,
+                           array_agg(peso ORDER BY variavel, pergunta_numero)::NUMERIC(4,2)[] AS pesos,
+                           array_agg(nota ORDER BY variavel, pergunta_numero)::SMALLINT[] AS notas,
+                           MIN(respondido_em) AS respondido_em
+                    FROM respostas_diagnostico
+                    WHERE organizacao_id = ANY(%s)
+                    GROUP BY organizacao_id;
+                INSERT INTO questionarios (variaveis, numeros, pesos)
+                    SELECT DISTINCT variaveis, numeros, pesos FROM _compactar
+                    ON CONFLICT DO NOTHING;
+                INSERT INTO diagnosticos_compactos (organizacao_id, questionario_versao, notas, respondido_em)
+                    SELECT c.organizacao_id, q.versao, c.notas, c.respondido_em
+                    FROM _compactar c
+                    JOIN questionarios q ON q.variaveis = c.variaveis AND q.numeros = c.numeros AND q.pesos = c.pesos;
+                DELETE FROM respostas_diagnostico WHERE organizacao_id = ANY(%s);
+            """, (org_ids, org_ids))
+            cur.close()
+        total += len(org_ids)
+        ultimo_id = org_ids[-1]
+        logger.info("%d diagnósticos convertidos...", total)
+    return total
+
+def _medias_perguntas(agregados):
+    """
+    Médias por pergunta no formato { variavel: [(media_nota, media_peso), ...] }, a partir de
+    {(variavel, pergunta_numero): (media_nota, media_peso)}. Sem dados para a pergunta: nota
+    zero e o peso padrão.
+    """
+    return {
+        var: [agregados.get((var, i), (0.0, peso_padrao)) for i, (_, peso_padrao) in enumerate(lista, 1)]
+        for var, lista in perguntas.items()
+    }
+
+def atualizar_pontuacoes_empresa(cur, empresas):
+    """
+    Recalcula a pontuação das empresas (nomes normalizados) sobre as médias por pergunta
+    dos agregados, como no diagnóstico da empresa, e grava em pontuacoes_empresa.
+    Não faz commit: deve rodar na mesma transação que atualiza os agregados.
+    """
+    empresas = sorted(set(empresas))
+    if not empresas:
+        return
+    # Cursor simples na mesma transação (o recebido pode ser um RealDictCursor)
+    with cur.connection.cursor() as cur_empresas:
+        cur_empresas.execute("""
+            SELECT t.empresa, t.num_diagnosticos, a.variavel, a.pergunta_numero,
+                   (a.soma_notas::numeric / a.total)::float, (a.soma_pesos / a.total)::float
+            FROM agregados_empresa_totais t
+            LEFT JOIN agregados_empresa a ON a.empresa = t.empresa AND a.total > 0
+            WHERE t.empresa = ANY(%s) AND t.num_diagnosticos > 0
+        """, (empresas,))
+        totais = {}
+        agregados = defaultdict(dict)
+        for empresa, num_diagnosticos, var, num, media_nota, media_peso in cur_empresas.fetchall():
+            totais[empresa] = num_diagnosticos
+            if var is not None:
+                agregados[empresa][(var, num)] = (media_nota, media_peso)
+        if not totais:
+            return
+        chaves = sorted(totais)
+        pontuacao = pontuar_respostas([_medias_perguntas(agregados[empresa]) for empresa in chaves])
+        colunas = ["num_diagnosticos"] + COLUNAS_MEDIAS + ["rexp", "zona"] + COLUNAS_DIMENSOES
+        execute_values(
+            cur_empresas,
+            f"""
+            INSERT INTO pontuacoes_empresa (empresa, {", ".join(colunas)})
+            VALUES %s
+            ON CONFLICT (empresa) DO UPDATE SET
+                {", ".join(f"{coluna} = EXCLUDED.{coluna}" for coluna in colunas)},
+                atualizado_em = CURRENT_TIMESTAMP
+            """,
+            [(chave, totais[chave], *linha) for chave, *linha in _linhas_pontuacao(chaves, pontuacao)],
+            page_size=len(chaves)
+        )
+
+@medido("db.preencher_pontuacoes_empresa")
+def preencher_pontuacoes_empresa(tamanho_lote=500, recalcular=False):
+    """
+    Calcula a pontuação das empresas que ainda não estão em pontuacoes_empresa (ou de
+    todas, com recalcular=True) a partir dos agregados, em lotes de `tamanho_lote`
+    empresas, uma transação por lote.
+    :return: Número de empresas pontuadas
+    """
+    filtro = "" if recalcular else "AND NOT EXISTS (SELECT 1 FROM pontuacoes_empresa p WHERE p.empresa = t.empresa)"
+    total = 0
+    ultima = ""
+    while True:
+        with conexao() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT t.empresa FROM agregados_empresa_totais t
+                WHERE t.empresa > %s {filtro}
+                ORDER BY t.empresa LIMIT %s
+            """, (ultima, tamanho_lote))
+            empresas = [linha[0] for linha in cur.fetchall()]
+            if not empresas:
+                cur.close()
+                break
+            atualizar_pontuacoes_empresa(cur, empresas)
+            cur.close()
+        total += len(empresas)
+        ultima = empresas[-1]
+        logger.info("%d empresas pontuadas...", total)
+    return total
+
+@medido("db.reconstruir_agregados")
+def reconstruir_agregados(empresa=None):
+    """
+    Recalcula os agregados (respostas por pergunta, pontuações por mês e pontuação da
+    empresa) a partir dos
+    diagnósticos gravados (nos dois formatos), para todas as empresas ou apenas para
+    `empresa`. Roda em uma única transação.
+    :return: Número de empresas reconstruídas
+    """
+    filtro = ""
+    params = ()
+    if empresa is not None:
+        filtro = "WHERE LOWER(TRIM(o.nome)) = %s"
+        params = (normalizar_empresa(empresa),)
+    with conexao() as conn:
+        cur = conn.cursor()
+        if empresa is None:
+            cur.execute("TRUNCATE agregados_empresa, agregados_empresa_totais")
+        else:
+            cur.execute("DELETE FROM agregados_empresa WHERE empresa = %s", params)
+            cur.execute("DELETE FROM agregados_empresa_totais WHERE empresa = %s", params)
+        cur.execute(f"""
+            INSERT INTO agregados_empresa (
+                empresa, variavel, pergunta_numero, total, soma_notas, soma_pesos, {", ".join(COLUNAS_HISTOGRAMA)}
+            )
+            SELECT LOWER(TRIM(o.nome)), r.variavel, r.pergunta_numero,
+                   COUNT(r.nota), COALESCE(SUM(r.nota), 0), COALESCE(SUM(r.peso) FILTER (WHERE r.nota IS NOT NULL), 0),
+                   {", ".join(f"COUNT(*) FILTER (WHERE r.nota = {nota})" for nota in NOTAS_POSSIVEIS)}
+            FROM organizacoes o
+            JOIN respostas_expandidas r ON r.organizacao_id = o.id
+            {filtro}
+            GROUP BY 1, 2, 3
+        """, params)
+        cur.execute(f"""
+            INSERT INTO agregados_empresa_totais (empresa, num_diagnosticos)
+            SELECT LOWER(TRIM(o.nome)), COUNT(*)
+            FROM organizacoes o
+            {filtro}
+            GROUP BY 1
+        """, params)
+        num_empresas = cur.rowcount
+        reconstruir_periodos(cur, empresa)
+        if empresa is None:
+            cur.execute("TRUNCATE pontuacoes_empresa")
+        else:
+            cur.execute("DELETE FROM pontuacoes_empresa WHERE empresa = %s", params)
+        cur.execute("SELECT empresa FROM agregados_empresa_totais " + ("WHERE empresa = %s" if empresa else ""), params)
+        atualizar_pontuacoes_empresa(cur, [linha[0] for linha in cur.fetchall()])
+        cur.close()
+    return num_empresas
+
+@medido("db.buscar_media_empresa")
+def buscar_media_empresa(nome_empresa):
+    """
+    Médias por pergunta de todos os diagnósticos da empresa, lidas dos agregados
+    (custo constante, independente do número de respondentes).
+    :return: ({ variavel: [(media_nota, media_peso), ...] }, num_diagnosticos) ou (None, 0)
+    """
+    chave = normalizar_empresa(nome_empresa)
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT num_diagnosticos FROM agregados_empresa_totais WHERE empresa = %s",
+            (chave,)
+        )
+        total = cur.fetchone()
+        if not total or not total[0]:
+            cur.close()
+            return None, 0
+        cur.execute("""
+            SELECT variavel, pergunta_numero, (soma_notas::numeric / total)::float, (soma_pesos / total)::float
+            FROM agregados_empresa
+            WHERE empresa = %s AND total > 0
+        """, (chave,))
+        agregados = {(var, num): (media_nota, media_peso) for var, num, media_nota, media_peso in cur.fetchall()}
+        cur.close()
+    return _medias_perguntas(agregados), total[0]
+
+def _distribuicao(contagens):
+    """
+    Distribuição das notas de cada pergunta no formato
+    { variavel: [{"histograma": [6 contagens], "respondentes", "media", "desvio", "quartis"}, ...] },
+    a partir de {(variavel, pergunta_numero): [contagens das notas 0 a 5]}. Média, desvio e
+    quartis na escala das notas (0-5); None para perguntas sem respostas.
+    """
+    chaves = [(var, i) for var, lista in perguntas.items() for i in range(1, len(lista) + 1)]
+    matriz = [contagens.get(chave, [0] * len(NOTAS_POSSIVEIS)) for chave in chaves]
+    estatisticas = estatisticas_histogramas(matriz)
+
+    def valor(numero):
+        return None if numero != numero else round(float(numero), 3)
+
+    distribuicao = {var: [] for var in perguntas}
+    for n, (var, _) in enumerate(chaves):
+        distribuicao[var].append({
+            "histograma": [int(contagem) for contagem in matriz[n]],
+            "respondentes": int(estatisticas["respondentes"][n]),
+            "media": valor(estatisticas["media"][n]),
+            "desvio": valor(estatisticas["desvio"][n]),
+            "quartis": [valor(quartil) for quartil in estatisticas["quartis"][n]],
+        })
+    return distribuicao
+
+@medido("db.buscar_distribuicao_empresa")
+def buscar_distribuicao_empresa(nome_empresa):
+    """
+    Histograma das notas 0-5, desvio padrão e quartis de cada pergunta, para todos os
+    diagnósticos da empresa. Lê as contagens por nota dos agregados em uma única consulta
+    (70 linhas, independente do número de respondentes).
+    :return: (distribuição no formato de _distribuicao, num_diagnosticos) ou (None, 0)
+    """
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT t.num_diagnosticos, a.variavel, a.pergunta_numero, {", ".join(f"a.{c}" for c in COLUNAS_HISTOGRAMA)}
+            FROM agregados_empresa_totais t
+            LEFT JOIN agregados_empresa a ON a.empresa = t.empresa
+            WHERE t.empresa = %s
+        """, (normalizar_empresa(nome_empresa),))
+        linhas = cur.fetchall()
+        cur.close()
+    if not linhas or not linhas[0][0]:
+        return None, 0
+    contagens = {(var, num): list(histograma) for _, var, num, *histograma in linhas if var is not None}
+    return _distribuicao(contagens), linhas[0][0]
+
+def impressao_diagnostico(empresa, responsavel, matricula, respostas, dia=None):
+    """
+    Hash SHA-256 do respondente, das respostas e do dia do envio (UTC). Envios iguais no
+    mesmo dia (duplo clique, rerun) têm a mesma impressão; repetir o diagnóstico em outro
+    dia, mesmo com as mesmas notas, gera um registro novo.
+    """
+    dia = dia or datetime.now(timezone.utc).date()
+    linhas = sorted(
+        (var, idx, nota, float(peso) if peso is not None else None)
+        for _, var, idx, nota, peso in _linhas_respostas(None, respostas)
+    )
+    conteudo = json.dumps([empresa, responsavel, matricula or "", dia.isoformat(), linhas], ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+@medido("db.salvar_diagnostico")
+def salvar_diagnostico(empresa, responsavel, respostas, matricula=""):
+    """
+    Salva as respostas do diagnóstico no banco de dados. Um envio idêntico ao já gravado
+    no mesmo dia (ver impressao_diagnostico) é ignorado.
+    :param empresa: Nome da empresa
+    :param responsavel: Nome do responsável
+    :param respostas: Dicionário { variavel: [(nota, peso), ...], ... }
+    :param matricula: Matrícula do funcionário
+    :return: True se o diagnóstico foi gravado, False se era um envio duplicado
+    """
+    impressao = impressao_diagnostico(empresa, responsavel, matricula, respostas)
+    with conexao() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # Insere a organização e obtém o id; duplicata: só a consulta ao índice único
+        cur.execute("""
+            INSERT INTO organizacoes (nome, responsavel, matricula, impressao) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (impressao) DO NOTHING
+            RETURNING id
+        """, (empresa, responsavel, matricula, impressao))
+        linha = cur.fetchone()
+        if linha is None:
+            cur.close()
+            return False
+        org_id = linha["id"]
+        # Insere todas as respostas em um único comando
+        if ARMAZENAMENTO == "compacto":
+            copiar_compactos(cur, [(org_id, respostas)])
+        else:
+            inserir_respostas(cur, org_id, respostas)
+        gravar_pontuacoes(cur, [org_id], [respostas])
+        atualizar_agregados(cur, [(empresa, respostas)])
+        atualizar_pontuacoes_empresa(cur, [normalizar_empresa(empresa)])
+        atualizar_periodos(cur, [org_id])
+        cur.close()
+    return True
+
+def gravar_diagnosticos(cur, diagnosticos, pontuacao=None):
+    """
+    Grava vários diagnósticos na transação do cursor recebido (sem commit).
+    As organizações são inseridas em um INSERT multi-linha e as respostas via COPY
+    (no formato definido por DB_ARMAZENAMENTO); as pontuações são calculadas em lote.
+    :param diagnosticos: Lista de (empresa, responsavel, respostas) ou
+                         (empresa, responsavel, respostas, matricula)
+    :param pontuacao: Resultado de pontuar_lote para os diagnósticos, na mesma ordem, se
+                      quem chama já o calculou
+    :return: Lista com os ids das organizações criadas, na ordem recebida
+    """
+    diagnosticos = [tuple(d) if len(d) == 4 else (*d, "") for d in diagnosticos]
+    if not diagnosticos:
+        return []
+    org_ids = [
+        row[0] for row in execute_values(
+            cur,
+            "INSERT INTO organizacoes (nome, responsavel, matricula) VALUES %s RETURNING id",
+            [(empresa, responsavel, matricula) for empresa, responsavel, _, matricula in diagnosticos],
+            page_size=len(diagnosticos),
+            fetch=True
+        )
+    ]
+    if ARMAZENAMENTO == "compacto":
+        copiar_compactos(cur, (
+            (org_id, respostas) for org_id, (_, _, respostas, _) in zip(org_ids, diagnosticos)
+        ))
+    else:
+        copiar_respostas(cur, (
+            linha
+            for org_id, (_, _, respostas, _) in zip(org_ids, diagnosticos)
+            for linha in _linhas_respostas(org_id, respostas)
+        ))
+    gravar_pontuacoes(cur, org_ids, [respostas for _, _, respostas, _ in diagnosticos], pontuacao)
+    atualizar_agregados(cur, ((empresa, respostas) for empresa, _, respostas, _ in diagnosticos))
+    atualizar_pontuacoes_empresa(cur, (normalizar_empresa(empresa) for empresa, _, _, _ in diagnosticos))
+    atualizar_periodos(cur, org_ids)
+    return org_ids
+
+@medido("db.salvar_diagnosticos")
+def salvar_diagnosticos(diagnosticos):
+    """
+    Salva vários diagnósticos de uma vez, em uma única transação (ver gravar_diagnosticos).
+    :return: Lista com os ids das organizações criadas, na ordem recebida
+    """
+    if not diagnosticos:
+        return []
+    with conexao() as conn:
+        cur = conn.cursor()
+        org_ids = gravar_diagnosticos(cur, diagnosticos)
+        cur.close()
+    return org_ids
+
+@medido("db.buscar_ultimo_diagnostico")
+def buscar_ultimo_diagnostico(empresa, responsavel, matricula=None):
+    """
+    Busca o último diagnóstico salvo para a empresa/responsável (e matrícula, se informada),
+    em uma única consulta (índice idx_org_respondente_criado).
+    :return: Respostas estruturadas { variavel: [(nota, peso), ...], ... } ou None
+    """
+    filtro_matricula = "AND matricula = %s" if matricula is not None else ""
+    params = (empresa, responsavel) + ((matricula,) if matricula is not None else ())
+    with conexao() as conn:
+        cur = conn.cursor()
+        # Diagnósticos compactos já vêm em arrays; os gravados em linhas são agregados na mesma consulta
+        cur.execute(f"""
+            SELECT o.id, COALESCE(q.variaveis, r.variaveis), COALESCE(d.notas, r.notas),
+                   COALESCE(q.pesos, r.pesos)::float8[]
+            FROM (
+                SELECT id FROM organizacoes
+                WHERE nome = %s AND responsavel = %s {filtro_matricula}
+                ORDER BY criado_em DESC LIMIT 1
+            ) o
+            LEFT JOIN diagnosticos_compactos d ON d.organizacao_id = o.id
+            LEFT JOIN questionarios q ON q.versao = d.questionario_versao
+            LEFT JOIN LATERAL (
+                SELECT array_agg(variavel ORDER BY variavel, pergunta_numero) AS variaveis,
+                       array_agg(nota ORDER BY variavel, pergunta_numero) AS notas,
+                       array_agg(peso ORDER BY variavel, pergunta_numero) AS pesos
+                FROM respostas_diagnostico
+                WHERE organizacao_id = o.id AND d.organizacao_id IS NULL
+            ) r ON TRUE
+        """, params)
+        org = cur.fetchone()
         cur.close()
-        conn.close()
+    if not org:
         return None
-    org_id = org["id"]
-    cur.execute("""
-        SELECT variavel, pergunta_numero, nota, peso FROM respostas_diagnostico
-        WHERE organizacao_id = %s
-        ORDER BY variavel, pergunta_numero
-    """, (org_id,))
-    dados = cur.fetchall()
-    cur.close()
-    conn.close()
     # Reconstrói respostas agrupadas para exibição
+    _, variaveis, notas, pesos = org
     respostas = {}
-    for row in dados:
-        var = row["variavel"]
-        if var not in respostas:
-            respostas[var] = []
-        respostas[var].append((row["nota"], float(row["peso"])))
-    return respostas
\ No newline at end of file
+    for var, nota, peso in zip(variaveis or [], notas or [], pesos or []):
+        respostas.setdefault(var, []).append((nota, peso))
+    return respostas
+
+@medido("db.buscar_ultima_pontuacao")
+def buscar_ultima_pontuacao(empresa, responsavel, matricula=None):
+    """
+    Pontuação gravada do último diagnóstico da empresa/responsável (e matrícula, se informada).
+    :return: Dicionário (ver _pontuacao) ou None se não houver diagnóstico pontuado
+    """
+    filtro_matricula = "AND o.matricula = %s" if matricula is not None else ""
+    params = (empresa, responsavel) + ((matricula,) if matricula is not None else ())
+    with conexao() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f"""
+            SELECT p.* FROM organizacoes o
+            JOIN pontuacoes p ON p.organizacao_id = o.id
+            WHERE o.nome = %s AND o.responsavel = %s {filtro_matricula}
+            ORDER BY o.criado_em DESC LIMIT 1
+        """, params)
+        linha = cur.fetchone()
+        cur.close()
+    return _pontuacao(linha) if linha else None
+
+@medido("db.buscar_tendencia")
+def buscar_tendencia(empresa, responsavel=None, matricula=None, periodo="trimestre"):
+    """
+    Evolução do Rexp e das dimensões por período: da empresa inteira (somas mensais em
+    pontuacoes_periodo) ou, se `responsavel` for informado, dos diagnósticos desse respondente.
+    :param periodo: "mes", "trimestre" ou "ano"
+    :return: Lista, em ordem cronológica, de {"periodo": date, "num_diagnosticos": int,
+             "rexp": float ou None, "dimensoes": {dimensao: valor}}
+    """
+    if periodo not in PERIODOS:
+        raise Exception(f"Período inválido: {periodo!r} (use {', '.join(PERIODOS)}).")
+    if responsavel is None:
+        medias = ", ".join(f"SUM(soma_{coluna}) / SUM(num_diagnosticos)" for coluna in COLUNAS_DIMENSOES)
+        sql = f"""
+            SELECT date_trunc(%s, periodo)::date, SUM(num_diagnosticos),
+                   SUM(soma_rexp) / NULLIF(SUM(num_rexp), 0), {medias}
+            FROM pontuacoes_periodo
+            WHERE empresa = %s
+            GROUP BY 1 ORDER BY 1
+        """
+        params = (PERIODOS[periodo], normalizar_empresa(empresa))
+    else:
+        filtro_matricula = "AND o.matricula = %s" if matricula is not None else ""
+        medias = ", ".join(f"AVG(p.{coluna})" for coluna in COLUNAS_DIMENSOES)
+        sql = f"""
+            SELECT date_trunc(%s, o.criado_em)::date, COUNT(*), AVG(p.rexp), {medias}
+            FROM organizacoes o
+            JOIN pontuacoes p ON p.organizacao_id = o.id
+            WHERE o.nome = %s AND o.responsavel = %s {filtro_matricula}
+            GROUP BY 1 ORDER BY 1
+        """
+        params = (PERIODOS[periodo], empresa, responsavel) + ((matricula,) if matricula is not None else ())
+    with conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        linhas = cur.fetchall()
+        cur.close()
+    return [
+        {
+            "periodo": inicio,
+            "num_diagnosticos": int(num),
+            "rexp": round(rexp, 3) if rexp is not None else None,
+            "dimensoes": {dimensao: round(valor, 3) for dimensao, valor in zip(DIMENSOES, valores)},
+        }
+        for inicio, num, rexp, *valores in linhas
+    ]
+
+@medido("db.buscar_ranking_empresas")
+def buscar_ranking_empresas(ordenar_por="rexp", decrescente=True, busca=None, zona=None, min_diagnosticos=1,
+                            pagina=1, por_pagina=20):
+    """
+    Ranking das empresas pela pontuação agregada (pontuacoes_empresa), com filtros e paginação.
+    A posição considera todas as empresas com pelo menos `min_diagnosticos` diagnósticos,
+    antes dos filtros de nome e zona.
+    :param ordenar_por: Uma das ORDENACOES_RANKING
+    :param busca: Trecho do nome da empresa
+    :param pagina: Página desejada, a partir de 1
+    :return: (lista da página, total de empresas após os filtros); cada item traz "posicao",
+             "empresa", "num_diagnosticos" e as chaves de _pontuacao
+    """
+    if ordenar_por not in ORDENACOES_RANKING:
+        raise Exception(f"Ordenação inválida: {ordenar_por!r} (use {', '.join(ORDENACOES_RANKING)}).")
+    filtros = []
+    params = []
+    if busca:
+        trecho = normalizar_empresa(busca).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filtros.append("empresa LIKE %s")
+        params.append(f"%{trecho}%")
+    if zona:
+        filtros.append("zona = %s")
+        params.append(zona)
+    where = "WHERE " + " AND ".join(filtros) if filtros else ""
+    ranking = f"""
+        SELECT p.*, RANK() OVER (ORDER BY {ordenar_por} {"DESC" if decrescente else "ASC"} NULLS LAST) AS posicao
+        FROM pontuacoes_empresa p
+        WHERE num_diagnosticos >= %s
+    """
+    with conexao() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f"SELECT COUNT(*) AS total FROM ({ranking}) r {where}", [min_diagnosticos] + params)
+        total = cur.fetchone()["total"]
+        cur.execute(f"""
+            SELECT * FROM ({ranking}) r
+            {where}
+            ORDER BY posicao, empresa
+            LIMIT %s OFFSET %s
+        """, [min_diagnosticos] + params + [por_pagina, (max(pagina, 1) - 1) * por_pagina])
+        linhas = cur.fetchall()
+        cur.close()
+    return [
+        {"posicao": linha["posicao"], "empresa": linha["empresa"], "num_diagnosticos": linha["num_diagnosticos"],
+         **_pontuacao(linha)}
+        for linha in linhas
+    ], total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção do banco de dados DREXUS ICE³-R.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    reconstruir = comandos.add_parser(
+        "reconstruir-agregados",
+        help="Recalcula os agregados por empresa a partir das respostas gravadas."
+    )
+    reconstruir.add_argument("--empresa", help="Reconstrói apenas esta empresa.")
+    preencher = comandos.add_parser(
+        "preencher-pontuacoes",
+        help="Calcula as pontuações dos diagnósticos gravados antes da tabela pontuacoes."
+    )
+    preencher.add_argument("--lote", type=int, default=1000, help="Diagnósticos por transação (padrão 1000).")
+    preencher.add_argument("--recalcular", action="store_true", help="Recalcula também os já pontuados.")
+    pontuar_empresas = comandos.add_parser(
+        "pontuar-empresas",
+        help="Calcula a pontuação das empresas gravadas antes da tabela pontuacoes_empresa."
+    )
+    pontuar_empresas.add_argument("--lote", type=int, default=500, help="Empresas por transação (padrão 500).")
+    pontuar_empresas.add_argument("--recalcular", action="store_true", help="Recalcula também as já pontuadas.")
+    compactar = comandos.add_parser(
+        "compactar-respostas",
+        help="Converte os diagnósticos gravados em linhas para o formato compacto."
+    )
+    compactar.add_argument("--lote", type=int, default=1000, help="Diagnósticos por transação (padrão 1000).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.comando == "reconstruir-agregados":
+        num_empresas = reconstruir_agregados(args.empresa)
+        print(f"Agregados reconstruídos para {num_empresas} empresa(s).")
+    elif args.comando == "preencher-pontuacoes":
+        total = preencher_pontuacoes(args.lote, args.recalcular)
+        print(f"Pontuações calculadas para {total} diagnóstico(s).")
+    elif args.comando == "pontuar-empresas":
+        total = preencher_pontuacoes_empresa(args.lote, args.recalcular)
+        print(f"Pontuação calculada para {total} empresa(s).")
+    elif args.comando == "compactar-respostas":
+        total = compactar_respostas(args.lote)
+        print(f"{total} diagnóstico(s) convertido(s) para o formato compacto.")
+
+
+if __name__ == "__main__":
+    main()
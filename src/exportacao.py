@@ -0,0 +1,210 @@
+"""
+Exportação em streaming dos diagnósticos para CSV ou Parquet.
+
+Cada linha exportada é um diagnóstico: identificação (empresa, responsável, matrícula, data),
+as notas das 70 perguntas (If1 ... Pv10) e os resultados gravados em pontuacoes (media_if ...
+media_pv, rexp, zona e as dimensões cognitiva ... cultural); só os diagnósticos ainda sem
+pontuação (antes de preencher-pontuacoes) são calculados na exportação. A leitura usa um cursor nomeado (do lado do servidor) e o arquivo
+é escrito lote a lote, então o uso de memória não depende do tamanho das tabelas.
+
+    python -m src.exportacao diagnosticos.csv
+    python -m src.exportacao diagnosticos.parquet --empresa "Empresa X" --desde 2025-01-01 --ate 2025-06-30
+"""
+
+import argparse
+import csv
+import logging
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from . import db
+from .calculos import pontuar_lote
+from .importacao import colunas_perguntas
+from .perguntas import perguntas as perguntas_padrao
+
+LOTE_PADRAO = 5000  # diagnósticos por ida ao servidor
+COLUNAS_IDENTIFICACAO = ["id", "empresa", "responsavel", "matricula", "criado_em"]
+COLUNAS_PONTUACAO = db.COLUNAS_MEDIAS + ["rexp", "zona"] + db.COLUNAS_DIMENSOES
+FORMATOS = ("csv", "parquet")
+
+logger = logging.getLogger(__name__)
+
+
+def _consulta(empresa=None, desde=None, ate=None, matricula=None):
+    """
+    SQL e parâmetros da consulta de exportação, com os filtros informados.
+    """
+    filtros = []
+    params = []
+    if empresa is not None:
+        filtros.append("LOWER(TRIM(o.nome)) = %s")
+        params.append(db.normalizar_empresa(empresa))
+    if desde is not None:
+        filtros.append("o.criado_em >= %s")
+        params.append(desde)
+    if ate is not None:
+        filtros.append("o.criado_em < %s")
+        params.append(ate + timedelta(days=1))  # inclui o dia inteiro
+    if matricula is not None:
+        filtros.append("o.matricula = %s")
+        params.append(matricula)
+    where = "WHERE " + " AND ".join(filtros) if filtros else ""
+    # Diagnósticos compactos já vêm em arrays; os gravados em linhas são agregados por organização.
+    # Os resultados vêm de pontuacoes (NULL para diagnósticos ainda sem pontuação)
+    sql = f"""
+        SELECT o.id, o.nome, o.responsavel, o.matricula, o.criado_em,
+               COALESCE(q.variaveis, r.variaveis), COALESCE(q.numeros, r.numeros),
+               COALESCE(d.notas, r.notas), COALESCE(q.pesos, r.pesos)::float8[],
+               p.organizacao_id IS NOT NULL, {", ".join(f"p.{coluna}" for coluna in COLUNAS_PONTUACAO)}
+        FROM organizacoes o
+        LEFT JOIN pontuacoes p ON p.organizacao_id = o.id
+        LEFT JOIN diagnosticos_compactos d ON d.organizacao_id = o.id
+        LEFT JOIN questionarios q ON q.versao = d.questionario_versao
+        LEFT JOIN LATERAL (
+            SELECT array_agg(variavel ORDER BY variavel, pergunta_numero) AS variaveis,
+                   array_agg(pergunta_numero ORDER BY variavel, pergunta_numero) AS numeros,
+                   array_agg(nota ORDER BY variavel, pergunta_numero) AS notas,
+                   array_agg(peso ORDER BY variavel, pergunta_numero) AS pesos
+            FROM respostas_diagnostico
+            WHERE organizacao_id = o.id AND d.organizacao_id IS NULL
+        ) r ON TRUE
+        {where}
+        ORDER BY o.id
+    """
+    return sql, params
+
+
+def colunas_exportacao(perguntas=perguntas_padrao):
+    """
+    Nomes das colunas exportadas, na ordem.
+    """
+    return COLUNAS_IDENTIFICACAO + colunas_perguntas(perguntas) + COLUNAS_PONTUACAO
+
+
+def lotes_diagnosticos(empresa=None, desde=None, ate=None, matricula=None, tamanho_lote=LOTE_PADRAO,
+                       perguntas=perguntas_padrao):
+    """
+    Lê os diagnósticos e suas pontuações com um cursor nomeado, lote a lote.
+    Diagnósticos ainda sem linha em pontuacoes têm os resultados calculados aqui.
+    :return: Gerador de listas de linhas (na ordem de colunas_exportacao)
+    """
+    posicoes = {}
+    pesos_padrao = []
+    for var, lista in perguntas.items():
+        for i, (_, peso) in enumerate(lista, 1):
+            posicoes[(var, i)] = len(pesos_padrao)
+            pesos_padrao.append(float(peso))
+    indices_layout = {}  # (variaveis, numeros) -> (colunas no questionário, posições válidas)
+    sql, params = _consulta(empresa, desde, ate, matricula)
+    with db.conexao() as conn:
+        cur = conn.cursor(name="exportacao_diagnosticos")
+        cur.itersize = tamanho_lote
+        cur.execute(sql, params)
+        while True:
+            linhas = cur.fetchmany(tamanho_lote)
+            if not linhas:
+                break
+            # Notas e pesos na ordem do questionário; perguntas sem resposta contam como nota 0
+            notas = np.full((len(linhas), len(pesos_padrao)), np.nan)
+            pesos = np.tile(pesos_padrao, (len(linhas), 1))
+            for n, (_, _, _, _, _, variaveis, numeros, notas_org, pesos_org, *_) in enumerate(linhas):
+                if not variaveis:
+                    continue
+                chave = (tuple(variaveis), tuple(numeros))
+                if chave not in indices_layout:
+                    indices = np.array([posicoes.get(k, -1) for k in zip(variaveis, numeros)], dtype=np.intp)
+                    indices_layout[chave] = (indices[indices >= 0], indices >= 0)
+                indices, validos = indices_layout[chave]
+                notas[n, indices] = np.array(notas_org, dtype=float)[validos]
+                valores_pesos = np.array(pesos_org, dtype=float)[validos]
+                pesos[n, indices] = np.where(np.isnan(valores_pesos), pesos[n, indices], valores_pesos)
+            notas_saida = [[None if nota != nota else int(nota) for nota in linha] for linha in notas.tolist()]
+            sem_pontuacao = [n for n, linha in enumerate(linhas) if not linha[9]]
+            calculadas = {}
+            if sem_pontuacao:
+                pontuacao = pontuar_lote(np.nan_to_num(notas[sem_pontuacao]), pesos[sem_pontuacao], perguntas)
+                calculadas = {linha[0]: linha[1:] for linha in db._linhas_pontuacao(sem_pontuacao, pontuacao)}
+            lote = [
+                list(linha[:5]) + notas_saida[n] + list(calculadas.get(n, linha[10:]))
+                for n, linha in enumerate(linhas)
+            ]
+            yield lote
+        cur.close()
+
+
+def _esquema_parquet(colunas, perguntas):
+    import pyarrow as pa
+    tipos = {"id": pa.int64(), "criado_em": pa.timestamp("us"), "zona": pa.string()}
+    for nome in ("empresa", "responsavel", "matricula"):
+        tipos[nome] = pa.string()
+    for nome in colunas_perguntas(perguntas):
+        tipos[nome] = pa.int8()
+    return pa.schema([(nome, tipos.get(nome, pa.float64())) for nome in colunas])
+
+
+def exportar(caminho, formato=None, empresa=None, desde=None, ate=None, matricula=None,
+             tamanho_lote=LOTE_PADRAO, perguntas=perguntas_padrao):
+    """
+    Exporta os diagnósticos filtrados para CSV ou Parquet, escrevendo lote a lote.
+    :param formato: "csv" ou "parquet" (padrão: pela extensão do arquivo)
+    :param desde: Data inicial (inclusive) de criado_em
+    :param ate: Data final (inclusive) de criado_em
+    :return: Número de diagnósticos exportados
+    """
+    formato = formato or Path(caminho).suffix.lstrip(".").lower()
+    if formato not in FORMATOS:
+        raise Exception(f"Formato de exportação inválido: {formato!r} (use {' ou '.join(FORMATOS)}).")
+    colunas = colunas_exportacao(perguntas)
+    lotes = lotes_diagnosticos(empresa, desde, ate, matricula, tamanho_lote, perguntas)
+    total = 0
+    if formato == "csv":
+        with open(caminho, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.writer(f)
+            escritor.writerow(colunas)
+            for lote in lotes:
+                escritor.writerows(lote)
+                total += len(lote)
+                logger.info("%d diagnósticos exportados...", total)
+        return total
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Para exportar em Parquet, instale o pyarrow (pip install pyarrow).")
+    esquema = _esquema_parquet(colunas, perguntas)
+    with pq.ParquetWriter(caminho, esquema) as escritor:
+        for lote in lotes:
+            colunas_lote = [pa.array(valores, campo.type) for valores, campo in zip(zip(*lote), esquema)]
+            escritor.write_table(pa.Table.from_arrays(colunas_lote, schema=esquema))
+            total += len(lote)
+            logger.info("%d diagnósticos exportados...", total)
+        if total == 0:
+            escritor.write_table(esquema.empty_table())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportação dos diagnósticos DREXUS ICE³-R.")
+    parser.add_argument("arquivo", help="Arquivo de saída (.csv ou .parquet).")
+    parser.add_argument("--formato", choices=FORMATOS, help="Formato de saída (padrão: pela extensão).")
+    parser.add_argument("--empresa", help="Apenas diagnósticos desta empresa.")
+    parser.add_argument("--desde", type=date.fromisoformat, help="Data inicial (AAAA-MM-DD), inclusive.")
+    parser.add_argument("--ate", type=date.fromisoformat, help="Data final (AAAA-MM-DD), inclusive.")
+    parser.add_argument("--matricula", help="Apenas diagnósticos desta matrícula.")
+    parser.add_argument("--lote", type=int, default=LOTE_PADRAO,
+                        help=f"Diagnósticos lidos por vez (padrão {LOTE_PADRAO}).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    total = exportar(
+        args.arquivo, args.formato, empresa=args.empresa, desde=args.desde, ate=args.ate,
+        matricula=args.matricula, tamanho_lote=args.lote
+    )
+    print(f"Exportação concluída: {total} diagnóstico(s) em {args.arquivo}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Importação em lote de diagnósticos a partir de planilhas (CSV ou XLSX).
+
+Cada linha da planilha é um respondente: colunas empresa, responsavel, matricula (opcional)
+e uma coluna por pergunta, com a sigla da variável e o número da pergunta (If1 ... If10,
+Cm1 ... Pv10). O cabeçalho pode ser gerado com `python -m src.importacao modelo`.
+
+O arquivo é lido em streaming, validado (notas inteiras de 0 a 5), pontuado em lotes pelo
+motor vetorizado e gravado com COPY. Cada lote é gravado em uma transação junto com o
+progresso da importação (tabela importacoes); se um lote falhar, rodar o mesmo comando
+retoma a partir do primeiro lote não gravado.
+
+    python -m src.importacao importar respostas.csv
+    python -m src.importacao importar respostas.xlsx --lote 2000 --rejeitadas rejeitadas.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from . import db
+from .calculos import pontuar_lote
+from .migracoes import garantir_esquema
+from .perguntas import perguntas as perguntas_padrao
+
+LOTE_PADRAO = 1000  # diagnósticos por transação
+COLUNAS_IDENTIFICACAO = ["empresa", "responsavel", "matricula"]
+
+logger = logging.getLogger(__name__)
+
+
+class LinhaInvalida(Exception):
+    """
+    Linha da planilha com dados ausentes ou fora do intervalo; é rejeitada sem interromper a importação.
+    """
+
+
+class FalhaImportacao(Exception):
+    """
+    Um lote não pôde ser gravado; os lotes anteriores já estão salvos e a importação pode ser retomada.
+    """
+
+
+def colunas_perguntas(perguntas=perguntas_padrao):
+    """
+    Nomes das colunas das perguntas, na ordem do questionário (If1 ... Pv10).
+    """
+    return [f"{var}{i}" for var, lista in perguntas.items() for i in range(1, len(lista) + 1)]
+
+
+def hash_arquivo(caminho):
+    """
+    SHA-256 do conteúdo do arquivo; identifica a importação para retomá-la.
+    """
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def ler_planilha(caminho):
+    """
+    Lê a planilha linha a linha, sem carregá-la inteira na memória.
+    A primeira linha devolvida é o cabeçalho.
+    :return: Gerador de listas de valores
+    """
+    if Path(caminho).suffix.lower() in (".xlsx", ".xlsm"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise Exception("Para importar arquivos XLSX, instale o openpyxl (pip install openpyxl).")
+        planilha = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            for linha in planilha.active.iter_rows(values_only=True):
+                yield list(linha)
+        finally:
+            planilha.close()
+        return
+    with open(caminho, newline="", encoding="utf-8-sig") as f:
+        amostra = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=",;\t")
+        except csv.Error:
+            dialeto = csv.excel
+        yield from csv.reader(f, dialeto)
+
+
+def mapear_colunas(cabecalho, perguntas=perguntas_padrao):
+    """
+    Posição de cada coluna esperada no cabeçalho (sem diferenciar maiúsculas).
+    :return: (posições de empresa, responsavel e matricula (None se ausente), posições das perguntas)
+    """
+    posicoes = {str(nome).strip().lower(): i for i, nome in enumerate(cabecalho) if nome is not None}
+    esperadas = COLUNAS_IDENTIFICACAO[:2] + colunas_perguntas(perguntas)
+    faltando = [nome for nome in esperadas if nome.lower() not in posicoes]
+    if faltando:
+        raise Exception(f"Colunas ausentes na planilha: {', '.join(faltando)}")
+    identificacao = [posicoes.get(nome) for nome in COLUNAS_IDENTIFICACAO]
+    return identificacao, [posicoes[nome.lower()] for nome in colunas_perguntas(perguntas)]
+
+
+def _texto(valores, posicao):
+    # Normalizado como no formulário do app (strip + minúsculas), para que o diagnóstico
+    # importado seja encontrado como anterior pelo mesmo respondente
+    if posicao is None or posicao >= len(valores) or valores[posicao] is None:
+        return ""
+    return str(valores[posicao]).strip().lower()
+
+
+def _nota(valor, coluna):
+    texto = "" if valor is None else str(valor).strip().replace(",", ".")
+    if not texto:
+        raise LinhaInvalida(f"{coluna} vazia")
+    try:
+        nota = float(texto)
+    except ValueError:
+        raise LinhaInvalida(f"{coluna} não numérica: {texto!r}")
+    if not nota.is_integer() or not 0 <= nota <= 5:
+        raise LinhaInvalida(f"{coluna} fora do intervalo 0-5: {texto}")
+    return int(nota)
+
+
+def converter_linha(valores, identificacao, colunas, nomes_colunas):
+    """
+    Valida uma linha da planilha.
+    :return: (empresa, responsavel, matricula, notas)
+    """
+    empresa, responsavel, matricula = (_texto(valores, posicao) for posicao in identificacao)
+    if not empresa or not responsavel:
+        raise LinhaInvalida("empresa e responsavel são obrigatórios")
+    notas = [
+        _nota(valores[posicao] if posicao < len(valores) else None, nome)
+        for posicao, nome in zip(colunas, nomes_colunas)
+    ]
+    return empresa, responsavel, matricula, notas
+
+
+def _estado_importacao(cur, chave):
+    cur.execute("""
+        SELECT linhas_processadas, importados, rejeitados, concluida
+        FROM importacoes WHERE chave = %s
+    """, (chave,))
+    return cur.fetchone()
+
+
+def importar(caminho, tamanho_lote=LOTE_PADRAO, caminho_rejeitadas=None, forcar=False,
+             perguntas=perguntas_padrao):
+    """
+    Importa a planilha em lotes, retomando do último lote gravado se a importação
+    do mesmo arquivo já tiver começado.
+    :param caminho_rejeitadas: CSV onde as linhas rejeitadas são anexadas, com o motivo
+    :param forcar: Importa de novo um arquivo já importado por completo
+    :return: Dicionário com o resumo da importação
+    """
+    garantir_esquema()
+    chave = hash_arquivo(caminho)
+    with db.conexao() as conn:
+        cur = conn.cursor()
+        if forcar:
+            cur.execute("DELETE FROM importacoes WHERE chave = %s", (chave,))
+        estado = _estado_importacao(cur, chave)
+        cur.close()
+    ja_processadas, importados, rejeitados, concluida = estado or (0, 0, 0, False)
+    if concluida:
+        logger.info("%s já foi importado (%d diagnósticos). Use --forcar para importar de novo.", caminho, importados)
+        return {"importados": importados, "rejeitados": rejeitados, "concluida": True}
+    if ja_processadas:
+        logger.info("Retomando importação de %s após a linha %d.", caminho, ja_processadas + 1)
+
+    nomes_colunas = colunas_perguntas(perguntas)
+    pesos = [peso for lista in perguntas.values() for _, peso in lista]
+    faixas = []
+    inicio = 0
+    for var, lista in perguntas.items():
+        faixas.append((var, inicio, inicio + len(lista)))
+        inicio += len(lista)
+
+    linhas = ler_planilha(caminho)
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        raise Exception(f"{caminho} está vazio.")
+    identificacao, colunas = mapear_colunas(cabecalho, perguntas)
+
+    zonas = Counter()
+    soma_rexp = 0.0
+    importados_execucao = 0
+    inicio_execucao = time.perf_counter()
+    lote, notas_lote, rejeitadas_lote = [], [], []
+    processadas = ja_processadas
+    ja_processadas_lote = ja_processadas  # última linha gravada antes do lote atual
+
+    def gravar_lote(concluir=False):
+        nonlocal importados, rejeitados, importados_execucao, soma_rexp
+        rexp_lote = None
+        pontuacao = None
+        if notas_lote:
+            pontuacao = pontuar_lote(np.array(notas_lote, dtype=float), perguntas=perguntas)
+            zonas.update(pontuacao["zonas"].tolist())
+            soma_rexp += float(np.nansum(pontuacao["rexp"]))
+            rexp_lote = float(np.nanmean(pontuacao["rexp"]))
+        try:
+            with db.conexao() as conn:
+                cur = conn.cursor()
+                db.gravar_diagnosticos(cur, lote, pontuacao)
+                cur.execute("""
+                    INSERT INTO importacoes (chave, arquivo, linhas_processadas, importados, rejeitados, concluida)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (chave) DO UPDATE SET
+                        linhas_processadas = EXCLUDED.linhas_processadas,
+                        importados = importacoes.importados + EXCLUDED.importados,
+                        rejeitados = importacoes.rejeitados + EXCLUDED.rejeitados,
+                        concluida = EXCLUDED.concluida,
+                        atualizada_em = CURRENT_TIMESTAMP
+                """, (chave, os.path.basename(caminho), processadas, len(lote), len(rejeitadas_lote), concluir))
+                cur.close()
+        except Exception as e:
+            raise FalhaImportacao(
+                f"Falha ao gravar o lote que termina na linha {processadas + 1}: {e}\n"
+                f"As linhas até {ja_processadas_lote + 1} já estão gravadas; "
+                "rode o mesmo comando para retomar."
+            ) from e
+        if rejeitadas_lote and caminho_rejeitadas:
+            novo = not os.path.exists(caminho_rejeitadas)
+            with open(caminho_rejeitadas, "a", newline="", encoding="utf-8") as f:
+                escritor = csv.writer(f)
+                if novo:
+                    escritor.writerow(["linha", "motivo"] + list(cabecalho))
+                escritor.writerows(rejeitadas_lote)
+        importados += len(lote)
+        rejeitados += len(rejeitadas_lote)
+        importados_execucao += len(lote)
+        decorrido = time.perf_counter() - inicio_execucao
+        taxa = importados_execucao / decorrido if decorrido > 0 else 0.0
+        logger.info(
+            "Linha %d: %d importados, %d rejeitados (%.0f diagnósticos/s%s)",
+            processadas + 1, importados, rejeitados, taxa,
+            f", Rexp médio do lote {rexp_lote:.3f}" if rexp_lote is not None else ""
+        )
+        lote.clear()
+        notas_lote.clear()
+        rejeitadas_lote.clear()
+
+    for numero, valores in enumerate(linhas, 2):  # número da linha no arquivo (1 = cabeçalho)
+        if numero - 1 <= ja_processadas:
+            continue
+        processadas = numero - 1
+        if all(v is None or str(v).strip() == "" for v in valores):
+            continue
+        try:
+            empresa, responsavel, matricula, notas = converter_linha(valores, identificacao, colunas, nomes_colunas)
+        except LinhaInvalida as e:
+            rejeitadas_lote.append([numero, str(e)] + list(valores))
+            if rejeitados + len(rejeitadas_lote) <= 10:
+                logger.warning("Linha %d rejeitada: %s", numero, e)
+        else:
+            respostas = {
+                var: list(zip(notas[inicio:fim], pesos[inicio:fim])) for var, inicio, fim in faixas
+            }
+            lote.append((empresa, responsavel, respostas, matricula))
+            notas_lote.append(notas)
+        if len(lote) + len(rejeitadas_lote) >= tamanho_lote:
+            gravar_lote()
+            ja_processadas_lote = processadas
+    gravar_lote(concluir=True)
+
+    decorrido = time.perf_counter() - inicio_execucao
+    resumo = {
+        "importados": importados,
+        "rejeitados": rejeitados,
+        "concluida": True,
+        "segundos": round(decorrido, 2),
+        "diagnosticos_por_segundo": round(importados_execucao / decorrido, 1) if decorrido > 0 else 0.0,
+        "rexp_medio": round(soma_rexp / importados_execucao, 3) if importados_execucao else None,
+        "zonas": dict(zonas),
+    }
+    return resumo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importação em lote de diagnósticos DREXUS ICE³-R.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    importar_cmd = comandos.add_parser("importar", help="Importa uma planilha CSV ou XLSX.")
+    importar_cmd.add_argument("arquivo", help="Planilha com um respondente por linha.")
+    importar_cmd.add_argument("--lote", type=int, default=LOTE_PADRAO,
+                              help=f"Linhas por transação (padrão {LOTE_PADRAO}).")
+    importar_cmd.add_argument("--rejeitadas", help="CSV onde anexar as linhas rejeitadas, com o motivo.")
+    importar_cmd.add_argument("--forcar", action="store_true", help="Importa de novo um arquivo já importado.")
+    modelo = comandos.add_parser("modelo", help="Gera um CSV vazio com o cabeçalho esperado.")
+    modelo.add_argument("--saida", help="Arquivo de saída (padrão: saída padrão).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.comando == "modelo":
+        cabecalho = COLUNAS_IDENTIFICACAO + colunas_perguntas()
+        if args.saida:
+            with open(args.saida, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(cabecalho)
+        else:
+            csv.writer(sys.stdout).writerow(cabecalho)
+        return
+
+    try:
+        resumo = importar(args.arquivo, args.lote, args.rejeitadas, args.forcar)
+    except FalhaImportacao as e:
+        print(e)
+        sys.exit(1)
+    if "segundos" in resumo:
+        print(
+            f"Importação concluída: {resumo['importados']} diagnósticos, {resumo['rejeitados']} linhas rejeitadas "
+            f"em {resumo['segundos']}s ({resumo['diagnosticos_por_segundo']} diagnósticos/s)."
+        )
+        if resumo["rexp_medio"] is not None:
+            print(f"Rexp médio dos importados nesta execução: {resumo['rexp_medio']}")
+        for zona, total in sorted(resumo["zonas"].items(), key=lambda item: -item[1]):
+            print(f"  {zona}: {total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Instrumentação dos caminhos críticos: tempos, contadores e histogramas.
+
+Os trechos medidos (funções do banco, chamada à OpenAI, base de conhecimento, gráficos) são
+registrados em dois lugares:
+- nos histogramas e contadores do processo, exportados no formato texto do Prometheus
+  (exportar_prometheus; servidos em /metrics se METRICAS_PORTA estiver definida) e, se
+  METRICAS_LOG estiver definida, em um log estruturado (uma linha JSON por trecho);
+- na execução atual da thread (iniciar_execucao), que o app guarda por sessão para
+  mostrar a decomposição de tempo do último rerun.
+
+    @medido("db.salvar_diagnostico")
+    def salvar_diagnostico(...): ...
+
+    with trecho("grafico.radar"):
+        ...
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICAS_PORTA = os.getenv("METRICAS_PORTA")
+METRICAS_LOG = os.getenv("METRICAS_LOG")
+
+logger = logging.getLogger(__name__)
+
+# Limites (segundos) dos buckets dos histogramas de duração
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Texto do "# HELP" de cada contador registrado com incrementar()
+DESCRICOES_CONTADORES = {
+    "drexus_execucoes_total": "Execuções (reruns) do script do app.",
+    "drexus_resumo_cache_total": "Consultas ao cache de resumos da IA, por resultado (acerto ou falha).",
+    "drexus_openai_tokens_entrada_total": "Tokens de entrada enviados à API da OpenAI.",
+}
+
+
+class Registro:
+    """
+    Histogramas de duração e contadores do processo, por operação.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histogramas = {}  # operacao -> [contagens por bucket..., +Inf], soma
+        self._erros = defaultdict(int)
+        self._contadores = defaultdict(float)  # (nome, rótulos ordenados) -> valor
+
+    def observar(self, operacao, segundos, erro=False):
+        with self._lock:
+            contagens, soma = self._histogramas.get(operacao, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    contagens[i] += 1
+                    break
+            else:
+                contagens[-1] += 1
+            self._histogramas[operacao] = (contagens, soma + segundos)
+            if erro:
+                self._erros[operacao] += 1
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        with self._lock:
+            self._contadores[(nome, tuple(sorted(rotulos.items())))] += valor
+
+    def resumo(self):
+        """
+        Número de chamadas, erros e tempo total por operação.
+        """
+        with self._lock:
+            return {
+                operacao: {"chamadas": sum(contagens), "erros": self._erros.get(operacao, 0), "segundos": soma}
+                for operacao, (contagens, soma) in self._histogramas.items()
+            }
+
+    def exportar_prometheus(self):
+        """
+        Histogramas e contadores no formato texto de exposição do Prometheus.
+        """
+        with self._lock:
+            histogramas = {op: (list(c), s) for op, (c, s) in self._histogramas.items()}
+            erros = dict(self._erros)
+            contadores = dict(self._contadores)
+        linhas = [
+            "# HELP drexus_operacao_duracao_segundos Duração das operações instrumentadas.",
+            "# TYPE drexus_operacao_duracao_segundos histogram",
+        ]
+        for operacao, (contagens, soma) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, contagem in zip(list(self.buckets) + ["+Inf"], contagens):
+                acumulado += contagem
+                linhas.append(
+                    f'drexus_operacao_duracao_segundos_bucket{{operacao="{operacao}",le="{limite}"}} {acumulado}'
+                )
+            linhas.append(f'drexus_operacao_duracao_segundos_sum{{operacao="{operacao}"}} {soma}')
+            linhas.append(f'drexus_operacao_duracao_segundos_count{{operacao="{operacao}"}} {acumulado}')
+        linhas += [
+            "# HELP drexus_operacao_erros_total Operações instrumentadas que terminaram em exceção.",
+            "# TYPE drexus_operacao_erros_total counter",
+        ]
+        for operacao, total in sorted(erros.items()):
+            linhas.append(f'drexus_operacao_erros_total{{operacao="{operacao}"}} {total}')
+        tipos_declarados = set()
+        for (nome, rotulos), valor in sorted(contadores.items()):
+            if nome not in tipos_declarados:
+                linhas.append(f"# HELP {nome} {DESCRICOES_CONTADORES.get(nome, 'Contador ' + nome + '.')}")
+                linhas.append(f"# TYPE {nome} counter")
+                tipos_declarados.add(nome)
+            texto_rotulos = ",".join(f'{chave}="{valor_rotulo}"' for chave, valor_rotulo in rotulos)
+            linhas.append(f"{nome}{{{texto_rotulos}}} {valor}" if texto_rotulos else f"{nome} {valor}")
+        return "\n".join(linhas + _linhas_pool()) + "\n"
+
+
+def _linhas_pool():
+    # Estado atual do pool de conexões (importado aqui para evitar import circular com db)
+    from . import db
+    estatisticas = db.estatisticas_pool()
+    if not estatisticas:
+        return []
+    return [
+        "# HELP drexus_pool_conexoes Conexões do pool com o PostgreSQL, por estado.",
+        "# TYPE drexus_pool_conexoes gauge",
+        f'drexus_pool_conexoes{{estado="em_uso"}} {estatisticas["em_uso"]}',
+        f'drexus_pool_conexoes{{estado="ociosas"}} {estatisticas["ociosas"]}',
+        f'drexus_pool_conexoes{{estado="maximo"}} {estatisticas["maximo"]}',
+        "# HELP drexus_pool_espera_media_segundos Espera média por uma conexão livre do pool.",
+        "# TYPE drexus_pool_espera_media_segundos gauge",
+        f"drexus_pool_espera_media_segundos {estatisticas['espera_media_ms'] / 1000}",
+    ]
+
+
+# Registro do processo: compartilhado por todas as sessões e reruns
+registro = Registro()
+
+
+class Execucao:
+    """
+    Trechos medidos durante uma execução do script (um rerun do Streamlit).
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.trechos = []  # (operacao, profundidade, início relativo (s), duração (s), erro)
+        self._profundidade = 0
+
+    def total(self):
+        """
+        Tempo do início da execução até o fim do último trecho medido (s).
+        """
+        return max((inicio + duracao for _, _, inicio, duracao, _ in self.trechos), default=0.0)
+
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def iniciar_execucao():
+    """
+    Começa a registrar os trechos medidos nesta thread em uma nova Execucao.
+    """
+    _local.execucao = Execucao()
+    registro.incrementar("drexus_execucoes_total")
+    return _local.execucao
+
+
+def execucao_atual():
+    return getattr(_local, "execucao", None)
+
+
+def _registrar(operacao, inicio, duracao, erro, profundidade=0):
+    registro.observar(operacao, duracao, erro)
+    execucao = execucao_atual()
+    if execucao is not None:
+        execucao.trechos.append((operacao, profundidade, inicio - execucao.inicio, duracao, erro))
+    if METRICAS_LOG:
+        linha = json.dumps({
+            "ts": time.time(), "operacao": operacao, "duracao_ms": round(duracao * 1000, 3),
+            "erro": erro, "thread": threading.current_thread().name,
+        }, ensure_ascii=False)
+        with _log_lock, open(METRICAS_LOG, "a", encoding="utf-8") as f:
+            f.write(linha + "\n")
+
+
+@contextmanager
+def trecho(operacao):
+    """
+    Mede o bloco `with` como a operação `operacao`.
+    """
+    execucao = execucao_atual()
+    profundidade = 0
+    if execucao is not None:
+        profundidade = execucao._profundidade
+        execucao._profundidade += 1
+    inicio = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except BaseException as e:
+        # st.stop()/st.rerun() interrompem o script com exceções que não são erros
+        erro = isinstance(e, Exception) and type(e).__module__.split(".")[0] != "streamlit"
+        raise
+    finally:
+        if execucao is not None:
+            execucao._profundidade -= 1
+        _registrar(operacao, inicio, time.perf_counter() - inicio, erro, profundidade)
+
+
+def observar(operacao, segundos):
+    """
+    Registra uma duração medida fora de um trecho (ex.: tempo até o primeiro token).
+    """
+    _registrar(operacao, time.perf_counter() - segundos, segundos, False)
+
+
+def incrementar(nome, valor=1, **rotulos):
+    registro.incrementar(nome, valor, **rotulos)
+
+
+def medido(operacao):
+    """
+    Decorador que mede cada chamada da função. Em funções geradoras, mede o consumo
+    do gerador até o fim.
+    """
+    def decorador(funcao):
+        if inspect.isgeneratorfunction(funcao):
+            @functools.wraps(funcao)
+            def gerador(*args, **kwargs):
+                with trecho(operacao):
+                    yield from funcao(*args, **kwargs)
+            return gerador
+
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with trecho(operacao):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+class _HandlerMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = registro.exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+_servidor = None
+_servidor_lock = threading.Lock()
+
+
+def iniciar_servidor(porta=None):
+    """
+    Serve /metrics (formato Prometheus) em uma thread, uma vez por processo.
+    Sem porta informada, usa METRICAS_PORTA; se nenhuma estiver definida, não faz nada.
+    """
+    global _servidor
+    porta = porta or METRICAS_PORTA
+    if not porta or _servidor is not None:
+        return _servidor
+    with _servidor_lock:
+        if _servidor is None:
+            _servidor = ThreadingHTTPServer(("0.0.0.0", int(porta)), _HandlerMetricas)
+            threading.Thread(target=_servidor.serve_forever, daemon=True).start()
+            logger.info("Métricas Prometheus em http://0.0.0.0:%s/metrics", porta)
+    return _servidor
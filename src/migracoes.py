@@ -0,0 +1,341 @@
+"""
+Migrações versionadas do esquema do banco DREXUS.
+
+Cada migração tem um número de versão e é aplicada uma única vez; as versões aplicadas
+ficam registradas na tabela schema_version. O app aplica as pendentes uma vez por
+processo (garantir_esquema); em produção, prefira rodar antes do deploy:
+
+    python -m src.migracoes            # aplica as pendentes
+    python -m src.migracoes --status   # mostra a versão atual
+"""
+
+import argparse
+import threading
+
+from . import db
+from .metricas import medido
+
+# Chave do advisory lock que serializa migrações concorrentes (vários processos subindo juntos)
+LOCK_MIGRACOES = 7_061_003
+
+MIGRACOES = [
+    (1, "Esquema inicial: organizações e respostas", """
+        CREATE TABLE IF NOT EXISTS organizacoes (
+            id SERIAL PRIMARY KEY,
+            nome TEXT NOT NULL,
+            responsavel TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS respostas_diagnostico (
+            id SERIAL PRIMARY KEY,
+            organizacao_id INTEGER REFERENCES organizacoes(id) ON DELETE CASCADE,
+            variavel VARCHAR(10) NOT NULL,
+            pergunta_numero INTEGER NOT NULL,
+            nota INTEGER CHECK (nota >= 0 AND nota <= 5),
+            peso NUMERIC(4,2),
+            respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_respostas_orgid ON respostas_diagnostico (organizacao_id);
+    """),
+    (2, "Matrícula do funcionário em organizacoes", """
+        ALTER TABLE organizacoes ADD COLUMN IF NOT EXISTS matricula TEXT NOT NULL DEFAULT '';
+        ALTER TABLE organizacoes ALTER COLUMN matricula SET DEFAULT '';
+        CREATE INDEX IF NOT EXISTS idx_org_nome_resp_matricula ON organizacoes (nome, responsavel, matricula);
+        DROP INDEX IF EXISTS idx_org_nome_resp;
+    """),
+    (3, "Índice por nome da empresa sem diferenciar maiúsculas", """
+        CREATE INDEX IF NOT EXISTS idx_org_nome_lower ON organizacoes (LOWER(nome));
+    """),
+    (4, "Agregados por empresa", """
+        CREATE TABLE IF NOT EXISTS agregados_empresa (
+            empresa TEXT NOT NULL,
+            variavel VARCHAR(10) NOT NULL,
+            pergunta_numero INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            soma_notas BIGINT NOT NULL DEFAULT 0,
+            soma_pesos NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (empresa, variavel, pergunta_numero)
+        );
+        CREATE TABLE IF NOT EXISTS agregados_empresa_totais (
+            empresa TEXT PRIMARY KEY,
+            num_diagnosticos INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        TRUNCATE agregados_empresa, agregados_empresa_totais;
+        INSERT INTO agregados_empresa (empresa, variavel, pergunta_numero, total, soma_notas, soma_pesos)
+        SELECT LOWER(TRIM(o.nome)), r.variavel, r.pergunta_numero,
+               COUNT(r.nota), COALESCE(SUM(r.nota), 0), COALESCE(SUM(r.peso) FILTER (WHERE r.nota IS NOT NULL), 0)
+        FROM organizacoes o
+        JOIN respostas_diagnostico r ON r.organizacao_id = o.id
+        GROUP BY 1, 2, 3;
+        INSERT INTO agregados_empresa_totais (empresa, num_diagnosticos)
+        SELECT LOWER(TRIM(o.nome)), COUNT(*)
+        FROM organizacoes o
+        GROUP BY 1;
+    """),
+    (5, "Cache de resumos da IA", """
+        CREATE TABLE IF NOT EXISTS resumos_cache (
+            chave CHAR(64) PRIMARY KEY,
+            empresa TEXT,
+            modelo TEXT NOT NULL,
+            resumo TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expira_em TIMESTAMP NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_resumos_cache_empresa ON resumos_cache (empresa);
+    """),
+    (6, "Armazenamento compacto: uma linha por diagnóstico", """
+        -- Só cria as tabelas; respostas já gravadas: python -m src.db compactar-respostas
+        CREATE TABLE IF NOT EXISTS questionarios (
+            versao SERIAL PRIMARY KEY,
+            variaveis VARCHAR(10)[] NOT NULL,
+            numeros SMALLINT[] NOT NULL,
+            pesos NUMERIC(4,2)[] NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (variaveis, numeros, pesos)
+        );
+        CREATE TABLE IF NOT EXISTS diagnosticos_compactos (
+            organizacao_id INTEGER PRIMARY KEY REFERENCES organizacoes(id) ON DELETE CASCADE,
+            questionario_versao INTEGER NOT NULL REFERENCES questionarios(versao),
+            notas SMALLINT[70] NOT NULL CHECK (0 <= ALL(notas) AND 5 >= ALL(notas)),
+            respondido_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE OR REPLACE VIEW respostas_expandidas AS
+            SELECT organizacao_id, variavel, pergunta_numero, nota, peso
+            FROM respostas_diagnostico
+            UNION ALL
+            SELECT d.organizacao_id, q.variaveis[i], q.numeros[i]::integer, d.notas[i]::integer, q.pesos[i]
+            FROM diagnosticos_compactos d
+            JOIN questionarios q ON q.versao = d.questionario_versao
+            CROSS JOIN LATERAL generate_subscripts(d.notas, 1) AS i;
+    """),
+    (7, "Progresso das importações em lote", """
+        CREATE TABLE IF NOT EXISTS importacoes (
+            chave CHAR(64) PRIMARY KEY,
+            arquivo TEXT NOT NULL,
+            linhas_processadas INTEGER NOT NULL DEFAULT 0,
+            importados INTEGER NOT NULL DEFAULT 0,
+            rejeitados INTEGER NOT NULL DEFAULT 0,
+            concluida BOOLEAN NOT NULL DEFAULT FALSE,
+            iniciada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            atualizada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (8, "Pontuações calculadas por diagnóstico", """
+        -- Preenchida ao salvar; diagnósticos anteriores: python -m src.db preencher-pontuacoes
+        CREATE TABLE IF NOT EXISTS pontuacoes (
+            organizacao_id INTEGER PRIMARY KEY REFERENCES organizacoes(id) ON DELETE CASCADE,
+            media_if DOUBLE PRECISION NOT NULL,
+            media_cm DOUBLE PRECISION NOT NULL,
+            media_et DOUBLE PRECISION NOT NULL,
+            media_dreq DOUBLE PRECISION NOT NULL,
+            media_lc DOUBLE PRECISION NOT NULL,
+            media_im DOUBLE PRECISION NOT NULL,
+            media_pv DOUBLE PRECISION NOT NULL,
+            rexp DOUBLE PRECISION,
+            zona TEXT NOT NULL,
+            cognitiva DOUBLE PRECISION NOT NULL,
+            estrategica DOUBLE PRECISION NOT NULL,
+            operacional DOUBLE PRECISION NOT NULL,
+            cultural DOUBLE PRECISION NOT NULL,
+            calculado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (9, "Tendência: índice por data e pontuações por empresa e mês", """
+        CREATE INDEX IF NOT EXISTS idx_org_nome_criado ON organizacoes (nome, criado_em);
+        CREATE TABLE IF NOT EXISTS pontuacoes_periodo (
+            empresa TEXT NOT NULL,
+            periodo DATE NOT NULL,
+            num_diagnosticos INTEGER NOT NULL DEFAULT 0,
+            num_rexp INTEGER NOT NULL DEFAULT 0,
+            soma_rexp DOUBLE PRECISION NOT NULL DEFAULT 0,
+            soma_cognitiva DOUBLE PRECISION NOT NULL DEFAULT 0,
+            soma_estrategica DOUBLE PRECISION NOT NULL DEFAULT 0,
+            soma_operacional DOUBLE PRECISION NOT NULL DEFAULT 0,
+            soma_cultural DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (empresa, periodo)
+        );
+        INSERT INTO pontuacoes_periodo
+            SELECT LOWER(TRIM(o.nome)), date_trunc('month', o.criado_em)::date,
+                   COUNT(*), COUNT(p.rexp), COALESCE(SUM(p.rexp), 0),
+                   SUM(p.cognitiva), SUM(p.estrategica), SUM(p.operacional), SUM(p.cultural)
+            FROM organizacoes o
+            JOIN pontuacoes p ON p.organizacao_id = o.id
+            GROUP BY 1, 2;
+    """),
+    (10, "Pontuação agregada de cada empresa (painel de empresas)", """
+        -- Preenchida ao salvar; empresas anteriores: python -m src.db pontuar-empresas
+        CREATE TABLE IF NOT EXISTS pontuacoes_empresa (
+            empresa TEXT PRIMARY KEY,
+            num_diagnosticos INTEGER NOT NULL,
+            media_if DOUBLE PRECISION NOT NULL,
+            media_cm DOUBLE PRECISION NOT NULL,
+            media_et DOUBLE PRECISION NOT NULL,
+            media_dreq DOUBLE PRECISION NOT NULL,
+            media_lc DOUBLE PRECISION NOT NULL,
+            media_im DOUBLE PRECISION NOT NULL,
+            media_pv DOUBLE PRECISION NOT NULL,
+            rexp DOUBLE PRECISION,
+            zona TEXT NOT NULL,
+            cognitiva DOUBLE PRECISION NOT NULL,
+            estrategica DOUBLE PRECISION NOT NULL,
+            operacional DOUBLE PRECISION NOT NULL,
+            cultural DOUBLE PRECISION NOT NULL,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_pontuacoes_empresa_rexp ON pontuacoes_empresa (rexp DESC NULLS LAST);
+    """),
+    (11, "Índice de cobertura para o último diagnóstico do respondente", """
+        -- Atende WHERE nome/responsavel/matricula + ORDER BY criado_em DESC LIMIT 1 só com o índice
+        CREATE INDEX IF NOT EXISTS idx_org_respondente_criado
+            ON organizacoes (nome, responsavel, matricula, criado_em DESC) INCLUDE (id);
+        DROP INDEX IF EXISTS idx_org_nome_resp_matricula;
+    """),
+    (12, "Impressão digital dos envios (gravação idempotente)", """
+        -- Diagnósticos anteriores ficam com NULL (o índice único aceita vários NULL)
+        ALTER TABLE organizacoes ADD COLUMN IF NOT EXISTS impressao CHAR(64);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_org_impressao ON organizacoes (impressao);
+    """),
+    (13, "Histograma das notas nos agregados por empresa", """
+        ALTER TABLE agregados_empresa
+            ADD COLUMN IF NOT EXISTS qtd_nota_0 INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qtd_nota_1 INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qtd_nota_2 INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qtd_nota_3 INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qtd_nota_4 INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS qtd_nota_5 INTEGER NOT NULL DEFAULT 0;
+        UPDATE agregados_empresa a SET
+            qtd_nota_0 = h.n0, qtd_nota_1 = h.n1, qtd_nota_2 = h.n2,
+            qtd_nota_3 = h.n3, qtd_nota_4 = h.n4, qtd_nota_5 = h.n5
+        FROM (
+            SELECT LOWER(TRIM(o.nome)) AS empresa, r.variavel, r.pergunta_numero,
+                   COUNT(*) FILTER (WHERE r.nota = 0) AS n0, COUNT(*) FILTER (WHERE r.nota = 1) AS n1,
+                   COUNT(*) FILTER (WHERE r.nota = 2) AS n2, COUNT(*) FILTER (WHERE r.nota = 3) AS n3,
+                   COUNT(*) FILTER (WHERE r.nota = 4) AS n4, COUNT(*) FILTER (WHERE r.nota = 5) AS n5
+            FROM organizacoes o
+            JOIN respostas_expandidas r ON r.organizacao_id = o.id
+            GROUP BY 1, 2, 3
+        ) h
+        WHERE a.empresa = h.empresa AND a.variavel = h.variavel AND a.pergunta_numero = h.pergunta_numero;
+    """),
+    (14, "Diagnóstico compacto com as 70 notas do questionário", """
+        -- NOT VALID: vale para as novas gravações sem varrer as linhas já existentes
+        ALTER TABLE diagnosticos_compactos
+            ADD CONSTRAINT diagnosticos_compactos_num_notas CHECK (array_length(notas, 1) = 70) NOT VALID;
+    """),
+    (15, "Índice pelo nome normalizado da empresa", """
+        -- Mesma expressão dos filtros por empresa (LOWER(TRIM(nome)) = %s); LOWER(nome) não os atende
+        CREATE INDEX IF NOT EXISTS idx_org_empresa ON organizacoes (LOWER(TRIM(nome)));
+        DROP INDEX IF EXISTS idx_org_nome_lower;
+    """),
+    (16, "Remove o índice (nome, criado_em), que nenhuma consulta usa", """
+        -- Tendência da empresa: pontuacoes_periodo; do respondente: idx_org_respondente_criado
+        DROP INDEX IF EXISTS idx_org_nome_criado;
+    """),
+]
+
+# Tabelas do app, na ordem em que podem ser removidas
+TABELAS = [
+    "pontuacoes_empresa", "pontuacoes_periodo", "pontuacoes", "importacoes", "resumos_cache", "agregados_empresa_totais", "agregados_empresa",
+    "diagnosticos_compactos", "questionarios", "respostas_diagnostico", "organizacoes", "schema_version",
+]
+
+_esquema_ok = False
+_esquema_lock = threading.Lock()
+
+
+def versao_atual(cur):
+    cur.execute("SELECT to_regclass('schema_version')")
+    if cur.fetchone()[0] is None:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+@medido("db.migrar")
+def migrar(alvo=None):
+    """
+    Aplica, em uma única transação, as migrações com versão maior que a atual
+    (até `alvo`, se informado).
+    :return: Lista de (versao, descricao) aplicadas
+    """
+    aplicadas = []
+    with db.conexao() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_MIGRACOES,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        atual = versao_atual(cur)
+        for versao, descricao, sql in MIGRACOES:
+            if versao <= atual or (alvo is not None and versao > alvo):
+                continue
+            cur.execute(sql)
+            cur.execute(
+                "INSERT INTO schema_version (versao, descricao) VALUES (%s, %s)",
+                (versao, descricao)
+            )
+            aplicadas.append((versao, descricao))
+        cur.close()
+    return aplicadas
+
+
+def garantir_esquema():
+    """
+    Aplica as migrações pendentes na primeira chamada do processo; as seguintes não
+    acessam o banco.
+    """
+    global _esquema_ok
+    if _esquema_ok:
+        return
+    with _esquema_lock:
+        if not _esquema_ok:
+            migrar()
+            _esquema_ok = True
+
+
+def resetar_banco():
+    """
+    Remove todas as tabelas do app e recria o esquema na versão mais recente.
+    """
+    global _esquema_ok
+    with db.conexao() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS " + ", ".join(TABELAS) + " CASCADE")
+        cur.close()
+    db.limpar_cache_versoes()
+    with _esquema_lock:
+        _esquema_ok = False
+    garantir_esquema()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrações do banco de dados DREXUS ICE³-R.")
+    parser.add_argument("--status", action="store_true", help="Mostra a versão atual e as pendentes.")
+    parser.add_argument("--alvo", type=int, help="Aplica as migrações apenas até esta versão.")
+    args = parser.parse_args()
+
+    if args.status:
+        with db.conexao() as conn:
+            cur = conn.cursor()
+            atual = versao_atual(cur)
+            cur.close()
+        print(f"Versão atual do esquema: {atual}")
+        for versao, descricao, _ in MIGRACOES:
+            if versao > atual:
+                print(f"  pendente: {versao} - {descricao}")
+        return
+
+    aplicadas = migrar(args.alvo)
+    if not aplicadas:
+        print("Esquema já está atualizado.")
+    for versao, descricao in aplicadas:
+        print(f"Aplicada: {versao} - {descricao}")
+
+
+if __name__ == "__main__":
+    main()
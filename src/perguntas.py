@@ -87,3 +87,13 @@ perguntas = {
         ("O propósito vivo é reconhecido como diferencial?", 0.10),
     ],
 }
+
+nomes_longos = {
+    "If": "Integridade Funcional",
+    "Cm": "Capacidade de Modularidade",
+    "Et": "Evolução sob Estresse",
+    "DREq": "Densidade de DREs",
+    "Lc": "Lógica Contextual",
+    "Im": "Impacto Sistêmico das DREs",
+    "Pv": "Propósito Vivo",
+}
@@ -0,0 +1,126 @@
+"""
+Serialização compacta dos dados do diagnóstico para o prompt e contagem de tokens.
+
+Em vez do repr das 70 tuplas (nota, peso), o prompt recebe uma linha por variável com a
+média e as notas arredondadas, mais as perguntas que destoam da média da variável e os
+pontos de alavanca (perguntas em que +1 ponto mais aumenta o Rexp, de src/sensibilidade.py).
+Se o prompt passar do orçamento de tokens, os detalhes são reduzidos em etapas.
+"""
+
+import logging
+import math
+import os
+
+from .perguntas import perguntas as perguntas_padrao, nomes_longos
+from .sensibilidade import MAX_ALAVANCAS, pontos_alavanca
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "2000"))
+LIMIAR_DESTAQUE = 1.5  # distância (em pontos de nota) da média da variável
+MAX_DESTAQUES = 8
+
+_codificadores = {}  # modelo -> codificador do tiktoken, ou None (estimativa)
+
+logger = logging.getLogger(__name__)
+
+
+class OrcamentoTokensExcedido(Exception):
+    """
+    O prompt mínimo (sem detalhes nem contexto) ainda passa do orçamento de tokens.
+    """
+
+
+def _codificador(modelo):
+    # O tiktoken baixa o arquivo da codificação no primeiro uso; sem ele (ou sem acesso à
+    # internet e sem TIKTOKEN_CACHE_DIR), a contagem passa a ser estimada
+    if modelo not in _codificadores:
+        try:
+            import tiktoken
+            try:
+                _codificadores[modelo] = tiktoken.encoding_for_model(modelo)
+            except KeyError:
+                _codificadores[modelo] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning("tiktoken indisponível (%s); tokens estimados em 4 caracteres por token.", e)
+            _codificadores[modelo] = None
+    return _codificadores[modelo]
+
+
+def contar_tokens(texto, modelo="gpt-4o"):
+    """
+    Número de tokens do texto, com o tiktoken. Se ele não puder ser carregado, estima
+    em 1 token a cada 4 caracteres.
+    """
+    codificador = _codificador(modelo)
+    if codificador is None:
+        return math.ceil(len(texto) / 4)
+    return len(codificador.encode(texto))
+
+
+def contar_tokens_mensagens(mensagens, modelo="gpt-4o"):
+    """
+    Tokens de entrada de uma lista de mensagens de chat (inclui ~4 tokens de estrutura por mensagem).
+    """
+    return sum(contar_tokens(m["content"], modelo) + 4 for m in mensagens) + 2
+
+
+def _fmt_nota(nota):
+    return f"{float(nota):.1f}".rstrip("0").rstrip(".")
+
+
+def _media_variavel(valores):
+    soma_pesos = sum(float(peso) for _, peso in valores)
+    if soma_pesos <= 0:
+        return 0.0
+    return sum(float(nota) * float(peso) for nota, peso in valores) / soma_pesos
+
+
+def perguntas_destaque(respostas, perguntas=perguntas_padrao, limiar=LIMIAR_DESTAQUE, maximo=MAX_DESTAQUES):
+    """
+    Perguntas cuja nota se afasta da média ponderada da variável em pelo menos `limiar`
+    pontos; sem nenhuma, as 3 menores notas.
+    :return: Lista de (variavel, numero, texto, nota, media_variavel), maiores desvios primeiro
+    """
+    candidatas = []
+    for var, valores in respostas.items():
+        media = _media_variavel(valores)
+        textos = perguntas.get(var, [])
+        for i, (nota, _) in enumerate(valores):
+            texto = textos[i][0] if i < len(textos) else ""
+            candidatas.append((abs(float(nota) - media), var, i + 1, texto, float(nota), media))
+    destaques = [c for c in candidatas if c[0] >= limiar]
+    if destaques:
+        destaques.sort(key=lambda c: -c[0])
+    else:
+        destaques = sorted(candidatas, key=lambda c: c[4])[:3]
+    return [c[1:] for c in destaques[:maximo]]
+
+
+def serializar_diagnostico(respostas, medias, rexp, zona, detalhar_notas=True, max_destaques=MAX_DESTAQUES,
+                           perguntas=perguntas_padrao, max_alavancas=MAX_ALAVANCAS):
+    """
+    Texto compacto com as médias, Rexp, zona, perguntas de destaque e pontos de alavanca do diagnóstico.
+    :param detalhar_notas: Inclui as notas de cada pergunta (arredondadas em 1 casa)
+    """
+    linhas = [f"Rexp: {rexp} | Zona de maturidade: {zona}"]
+    if detalhar_notas:
+        linhas.append("Variáveis (média 0-1 | notas 0-5 das perguntas, em ordem):")
+    else:
+        linhas.append("Variáveis (média 0-1):")
+    for var, media in medias.items():
+        linha = f"- {var} {nomes_longos.get(var, var)}: {float(media):.2f}"
+        if detalhar_notas and var in respostas:
+            linha += " | " + " ".join(_fmt_nota(nota) for nota, _ in respostas[var])
+        linhas.append(linha)
+    destaques = perguntas_destaque(respostas, perguntas, maximo=max_destaques) if max_destaques else []
+    if destaques:
+        linhas.append("Perguntas de destaque (nota; média da variável):")
+        for var, numero, texto, nota, media in destaques:
+            linhas.append(f"- {var}{numero} {texto} {_fmt_nota(nota)}; {media:.1f}")
+    alavancas = pontos_alavanca(respostas, max_alavancas, perguntas=perguntas) if max_alavancas else []
+    if alavancas:
+        linhas.append("Pontos de alavanca (aumento do Rexp com +1 ponto na pergunta; nota atual):")
+        for alavanca in alavancas:
+            linhas.append(
+                f"- {alavanca['pergunta']} {alavanca['texto']} +{alavanca['ganho']:.3f}; {_fmt_nota(alavanca['nota'])}"
+            )
+    return "\n".join(linhas)
@@ -0,0 +1,330 @@
+"""
+Geração do resumo inteligente (OpenAI) e cache dos resumos gerados.
+
+A chamada usa o cliente oficial da OpenAI; OPENAI_BASE_URL permite apontá-la para
+qualquer servidor compatível (por exemplo, um servidor falso local em testes).
+O resumo pode ser obtido completo (gerar_resumo) ou em partes, à medida que os
+tokens chegam (gerar_resumo_stream).
+
+O cache tem dois níveis: um LRU em memória, compartilhado pelo processo, e uma tabela
+PostgreSQL (resumos_cache) com validade (TTL), que sobrevive a reinícios e é
+compartilhada entre instâncias. A chave é o hash das mensagens enviadas e dos
+parâmetros do modelo, então dados idênticos reutilizam o mesmo resumo.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import db, metricas
+from .armazenamento import usa_postgres
+from .migracoes import garantir_esquema
+from .prompt import (
+    MAX_ALAVANCAS, MAX_DESTAQUES, PROMPT_MAX_TOKENS, OrcamentoTokensExcedido, contar_tokens_mensagens, serializar_diagnostico
+)
+
+MODELO = "gpt-4o"
+MAX_TOKENS = 800
+TEMPERATURA = 0.7
+MENSAGEM_SISTEMA = "Você é um consultor especialista em organizações regenerativas e maturidade organizacional."
+
+logger = logging.getLogger(__name__)
+
+CACHE_TAMANHO = int(os.getenv("RESUMO_CACHE_TAMANHO", "256"))
+CACHE_TTL = float(os.getenv("RESUMO_CACHE_TTL", str(7 * 24 * 3600)))  # segundos
+
+
+def chave_resumo(mensagens, modelo=MODELO, max_tokens=MAX_TOKENS, temperatura=TEMPERATURA):
+    """
+    Hash SHA-256 das mensagens e dos parâmetros do modelo.
+    """
+    conteudo = json.dumps(
+        {"mensagens": mensagens, "modelo": modelo, "max_tokens": max_tokens, "temperatura": temperatura},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+class CacheResumos:
+    """
+    Cache de resumos em dois níveis (memória LRU + PostgreSQL com TTL).
+    Falhas no banco não interrompem a geração: o cache apenas deixa de ser usado.
+    Com o armazenamento SQLite, só o nível em memória é usado.
+    """
+
+    def __init__(self, tamanho=CACHE_TAMANHO, ttl=CACHE_TTL):
+        self.tamanho = tamanho
+        self.ttl = ttl
+        self._memoria = OrderedDict()  # chave -> (resumo, empresa, expira_em)
+        self._lock = threading.Lock()
+
+    def _garantir_tabela(self):
+        # A tabela resumos_cache é criada pelas migrações (uma vez por processo)
+        garantir_esquema()
+
+    def _guardar_memoria(self, chave, resumo, empresa, expira_em):
+        with self._lock:
+            self._memoria[chave] = (resumo, empresa, expira_em)
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.tamanho:
+                self._memoria.popitem(last=False)
+
+    @metricas.medido("resumo.cache_obter")
+    def obter(self, chave):
+        """
+        Retorna o resumo em cache para a chave, ou None.
+        """
+        with self._lock:
+            item = self._memoria.get(chave)
+            if item is not None:
+                if item[2] > time.time():
+                    self._memoria.move_to_end(chave)
+                    return item[0]
+                del self._memoria[chave]
+        if not usa_postgres():
+            return None
+        try:
+            self._garantir_tabela()
+            with db.conexao() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT resumo, empresa, EXTRACT(EPOCH FROM expira_em - CURRENT_TIMESTAMP)
+                    FROM resumos_cache
+                    WHERE chave = %s AND expira_em > CURRENT_TIMESTAMP
+                """, (chave,))
+                linha = cur.fetchone()
+                cur.close()
+        except Exception as e:
+            logger.warning("Cache de resumos indisponível no banco: %s", e)
+            return None
+        if not linha:
+            return None
+        resumo, empresa, restante = linha
+        self._guardar_memoria(chave, resumo, empresa, time.time() + float(restante))
+        return resumo
+
+    @metricas.medido("resumo.cache_guardar")
+    def guardar(self, chave, resumo, empresa=None, modelo=MODELO):
+        """
+        Guarda o resumo nos dois níveis do cache.
+        """
+        empresa = db.normalizar_empresa(empresa) if empresa else None
+        self._guardar_memoria(chave, resumo, empresa, time.time() + self.ttl)
+        if not usa_postgres():
+            return
+        try:
+            self._garantir_tabela()
+            with db.conexao() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    INSERT INTO resumos_cache (chave, empresa, modelo, resumo, expira_em)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                    ON CONFLICT (chave) DO UPDATE SET
+                        resumo = EXCLUDED.resumo,
+                        criado_em = CURRENT_TIMESTAMP,
+                        expira_em = EXCLUDED.expira_em
+                """, (chave, empresa, modelo, resumo, self.ttl))
+                cur.close()
+        except Exception as e:
+            logger.warning("Não foi possível gravar o resumo no cache do banco: %s", e)
+
+    def invalidar(self, chave=None, empresa=None):
+        """
+        Remove do cache uma chave, todos os resumos de uma empresa ou, sem argumentos, tudo.
+        :return: Número de registros removidos do banco
+        """
+        empresa = db.normalizar_empresa(empresa) if empresa else None
+        with self._lock:
+            if chave is None and empresa is None:
+                self._memoria.clear()
+            else:
+                for k in [k for k, (_, emp, _) in self._memoria.items()
+                          if k == chave or (empresa is not None and emp == empresa)]:
+                    del self._memoria[k]
+        self._garantir_tabela()
+        with db.conexao() as conn:
+            cur = conn.cursor()
+            if chave is not None:
+                cur.execute("DELETE FROM resumos_cache WHERE chave = %s", (chave,))
+            elif empresa is not None:
+                cur.execute("DELETE FROM resumos_cache WHERE empresa = %s", (empresa,))
+            else:
+                cur.execute("DELETE FROM resumos_cache")
+            removidos = cur.rowcount
+            cur.close()
+        return removidos
+
+    def remover_expirados(self):
+        """
+        Apaga do banco os resumos vencidos.
+        :return: Número de registros removidos
+        """
+        with self._lock:
+            agora = time.time()
+            for k in [k for k, (_, _, expira_em) in self._memoria.items() if expira_em <= agora]:
+                del self._memoria[k]
+        self._garantir_tabela()
+        with db.conexao() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM resumos_cache WHERE expira_em <= CURRENT_TIMESTAMP")
+            removidos = cur.rowcount
+            cur.close()
+        return removidos
+
+
+# Instância do processo: o LRU é compartilhado por todos os reruns e sessões do Streamlit
+cache_resumos = CacheResumos()
+
+
+@metricas.medido("resumo.montar_mensagens")
+def montar_mensagens(empresa, responsavel, matricula, respostas, medias, rexp, zona, conhecimento_drexus,
+                     max_tokens_prompt=PROMPT_MAX_TOKENS):
+    """
+    Monta as mensagens (system + user) enviadas ao modelo, com os dados do diagnóstico
+    serializados de forma compacta. Se passar de `max_tokens_prompt` tokens, reduz em etapas:
+    tira as notas por pergunta, depois os trechos de contexto menos relevantes e, por fim,
+    parte das perguntas de destaque e dos pontos de alavanca.
+    """
+    trechos = [t for t in conhecimento_drexus.split("\n\n") if t.strip()]
+    etapas = [(True, MAX_DESTAQUES, len(trechos)), (False, MAX_DESTAQUES, len(trechos))]
+    etapas += [(False, MAX_DESTAQUES, n) for n in range(len(trechos) - 1, -1, -1)]
+    etapas += [(False, 3, 0), (False, 0, 0)]
+    for detalhar_notas, max_destaques, num_trechos in etapas:
+        dados = serializar_diagnostico(
+            respostas, medias, rexp, zona, detalhar_notas=detalhar_notas, max_destaques=max_destaques,
+            max_alavancas=min(max_destaques, MAX_ALAVANCAS)
+        )
+        contexto = "\n\n".join(trechos[:num_trechos]) or "(não incluído)"
+        prompt = (
+            f"Empresa: {empresa}\n"
+            f"Responsável: {responsavel}\n"
+            f"Matrícula: {matricula}\n"
+            f"{dados}\n"
+            f"Contexto do DREXUS (trechos relevantes para as variáveis mais fracas):\n{contexto}\n\n"
+            "Faça um resumo detalhado da situação da empresa, identifique vulnerabilidades e sugira "
+            "as 5 principais ações prioritárias e objetivas para evolução imediata, começando pelos pontos "
+            "de alavanca, quando listados. Seja claro e prático."
+        )
+        mensagens = [
+            {"role": "system", "content": MENSAGEM_SISTEMA},
+            {"role": "user", "content": prompt}
+        ]
+        tokens = contar_tokens_mensagens(mensagens, MODELO)
+        if tokens <= max_tokens_prompt:
+            return mensagens
+    raise OrcamentoTokensExcedido(
+        f"O prompt mínimo tem {tokens} tokens, acima do orçamento de {max_tokens_prompt} (PROMPT_MAX_TOKENS)."
+    )
+
+
+class ChaveOpenAIAusente(Exception):
+    """
+    OPENAI_API_KEY não configurada e o resumo não está em cache.
+    """
+
+
+def _cliente_openai():
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ChaveOpenAIAusente("Chave da API OpenAI não está configurada. Configure a variável OPENAI_API_KEY.")
+    from openai import OpenAI
+    return OpenAI()
+
+
+@metricas.medido("openai.resumo")
+def gerar_resumo(mensagens, empresa=None, usar_cache=True, cliente=None):
+    """
+    Gera o resumo completo, consultando o cache antes de chamar a API.
+    :return: Texto do resumo
+    """
+    chave = chave_resumo(mensagens)
+    if usar_cache:
+        em_cache = cache_resumos.obter(chave)
+        metricas.incrementar("drexus_resumo_cache_total", resultado="acerto" if em_cache is not None else "falha")
+        if em_cache is not None:
+            return em_cache
+    cliente = cliente or _cliente_openai()
+    tokens = contar_tokens_mensagens(mensagens, MODELO)
+    metricas.incrementar("drexus_openai_tokens_entrada_total", tokens)
+    logger.info("Resumo%s: %d tokens de entrada (orçamento %d)", f" de {empresa}" if empresa else "", tokens,
+                PROMPT_MAX_TOKENS)
+    with metricas.trecho("openai.chat_completions"):
+        response = cliente.chat.completions.create(
+            model=MODELO,
+            messages=mensagens,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURA
+        )
+    resumo = response.choices[0].message.content
+    if resumo:
+        cache_resumos.guardar(chave, resumo, empresa=empresa)
+    return resumo
+
+
+@metricas.medido("openai.resumo_stream")
+def gerar_resumo_stream(mensagens, empresa=None, usar_cache=True, cliente=None):
+    """
+    Gera o resumo em partes, à medida que os tokens chegam da API.
+    Um resumo em cache é entregue de uma vez. O texto completo é guardado no cache
+    somente quando o stream termina sem erro; uma falha no meio é levantada para quem
+    consome o gerador, sem cache do texto parcial.
+    :return: Gerador de trechos de texto
+    """
+    chave = chave_resumo(mensagens)
+    if usar_cache:
+        em_cache = cache_resumos.obter(chave)
+        metricas.incrementar("drexus_resumo_cache_total", resultado="acerto" if em_cache is not None else "falha")
+        if em_cache is not None:
+            yield em_cache
+            return
+    cliente = cliente or _cliente_openai()
+    tokens = contar_tokens_mensagens(mensagens, MODELO)
+    metricas.incrementar("drexus_openai_tokens_entrada_total", tokens)
+    logger.info("Resumo%s: %d tokens de entrada (orçamento %d)", f" de {empresa}" if empresa else "", tokens,
+                PROMPT_MAX_TOKENS)
+    inicio = time.perf_counter()
+    stream = cliente.chat.completions.create(
+        model=MODELO,
+        messages=mensagens,
+        max_tokens=MAX_TOKENS,
+        temperature=TEMPERATURA,
+        stream=True
+    )
+    partes = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        trecho = chunk.choices[0].delta.content
+        if trecho:
+            if not partes:
+                # Latência percebida pelo usuário: até o primeiro token aparecer na tela
+                metricas.observar("openai.primeiro_token", time.perf_counter() - inicio)
+            partes.append(trecho)
+            yield trecho
+    if partes:
+        cache_resumos.guardar(chave, "".join(partes), empresa=empresa)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção do cache de resumos DREXUS.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    invalidar = comandos.add_parser("invalidar", help="Remove resumos do cache.")
+    invalidar.add_argument("--empresa", help="Remove apenas os resumos desta empresa.")
+    invalidar.add_argument("--chave", help="Remove apenas o resumo com esta chave.")
+    comandos.add_parser("limpar-expirados", help="Apaga os resumos vencidos.")
+    args = parser.parse_args()
+
+    if args.comando == "invalidar":
+        removidos = cache_resumos.invalidar(chave=args.chave, empresa=args.empresa)
+        print(f"{removidos} resumo(s) removido(s) do cache.")
+    elif args.comando == "limpar-expirados":
+        removidos = cache_resumos.remover_expirados()
+        print(f"{removidos} resumo(s) expirado(s) removido(s).")
+
+
+if __name__ == "__main__":
+    main()
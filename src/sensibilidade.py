@@ -0,0 +1,154 @@
+"""
+Sensibilidade do Rexp às perguntas e simulação de cenários ("e se estas perguntas subirem 1 ponto?").
+
+Rexp = If·Cm·Et·(1 + DREq·(1 + Lc·Im·Pv)) é multilinear nas médias das variáveis, e cada média
+é uma combinação linear (pelos pesos das perguntas) das notas da própria variável. Por isso a
+derivada do Rexp em relação à nota de uma pergunta é exata: mudar só essa nota em Δ muda o Rexp
+em exatamente derivada·Δ (antes do arredondamento em 3 casas).
+
+    efeitos = efeitos_lote(notas, pesos)                  # (N, 70) derivadas por ponto de nota
+    alavancas = pontos_alavanca(respostas, maximo=5)      # perguntas com maior ganho de Rexp
+    rexp = simular_cenarios(notas, [cenario(["If3", "Cm1"])], pesos)   # (1, N)
+"""
+
+import numpy as np
+
+from .calculos import (
+    NOTAS_POSSIVEIS, VARIAVEIS_REXP, colunas_medias, estrutura_questionario, matrizes_respostas,
+    medias_lote, rexp_lote,
+)
+from .perguntas import perguntas as perguntas_padrao
+
+NOTA_MAXIMA = float(NOTAS_POSSIVEIS[-1])
+MAX_ALAVANCAS = 5
+
+
+def derivadas_rexp(medias, variaveis):
+    """
+    Derivadas parciais do Rexp em relação às médias das variáveis.
+    :param medias: Matriz (N, V) de médias normalizadas (sem arredondar)
+    :param variaveis: Nomes das V colunas
+    :return: Matriz (N, V); variáveis fora da fórmula têm derivada 0
+    """
+    medias = np.atleast_2d(np.asarray(medias, dtype=float))
+    if_, cm, et, dreq, lc, im, pv = colunas_medias(medias, variaveis, VARIAVEIS_REXP)
+    base = if_ * cm * et
+    amplificador = 1 + dreq * (1 + lc * im * pv)
+    parciais = {
+        "If": cm * et * amplificador,
+        "Cm": if_ * et * amplificador,
+        "Et": if_ * cm * amplificador,
+        "DREq": base * (1 + lc * im * pv),
+        "Lc": base * dreq * im * pv,
+        "Im": base * dreq * lc * pv,
+        "Pv": base * dreq * lc * im,
+    }
+    resultado = np.zeros_like(medias)
+    for j, var in enumerate(variaveis):
+        if var in parciais:
+            resultado[:, j] = parciais[var]
+    return resultado
+
+
+def efeitos_lote(notas, pesos=None, perguntas=perguntas_padrao):
+    """
+    Efeito marginal exato de cada pergunta no Rexp: variação do Rexp por ponto de nota,
+    considerando o peso da pergunta na média da sua variável.
+    :param notas: Matriz (N, 70) de notas, colunas na ordem de `perguntas`
+    :param pesos: Vetor (70,) ou matriz (N, 70) de pesos; padrão: pesos de `perguntas`
+    :return: Matriz (N, 70)
+    """
+    variaveis, pesos_padrao, grupos = estrutura_questionario(perguntas)
+    notas = np.atleast_2d(np.asarray(notas, dtype=float))
+    pesos = np.broadcast_to(np.asarray(pesos_padrao if pesos is None else pesos, dtype=float), notas.shape)
+    medias = medias_lote(notas, pesos, grupos, len(variaveis), arredondar=False)
+    # d(média da variável)/d(nota) = peso da pergunta / (5 · soma dos pesos da variável)
+    indicadora = np.zeros((notas.shape[1], len(variaveis)))
+    indicadora[np.arange(notas.shape[1]), grupos] = 1.0
+    soma_pesos = (pesos @ indicadora)[:, grupos] * 5
+    derivada_media = np.divide(pesos, soma_pesos, out=np.zeros_like(pesos), where=soma_pesos > 0)
+    return derivadas_rexp(medias, variaveis)[:, grupos] * derivada_media
+
+
+def ganhos_lote(notas, pesos=None, pontos=1.0, perguntas=perguntas_padrao):
+    """
+    Variação exata do Rexp (sem arredondar) ao subir, uma de cada vez, cada pergunta em
+    `pontos` (limitado à nota máxima).
+    :return: Matriz (N, 70)
+    """
+    notas = np.atleast_2d(np.asarray(notas, dtype=float))
+    aumento = np.clip(np.minimum(pontos, NOTA_MAXIMA - notas), 0, None)
+    return efeitos_lote(notas, pesos, perguntas) * aumento
+
+
+def rotulos_perguntas(perguntas=perguntas_padrao):
+    """
+    Rótulos das perguntas na ordem das colunas (If1 ... Pv10).
+    """
+    return [f"{var}{i}" for var, lista in perguntas.items() for i in range(1, len(lista) + 1)]
+
+
+def cenario(questoes, pontos=1.0, perguntas=perguntas_padrao):
+    """
+    Vetor (70,) de aumentos para simular_cenarios: `pontos` nas perguntas informadas.
+    :param questoes: Rótulos das perguntas (ex.: ["If3", "Cm1"]) ou dicionário {rótulo: pontos}
+    """
+    rotulos = rotulos_perguntas(perguntas)
+    posicoes = {rotulo: i for i, rotulo in enumerate(rotulos)}
+    aumentos = questoes if isinstance(questoes, dict) else {questao: pontos for questao in questoes}
+    vetor = np.zeros(len(rotulos))
+    for questao, valor in aumentos.items():
+        if questao not in posicoes:
+            raise Exception(f"Pergunta inválida: {questao!r} (use rótulos como {rotulos[0]} ... {rotulos[-1]}).")
+        vetor[posicoes[questao]] += valor
+    return vetor
+
+
+def simular_cenarios(notas, cenarios, pesos=None, perguntas=perguntas_padrao):
+    """
+    Rexp de N diagnósticos em S cenários de mudança das notas, calculados de uma só vez.
+    :param notas: Matriz (N, 70) de notas
+    :param cenarios: Matriz (S, 70) de pontos somados às notas (resultado limitado a 0-5)
+    :param pesos: Vetor (70,) ou matriz (N, 70) de pesos; padrão: pesos de `perguntas`
+    :return: Matriz (S, N) de Rexp arredondado em 3 casas, como em pontuar_lote
+    """
+    variaveis, pesos_padrao, grupos = estrutura_questionario(perguntas)
+    notas = np.atleast_2d(np.asarray(notas, dtype=float))
+    cenarios = np.atleast_2d(np.asarray(cenarios, dtype=float))
+    pesos = np.broadcast_to(np.asarray(pesos_padrao if pesos is None else pesos, dtype=float), notas.shape)
+    formato = (cenarios.shape[0],) + notas.shape
+    novas = np.clip(notas[None, :, :] + cenarios[:, None, :], 0, NOTA_MAXIMA).reshape(-1, notas.shape[1])
+    pesos = np.broadcast_to(pesos, formato).reshape(-1, notas.shape[1])
+    medias = medias_lote(novas, pesos, grupos, len(variaveis))
+    return rexp_lote(medias, variaveis).reshape(formato[:2])
+
+
+def pontos_alavanca(respostas, maximo=MAX_ALAVANCAS, pontos=1.0, perguntas=perguntas_padrao):
+    """
+    Perguntas em que subir a nota em `pontos` mais aumenta o Rexp de um diagnóstico (ou das
+    médias de uma empresa). Empates ficam na ordem do questionário, então a lista é determinística.
+    :param respostas: Dicionário {variável: [(nota, peso), ...]}
+    :return: Lista de até `maximo` dicionários {"pergunta", "variavel", "numero", "texto", "nota",
+             "peso", "efeito" (Rexp por ponto), "ganho" (variação do Rexp)}, maior ganho primeiro;
+             só entram perguntas com ganho positivo
+    """
+    notas, pesos = matrizes_respostas([respostas], perguntas)
+    efeitos = efeitos_lote(notas, pesos, perguntas)[0]
+    ganhos = ganhos_lote(notas, pesos, pontos, perguntas)[0]
+    chaves = [(var, i, texto) for var, lista in perguntas.items() for i, (texto, _) in enumerate(lista, 1)]
+    alavancas = []
+    for j in np.argsort(-ganhos, kind="stable")[:maximo]:
+        if ganhos[j] <= 0:
+            break
+        var, numero, texto = chaves[j]
+        alavancas.append({
+            "pergunta": f"{var}{numero}",
+            "variavel": var,
+            "numero": numero,
+            "texto": texto,
+            "nota": float(notas[0, j]),
+            "peso": float(pesos[0, j]),
+            "efeito": float(efeitos[j]),
+            "ganho": float(ganhos[j]),
+        })
+    return alavancas
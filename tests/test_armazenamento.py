@@ -0,0 +1,144 @@
+"""
+Backend SQLite (src/armazenamento.py) em um banco em memória: gravação e envios duplicados,
+médias e distribuição da empresa, evolução por período e painel de empresas.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from src.armazenamento import ArmazenamentoSQLite
+from src.calculos import DIMENSOES, calcular_dimensoes, calcular_medias, calcular_rexp, interpretar_rexp
+from src.perguntas import perguntas
+
+
+def respostas_aleatorias(rng):
+    return {var: [(rng.randint(0, 5), peso) for _, peso in lista] for var, lista in perguntas.items()}
+
+
+def respostas_constantes(nota):
+    return {var: [(nota, peso) for _, peso in lista] for var, lista in perguntas.items()}
+
+
+@pytest.fixture
+def armazenamento():
+    return ArmazenamentoSQLite(":memory:")
+
+
+def mudar_data(armazenamento, responsavel, criado_em):
+    with armazenamento._conexao() as conn:
+        conn.execute("UPDATE organizacoes SET criado_em = ? WHERE responsavel = ?", (criado_em, responsavel))
+
+
+def test_salvar_e_buscar_ultimo_diagnostico(armazenamento):
+    rng = random.Random(1)
+    respostas = respostas_aleatorias(rng)
+    assert armazenamento.salvar_diagnostico("acme", "ana", respostas, "m1") is True
+    assert armazenamento.buscar_ultimo_diagnostico("acme", "ana", "m1") == respostas
+    assert armazenamento.buscar_ultimo_diagnostico("acme", "ana", "outra") is None
+
+    pontuacao = armazenamento.buscar_ultima_pontuacao("acme", "ana", "m1")
+    medias = calcular_medias(respostas)
+    rexp = calcular_rexp(medias)
+    assert pontuacao["medias"] == pytest.approx(medias)
+    assert pontuacao["rexp"] == pytest.approx(rexp)
+    assert pontuacao["zona"] == interpretar_rexp(rexp)
+    assert list(pontuacao["dimensoes"].values()) == pytest.approx(list(calcular_dimensoes(medias).values()))
+
+    # O diagnóstico mais recente do respondente prevalece
+    novas = respostas_aleatorias(rng)
+    assert armazenamento.salvar_diagnostico("acme", "ana", novas, "m1") is True
+    assert armazenamento.buscar_ultimo_diagnostico("acme", "ana", "m1") == novas
+
+
+def test_envio_duplicado_nao_grava(armazenamento):
+    respostas = respostas_aleatorias(random.Random(2))
+    assert armazenamento.salvar_diagnostico("acme", "ana", respostas, "m1") is True
+    assert armazenamento.salvar_diagnostico("acme", "ana", respostas, "m1") is False
+    assert armazenamento.buscar_media_empresa("acme")[1] == 1
+    # Outro respondente com as mesmas notas é outro diagnóstico
+    assert armazenamento.salvar_diagnostico("acme", "bia", respostas, "m2") is True
+    assert armazenamento.buscar_media_empresa("acme")[1] == 2
+
+
+def test_media_e_distribuicao_da_empresa(armazenamento):
+    rng = random.Random(3)
+    lista = [respostas_aleatorias(rng) for _ in range(6)]
+    for n, respostas in enumerate(lista):
+        armazenamento.salvar_diagnostico("Acme " if n % 2 else "ACME", f"r{n}", respostas, f"m{n}")
+    armazenamento.salvar_diagnostico("outra", "x", respostas_aleatorias(rng), "y")
+
+    medias, total = armazenamento.buscar_media_empresa(" acme")
+    assert total == 6
+    distribuicao, total_distribuicao = armazenamento.buscar_distribuicao_empresa("acme")
+    assert total_distribuicao == 6
+    for var, lista_perguntas in perguntas.items():
+        for i, (_, peso) in enumerate(lista_perguntas):
+            notas = [respostas[var][i][0] for respostas in lista]
+            media_nota, media_peso = medias[var][i]
+            assert media_nota == pytest.approx(np.mean(notas))
+            assert media_peso == pytest.approx(peso)
+            pergunta = distribuicao[var][i]
+            assert pergunta["histograma"] == [notas.count(nota) for nota in range(6)]
+            assert pergunta["respondentes"] == 6
+            assert pergunta["desvio"] == round(float(np.std(notas)), 3)
+            assert pergunta["quartis"] == [round(float(q), 3) for q in np.percentile(notas, [25, 50, 75])]
+
+    assert armazenamento.buscar_media_empresa("inexistente") == (None, 0)
+    assert armazenamento.buscar_distribuicao_empresa("inexistente") == (None, 0)
+
+
+def test_tendencia_por_periodo(armazenamento):
+    datas = {"r1": "2025-01-10 09:00:00.000", "r2": "2025-02-03 09:00:00.000", "r3": "2025-02-20 09:00:00.000"}
+    notas = {"r1": 1, "r2": 3, "r3": 5}
+    for responsavel, criado_em in datas.items():
+        armazenamento.salvar_diagnostico("acme", responsavel, respostas_constantes(notas[responsavel]), "m")
+        mudar_data(armazenamento, responsavel, criado_em)
+    rexp = {r: calcular_rexp(calcular_medias(respostas_constantes(nota))) for r, nota in notas.items()}
+
+    por_mes = armazenamento.buscar_tendencia("ACME", periodo="mes")
+    assert [(p["periodo"].isoformat(), p["num_diagnosticos"]) for p in por_mes] == [
+        ("2025-01-01", 1), ("2025-02-01", 2)
+    ]
+    assert por_mes[0]["rexp"] == pytest.approx(rexp["r1"])
+    assert por_mes[1]["rexp"] == pytest.approx(round((rexp["r2"] + rexp["r3"]) / 2, 3))
+    assert set(por_mes[1]["dimensoes"]) == set(DIMENSOES)
+
+    por_trimestre = armazenamento.buscar_tendencia("acme", periodo="trimestre")
+    assert [(p["periodo"].isoformat(), p["num_diagnosticos"]) for p in por_trimestre] == [("2025-01-01", 3)]
+
+    respondente = armazenamento.buscar_tendencia("acme", "r2", "m", periodo="mes")
+    assert [(p["periodo"].isoformat(), p["rexp"]) for p in respondente] == [("2025-02-01", rexp["r2"])]
+
+    with pytest.raises(Exception):
+        armazenamento.buscar_tendencia("acme", periodo="semana")
+
+
+def test_ranking_de_empresas(armazenamento):
+    # Empresa com notas maiores tem Rexp maior
+    for empresa, nota, respondentes in [("alfa", 2, 1), ("beta", 5, 2), ("gama", 4, 3), ("delta", 1, 1)]:
+        for n in range(respondentes):
+            armazenamento.salvar_diagnostico(empresa, f"r{n}", respostas_constantes(nota), f"m{n}")
+
+    itens, total = armazenamento.buscar_ranking_empresas()
+    assert total == 4
+    assert [item["empresa"] for item in itens] == ["beta", "gama", "alfa", "delta"]
+    assert [item["posicao"] for item in itens] == [1, 2, 3, 4]
+    assert [item["num_diagnosticos"] for item in itens] == [2, 3, 1, 1]
+    assert itens[0]["rexp"] == pytest.approx(calcular_rexp(calcular_medias(respostas_constantes(5))))
+
+    crescente, _ = armazenamento.buscar_ranking_empresas(decrescente=False)
+    assert [item["empresa"] for item in crescente] == ["delta", "alfa", "gama", "beta"]
+
+    pagina, total = armazenamento.buscar_ranking_empresas(pagina=2, por_pagina=3)
+    assert total == 4 and [item["empresa"] for item in pagina] == ["delta"]
+
+    # Busca e mínimo de diagnósticos mantêm a posição do ranking completo
+    busca, total = armazenamento.buscar_ranking_empresas(busca="GAM")
+    assert total == 1 and busca[0]["empresa"] == "gama" and busca[0]["posicao"] == 2
+    varios, total = armazenamento.buscar_ranking_empresas(min_diagnosticos=2, ordenar_por="num_diagnosticos")
+    assert [item["empresa"] for item in varios] == ["gama", "beta"]
+
+    with pytest.raises(Exception):
+        armazenamento.buscar_ranking_empresas(ordenar_por="inexistente")
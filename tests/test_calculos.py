@@ -0,0 +1,123 @@
+"""
+O motor vetorizado de src/calculos.py deve reproduzir exatamente o cálculo escalar original
+(somas com sum() e arredondamento com round()), também com entradas fracionárias como as
+médias da empresa. As estatísticas calculadas sobre os histogramas devem ser iguais às de
+np.mean, np.std e np.percentile sobre as notas expandidas.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from src.calculos import (
+    DIMENSOES, NOTAS_POSSIVEIS, arredondar_exato, calcular_dimensoes, calcular_medias, calcular_rexp,
+    estatisticas_histogramas, pontuar_respostas,
+)
+from src.perguntas import perguntas
+
+
+# Cálculo escalar original, antes do motor vetorizado
+def medias_original(respostas):
+    medias = {}
+    for var, vals in respostas.items():
+        notas = [nota for nota, peso in vals]
+        pesos = [peso for nota, peso in vals]
+        if sum(pesos) > 0:
+            media = sum(n * p for n, p in zip(notas, pesos)) / sum(pesos)
+        else:
+            media = 0
+        medias[var] = round(media / 5, 3)
+    return medias
+
+
+def rexp_original(medias):
+    rexpb = medias["If"] * medias["Cm"] * medias["Et"]
+    rexpa = 1 + medias["DREq"] * (1 + medias["Lc"] * medias["Im"] * medias["Pv"])
+    return round(rexpb * rexpa, 3)
+
+
+def dimensoes_original(medias):
+    return {
+        "Cognitiva": round(
+            medias.get("Lc", 0) * 0.5 + medias.get("Et", 0) * 0.3 + medias.get("DREq", 0) * 0.2, 3),
+        "Estratégica": round(
+            medias.get("Pv", 0) * 0.4 + medias.get("Im", 0) * 0.3 + medias.get("DREq", 0) * 0.3, 3),
+        "Operacional": round(
+            medias.get("If", 0) * 0.4 + medias.get("Cm", 0) * 0.3 + medias.get("Et", 0) * 0.3, 3),
+        "Cultural": round(
+            medias.get("Et", 0) * 0.4 + medias.get("DREq", 0) * 0.3 + medias.get("Pv", 0) * 0.3, 3),
+    }
+
+
+# Estatísticas por pergunta sobre as notas expandidas, antes do cálculo sobre os histogramas
+def estatisticas_original(histograma):
+    notas = np.repeat(NOTAS_POSSIVEIS, histograma)
+    if not len(notas):
+        return len(notas), np.nan, np.nan, [np.nan] * 3
+    return len(notas), np.mean(notas), np.std(notas), np.percentile(notas, [25, 50, 75])
+
+
+def respostas_fracionarias(rng):
+    # Como as médias por pergunta de uma empresa: notas e pesos médios fracionários
+    return {
+        var: [(rng.uniform(0, 5), rng.choice([0.1, 0.15, rng.uniform(0.05, 0.2)])) for _ in lista]
+        for var, lista in perguntas.items()
+    }
+
+
+def test_arredondar_exato_igual_ao_round():
+    rng = np.random.default_rng(7)
+    valores = np.concatenate([
+        rng.random(100_000),
+        np.round(rng.random(20_000), 4) + 0.0005,  # muitos valores na metade da 3ª casa
+        [0.0625, 0.5535, -0.0625, 0.0, 1.0, np.nan],
+    ])
+    esperado = [round(float(v), 3) for v in valores]
+    obtido = arredondar_exato(valores)
+    np.testing.assert_array_equal(obtido, esperado)
+
+
+@pytest.mark.parametrize("semente", range(5))
+def test_funcoes_escalares_iguais_ao_original(semente):
+    rng = random.Random(semente)
+    for _ in range(400):
+        respostas = respostas_fracionarias(rng)
+        medias = calcular_medias(respostas)
+        assert medias == medias_original(respostas)
+        assert calcular_rexp(medias) == rexp_original(medias)
+        assert calcular_dimensoes(medias) == dimensoes_original(medias)
+
+        # Médias na grade de 3 casas: as combinações das dimensões caem com frequência na metade
+        medias_grade = {var: round(rng.random(), 3) for var in perguntas}
+        assert calcular_dimensoes(medias_grade) == dimensoes_original(medias_grade)
+        assert calcular_rexp(medias_grade) == rexp_original(medias_grade)
+
+
+def test_lote_igual_ao_original():
+    rng = random.Random(42)
+    lista = [respostas_fracionarias(rng) for _ in range(500)]
+    pontuacao = pontuar_respostas(lista)
+    for n, respostas in enumerate(lista):
+        medias = medias_original(respostas)
+        assert dict(zip(pontuacao["variaveis"], pontuacao["medias"][n].tolist())) == medias
+        assert pontuacao["rexp"][n] == rexp_original(medias)
+        assert dict(zip(DIMENSOES, pontuacao["valores_dimensoes"][n].tolist())) == dimensoes_original(medias)
+
+
+def test_estatisticas_histogramas_iguais_ao_original():
+    rng = np.random.default_rng(11)
+    contagens = np.concatenate([
+        rng.integers(0, 4, size=(300, 6)),
+        rng.integers(0, 200, size=(300, 6)),
+        rng.integers(0, 2, size=(300, 6)) * rng.integers(0, 50, size=(300, 6)),  # notas ausentes
+        np.eye(6, dtype=int),  # um único respondente
+        np.zeros((1, 6), dtype=int),  # pergunta sem respostas
+    ])
+    estatisticas = estatisticas_histogramas(contagens)
+    for n, histograma in enumerate(contagens):
+        respondentes, media, desvio, quartis = estatisticas_original(histograma)
+        assert estatisticas["respondentes"][n] == respondentes
+        np.testing.assert_allclose(estatisticas["media"][n], media, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(estatisticas["desvio"][n], desvio, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(estatisticas["quartis"][n], quartis, rtol=0, atol=1e-12)
@@ -0,0 +1,122 @@
+"""
+Cache dos resumos em streaming (src/resumo.py) com um cliente falso da OpenAI: só um stream
+completo é guardado no LRU e em resumos_cache; um stream que falha ou é interrompido por quem
+o consome não deixa resumo parcial em nenhum dos dois níveis.
+"""
+
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from src import resumo
+
+MENSAGENS = [{"role": "user", "content": "Diagnóstico da empresa de teste"}]
+
+
+def chunk(texto):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=texto))])
+
+
+class ClienteFalso:
+    """
+    Imita cliente.chat.completions.create(stream=True): entrega os trechos e, se `erro`
+    for informado, levanta a exceção depois deles.
+    """
+
+    def __init__(self, trechos, erro=None):
+        self.trechos = trechos
+        self.erro = erro
+        self.chamadas = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **parametros):
+        assert parametros["stream"] is True
+        self.chamadas += 1
+
+        def stream():
+            yield SimpleNamespace(choices=[])  # chunk sem escolhas, como o de uso de tokens
+            for trecho in self.trechos:
+                yield chunk(trecho)
+            if self.erro is not None:
+                raise self.erro
+        return stream()
+
+
+class CursorFalso:
+    def __init__(self, comandos):
+        self.comandos = comandos
+
+    def execute(self, sql, params=None):
+        self.comandos.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def comandos_banco(monkeypatch):
+    """
+    Cache novo, com o nível do banco apontado para uma conexão falsa que registra os comandos.
+    """
+    comandos = []
+
+    @contextmanager
+    def conexao():
+        yield SimpleNamespace(cursor=lambda: CursorFalso(comandos))
+
+    monkeypatch.setattr(resumo, "cache_resumos", resumo.CacheResumos())
+    monkeypatch.setattr(resumo, "usa_postgres", lambda: True)
+    monkeypatch.setattr(resumo.CacheResumos, "_garantir_tabela", lambda self: None)
+    monkeypatch.setattr(resumo.db, "conexao", conexao)
+    return comandos
+
+
+def gravacoes(comandos):
+    return [comando for comando in comandos if comando.startswith("INSERT INTO resumos_cache")]
+
+
+def test_stream_completo_vai_para_os_dois_niveis(comandos_banco):
+    cliente = ClienteFalso(["Resumo ", "completo."])
+    assert list(resumo.gerar_resumo_stream(MENSAGENS, empresa="Acme", cliente=cliente)) == ["Resumo ", "completo."]
+    assert len(gravacoes(comandos_banco)) == 1
+
+    # A segunda chamada vem do LRU, sem chamar a API
+    assert list(resumo.gerar_resumo_stream(MENSAGENS, cliente=cliente)) == ["Resumo completo."]
+    assert cliente.chamadas == 1
+
+
+def test_stream_com_erro_nao_guarda_parcial(comandos_banco):
+    cliente = ClienteFalso(["Resumo ", "pela "], erro=ConnectionError("conexão encerrada"))
+    recebidos = []
+    with pytest.raises(ConnectionError):
+        for trecho in resumo.gerar_resumo_stream(MENSAGENS, empresa="Acme", cliente=cliente):
+            recebidos.append(trecho)
+    assert recebidos == ["Resumo ", "pela "]
+    assert gravacoes(comandos_banco) == []
+    assert resumo.cache_resumos._memoria == {}
+
+    # A próxima chamada vai à API de novo e guarda o resumo completo
+    cliente = ClienteFalso(["Resumo ", "completo."])
+    assert "".join(resumo.gerar_resumo_stream(MENSAGENS, empresa="Acme", cliente=cliente)) == "Resumo completo."
+    assert cliente.chamadas == 1
+    assert len(gravacoes(comandos_banco)) == 1
+
+
+def test_stream_interrompido_nao_guarda_parcial(comandos_banco):
+    # Quem consome desiste no meio (ex.: o usuário sai da página e o rerun descarta o gerador)
+    gerador = resumo.gerar_resumo_stream(MENSAGENS, cliente=ClienteFalso(["Resumo ", "pela ", "metade"]))
+    assert next(gerador) == "Resumo "
+    gerador.close()
+    assert gravacoes(comandos_banco) == []
+    assert resumo.cache_resumos._memoria == {}
+    assert resumo.cache_resumos.obter(resumo.chave_resumo(MENSAGENS)) is None
+
+
+def test_stream_vazio_nao_guarda(comandos_banco):
+    assert list(resumo.gerar_resumo_stream(MENSAGENS, cliente=ClienteFalso([]))) == []
+    assert gravacoes(comandos_banco) == []
+    assert resumo.cache_resumos._memoria == {}
@@ -0,0 +1,92 @@
+"""
+O Rexp é multilinear nas notas: o ganho previsto por src/sensibilidade.py ao subir uma
+pergunta deve ser igual ao obtido pontuando de novo (pontuar_lote) as respostas alteradas.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from src.calculos import matrizes_respostas, pontuar_lote
+from src.perguntas import perguntas
+from src.sensibilidade import cenario, efeitos_lote, ganhos_lote, pontos_alavanca, simular_cenarios
+
+
+def notas_aleatorias(rng, quantidade):
+    # Notas inteiras e pesos fracionários por diagnóstico, como nas médias de uma empresa
+    notas = rng.integers(0, 6, size=(quantidade, 70)).astype(float)
+    pesos = rng.uniform(0.05, 0.2, size=(quantidade, 70))
+    return notas, pesos
+
+
+def rexp_exato(notas, pesos):
+    return pontuar_lote(notas, pesos, arredondar=False)["rexp"]
+
+
+@pytest.mark.parametrize("pontos", [1.0, 2.5])
+def test_ganhos_iguais_a_pontuar_de_novo(pontos):
+    notas, pesos = notas_aleatorias(np.random.default_rng(5), 40)
+    base = rexp_exato(notas, pesos)
+    efeitos = efeitos_lote(notas, pesos)
+    ganhos = ganhos_lote(notas, pesos, pontos)
+    for j in range(notas.shape[1]):
+        novas = notas.copy()
+        novas[:, j] = np.minimum(novas[:, j] + pontos, 5)
+        esperado = rexp_exato(novas, pesos) - base
+        np.testing.assert_allclose(ganhos[:, j], esperado, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(efeitos[:, j] * (novas[:, j] - notas[:, j]), esperado, rtol=0, atol=1e-12)
+    # Pergunta já na nota máxima não tem ganho
+    assert (ganhos[notas == 5] == 0).all()
+
+
+def test_efeitos_com_pesos_padrao():
+    notas, _ = notas_aleatorias(np.random.default_rng(6), 10)
+    _, pesos = matrizes_respostas([{}] * len(notas))
+    np.testing.assert_array_equal(efeitos_lote(notas), efeitos_lote(notas, pesos))
+
+
+def test_simular_cenarios_igual_a_pontuar_de_novo():
+    notas, pesos = notas_aleatorias(np.random.default_rng(8), 30)
+    cenarios = np.array([
+        np.zeros(70),
+        cenario(["If3", "Cm1"]),
+        cenario({"DREq2": 2, "Pv10": -1}),
+        cenario(["Lc1", "Im4", "Et7"], pontos=5),
+    ])
+    rexp = simular_cenarios(notas, cenarios, pesos)
+    assert rexp.shape == (len(cenarios), len(notas))
+    for s, aumentos in enumerate(cenarios):
+        novas = np.clip(notas + aumentos, 0, 5)
+        np.testing.assert_array_equal(rexp[s], pontuar_lote(novas, pesos)["rexp"])
+
+    with pytest.raises(Exception):
+        cenario(["Xx1"])
+
+
+def test_pontos_alavanca_igual_a_pontuar_de_novo():
+    rng = random.Random(9)
+    respostas = {var: [(rng.randint(0, 5), peso) for _, peso in lista] for var, lista in perguntas.items()}
+    notas, pesos = matrizes_respostas([respostas])
+    base = rexp_exato(notas, pesos)[0]
+    rotulos = [f"{var}{i}" for var, lista in perguntas.items() for i in range(1, len(lista) + 1)]
+
+    alavancas = pontos_alavanca(respostas, maximo=8)
+    assert 0 < len(alavancas) <= 8
+    ganhos = [alavanca["ganho"] for alavanca in alavancas]
+    assert ganhos == sorted(ganhos, reverse=True) and ganhos[-1] > 0
+    for alavanca in alavancas:
+        j = rotulos.index(alavanca["pergunta"])
+        assert alavanca["nota"] == notas[0, j] < 5
+        novas = notas.copy()
+        novas[0, j] += 1
+        assert alavanca["ganho"] == pytest.approx(rexp_exato(novas, pesos)[0] - base, abs=1e-12)
+        assert alavanca["efeito"] == pytest.approx(alavanca["ganho"], abs=1e-12)
+
+    # Nenhuma pergunta fora da lista tem ganho maior que a última alavanca
+    todos = ganhos_lote(notas, pesos)[0]
+    fora = [todos[j] for j, rotulo in enumerate(rotulos) if rotulo not in {a["pergunta"] for a in alavancas}]
+    assert max(fora) <= ganhos[-1]
+
+    # Diagnóstico já na nota máxima: nada a alavancar
+    assert pontos_alavanca({var: [(5, peso) for _, peso in lista] for var, lista in perguntas.items()}) == []